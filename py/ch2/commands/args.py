@@ -155,6 +155,7 @@ PATH = 'path'
 PATTERN = 'pattern'
 PERMANENT = 'permanent'
 PLAN = 'plan'
+POOL = 'pool'
 PREVIOUS = 'previous'
 PRINT = 'print'
 PROCESS = 'process'
@@ -318,6 +319,8 @@ def make_parser(with_noop=False):
                          help='run only matching pipeline classes')
     process.add_argument(mm(WORKER), metavar='ID', type=int,
                          help='internal use only (identifies sub-process workers)')
+    process.add_argument(mm(POOL), action='store_true',
+                         help=f'internal use only (tasks for {mm(WORKER)} are read from stdin)')
     process.add_argument(ARG, nargs='*', metavar='WORKER_ARG',
                          help=f'internal use only (tasks for {mm(WORKER)})')
 
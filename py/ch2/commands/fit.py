@@ -5,7 +5,7 @@ from .args import PATH, SUB_COMMAND, AFTER_BYTES, LIMIT_BYTES, AFTER_RECORDS, LI
     RECORDS, ALL_FIELDS, INTERNAL, ALL_MESSAGES, MESSAGE, FIELD, VALIDATE, MAX_DELTA_T, WARN, TABLES, PATTERN, \
     COMPACT, CONTEXT, NOT, MATCH, CSV, TOKENS, FIELDS
 from ..common.args import no
-from ..fit.profile.profile import read_fit
+from ..fit.profile.profile import map_fit
 from ..fit.summary import summarize_records, summarize_tables, summarize_grep, summarize_csv, summarize_tokens, \
     summarize_fields
 from ..common.io import terminal_width
@@ -68,47 +68,46 @@ finish and paths start.
             print()
             print(name_file)
 
-        data = read_fit(file_path)
-
-        if format == RECORDS:
-            summarize_records(data,
-                              all_fields=args[ALL_FIELDS], all_messages=args[ALL_MESSAGES],
+        with map_fit(file_path) as data:
+            if format == RECORDS:
+                summarize_records(data,
+                                  all_fields=args[ALL_FIELDS], all_messages=args[ALL_MESSAGES],
+                                  internal=args[INTERNAL], after_bytes=after_bytes, limit_bytes=limit_bytes,
+                                  after_records=after_records, limit_records=limit_records,
+                                  record_names=args[MESSAGE], field_names=args[FIELD],
+                                  warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
+                                  width=args[WIDTH] or terminal_width())
+            elif format == TABLES:
+                summarize_tables(data,
+                                 all_fields=args[ALL_FIELDS], all_messages=args[ALL_MESSAGES],
+                                 internal=args[INTERNAL], after_bytes=after_bytes, limit_bytes=limit_bytes,
+                                 after_records=after_records, limit_records=limit_records,
+                                 record_names=args[MESSAGE], field_names=args[FIELD],
+                                 warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
+                                 width=args[WIDTH] or terminal_width())
+            elif format == CSV:
+                summarize_csv(data,
                               internal=args[INTERNAL], after_bytes=after_bytes, limit_bytes=limit_bytes,
                               after_records=after_records, limit_records=limit_records,
                               record_names=args[MESSAGE], field_names=args[FIELD],
-                              warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
-                              width=args[WIDTH] or terminal_width())
-        elif format == TABLES:
-            summarize_tables(data,
-                             all_fields=args[ALL_FIELDS], all_messages=args[ALL_MESSAGES],
-                             internal=args[INTERNAL], after_bytes=after_bytes, limit_bytes=limit_bytes,
-                             after_records=after_records, limit_records=limit_records,
-                             record_names=args[MESSAGE], field_names=args[FIELD],
-                             warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
-                             width=args[WIDTH] or terminal_width())
-        elif format == CSV:
-            summarize_csv(data,
-                          internal=args[INTERNAL], after_bytes=after_bytes, limit_bytes=limit_bytes,
-                          after_records=after_records, limit_records=limit_records,
-                          record_names=args[MESSAGE], field_names=args[FIELD],
-                          warn=warn, max_delta_t=max_delta_t)
-        elif format == GREP:
-            summarize_grep(data, args[PATTERN],
-                           after_bytes=after_bytes, limit_bytes=limit_bytes,
-                           after_records=after_records, limit_records=limit_records,
-                           warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
-                           width=args[WIDTH] or terminal_width(),
-                           name_file=name_file, match=args[MATCH], compact=args[COMPACT],
-                           context=args[CONTEXT], invert=args[NOT])
-        elif format == TOKENS:
-            summarize_tokens(data,
-                             after_bytes=after_bytes, limit_bytes=limit_bytes,
-                             after_records=after_records, limit_records=limit_records,
-                             warn=warn, no_validate=no_validate, max_delta_t=max_delta_t)
-        elif format == FIELDS:
-            summarize_fields(data,
-                             after_bytes=after_bytes, limit_bytes=limit_bytes,
-                             after_records=after_records, limit_records=limit_records,
-                             warn=warn, no_validate=no_validate, max_delta_t=max_delta_t)
-        else:
-            raise Exception('Bad format: %s' % format)
+                              warn=warn, max_delta_t=max_delta_t)
+            elif format == GREP:
+                summarize_grep(data, args[PATTERN],
+                               after_bytes=after_bytes, limit_bytes=limit_bytes,
+                               after_records=after_records, limit_records=limit_records,
+                               warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
+                               width=args[WIDTH] or terminal_width(),
+                               name_file=name_file, match=args[MATCH], compact=args[COMPACT],
+                               context=args[CONTEXT], invert=args[NOT])
+            elif format == TOKENS:
+                summarize_tokens(data,
+                                 after_bytes=after_bytes, limit_bytes=limit_bytes,
+                                 after_records=after_records, limit_records=limit_records,
+                                 warn=warn, no_validate=no_validate, max_delta_t=max_delta_t)
+            elif format == FIELDS:
+                summarize_fields(data,
+                                 after_bytes=after_bytes, limit_bytes=limit_bytes,
+                                 after_records=after_records, limit_records=limit_records,
+                                 warn=warn, no_validate=no_validate, max_delta_t=max_delta_t)
+            else:
+                raise Exception('Bad format: %s' % format)
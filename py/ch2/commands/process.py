@@ -1,7 +1,7 @@
 
 from logging import getLogger
 
-from .args import LIKE, WORKER, ARG, parse_pairs, KARG, FORCE, CPROFILE
+from .args import LIKE, WORKER, ARG, parse_pairs, KARG, FORCE, CPROFILE, POOL
 from ..common.args import mm
 from ..pipeline.process import run_pipeline
 from ..sql.tables.pipeline import PipelineType
@@ -26,10 +26,15 @@ Delete statistics and then calculate new values.
 Calculate activity statistics from 2020 onwards in a single process for debugging.
     '''
     args = config.args
-    if bool(args[WORKER]) != bool(args[ARG]):
+    if args[POOL]:
+        if not args[WORKER] or args[ARG]:
+            raise Exception(f'{mm(POOL)} should be used with {mm(WORKER)} and no arguments')
+    elif bool(args[WORKER]) != bool(args[ARG]):
         raise Exception(f'{mm(WORKER)} and arguments should be used together')
     if args[LIKE] and args[WORKER]:
         raise Exception(f'{mm(LIKE)} cannot be used with {mm(WORKER)}')
+    kargs = parse_pairs(args[KARG])
+    if args[WORKER]:
+        kargs[POOL] = args[POOL]
     run_pipeline(config, PipelineType.PROCESS, *args[ARG],
-                 like=args[LIKE], worker=args[WORKER], cprofile=args[CPROFILE],
-                 **parse_pairs(args[KARG]))
+                 like=args[LIKE], worker=args[WORKER], cprofile=args[CPROFILE], **kargs)
@@ -1,7 +1,8 @@
 
 from .constraint import constrained_sources
 from .frame import session, nearby_activities, bookmarks, present, linear_resample_time, \
-    groups_by_time, transform, drop_empty, read_query
+    groups_by_time, transform, drop_empty, read_query, read_query_chunks, \
+    label_by_intervals, mean_by_intervals
 from .heart_rate import *
 from .lib import chisq, fit, inplace_decay
 from .plot import col_to_boxstats, box_plot, line_plotter, dot_plotter, bar_plotter, add_climbs, multi_plot, \
@@ -0,0 +1,133 @@
+from logging import getLogger
+from os import makedirs, replace, remove, listdir
+from os.path import join, exists, splitext
+from tempfile import mkstemp
+
+import numpy as np
+import pandas as pd
+
+from ..commands.args import base_system_path
+from ..sql import Timestamp, Source
+from ..sql.types import short_cls
+
+log = getLogger(__name__)
+
+FRAME_DIR = 'frame'
+FRAME_CACHE = 'frame-cache'  # key in session.info (see data.frame.session)
+
+
+def to_us(times):
+    return pd.to_datetime(times, utc=True).asi8 // 1000
+
+
+class ActivityFrame:
+    '''
+    The numeric statistics loaded for a single source, as a grid of values (NaN where missing), with
+    a row for each time and a column for each statistic name id.
+    '''
+
+    def __init__(self, source_id, times, ids, values):
+        self.source_id = source_id
+        self.times = times
+        self.ids = ids
+        self.values = values
+        self.__columns = {id: k for k, id in enumerate(ids.tolist())}
+
+    def __contains__(self, statistic_name_id):
+        return statistic_name_id in self.__columns
+
+    def rows(self, statistic_name_ids, dtype):
+        '''
+        (time, name id, source id, value) for the given statistics, ordered by time (as read from the database).
+        '''
+        values = self.values[:, [self.__columns[id] for id in statistic_name_ids]]
+        row, col = np.nonzero(~np.isnan(values))
+        return (self.times[row], np.array(statistic_name_ids, dtype=np.int64)[col],
+                np.full(len(row), self.source_id, dtype=np.int64), values[row, col].astype(dtype))
+
+
+class ActivityFrameCache:
+    '''
+    Numeric statistics for each activity, saved (as a single npz file per activity) when the activity
+    is read, so that later reads do not need to query the database.
+
+    Each file contains the id and time of the reader's Timestamp.  That is cleared when the activity is
+    re-read, or deleted (cascade) with the activity, so a file is used only while it matches the database
+    (and removed when found to be stale).  Files for sources that no longer exist are removed by prune().
+    '''
+
+    def __init__(self, base):
+        self.__dir = base_system_path(base, subdir=FRAME_DIR, create=False)
+        self.hits = 0
+        self.misses = 0
+
+    def __path(self, source_id):
+        return join(self.__dir, f'{source_id}.npz')
+
+    @staticmethod
+    def __key(s, owner, source):
+        timestamp = Timestamp.get(s, owner, source=source)
+        return [source.id, timestamp.id, int(to_us([timestamp.time])[0])] if timestamp else None
+
+    def write(self, s, source, owner, loader):
+        '''
+        Save the float and integer values just loaded by the loader (after loader.load()).
+        '''
+        key = self.__key(s, owner, source)
+        if key is None:
+            log.warning(f'No timestamp for {source.id} so not caching frame')
+            return
+        columns = [(statistic_name.id, to_us(times), values) for statistic_name, times, values in loader.numeric()]
+        if not columns: return
+        times = np.unique(np.concatenate([column_times for _, column_times, _ in columns]))
+        values = np.full((len(times), len(columns)), np.nan)
+        for k, (_, column_times, column_values) in enumerate(columns):
+            values[np.searchsorted(times, column_times), k] = column_values
+        makedirs(self.__dir, exist_ok=True)
+        # write to a temporary file and rename so that readers never see a partial file
+        fd, tmp_path = mkstemp(dir=self.__dir, suffix='.tmp')
+        try:
+            with open(fd, 'wb') as output:
+                np.savez(output, key=np.array(key), owner=np.array(short_cls(owner)), times=times,
+                         ids=np.array([id for id, _, _ in columns], dtype=np.int64), values=values)
+            replace(tmp_path, self.__path(source.id))
+        except:
+            if exists(tmp_path): remove(tmp_path)
+            raise
+        log.debug(f'Cached {len(columns)} statistics for {source.id}')
+
+    def read(self, s, source):
+        '''
+        The cached frame for the source, or None if missing or stale.
+        '''
+        path = self.__path(source.id)
+        if exists(path):
+            try:
+                with np.load(path) as data:
+                    if data['key'].tolist() == self.__key(s, str(data['owner']), source):
+                        self.hits += 1
+                        return ActivityFrame(source.id, data['times'], data['ids'], data['values'])
+                log.debug(f'Stale frame for {source.id}')
+            except Exception as e:
+                log.warning(f'Could not read {path}: {e}')
+            self.delete(source.id)
+        self.misses += 1
+        return None
+
+    def delete(self, source_id):
+        path = self.__path(source_id)
+        if exists(path): remove(path)
+
+    def prune(self, s):
+        '''
+        Delete files whose source is no longer in the database (eg deleted activities, which are otherwise
+        never read again).
+        '''
+        if not exists(self.__dir): return 0
+        ids = [int(root) for root, extn in map(splitext, listdir(self.__dir)) if extn == '.npz' and root.isdigit()]
+        existing = set(id for (id,) in s.query(Source.id).all())
+        orphans = [id for id in ids if id not in existing]
+        for id in orphans:
+            self.delete(id)
+        if orphans: log.info(f'Deleted {len(orphans)} orphan frame files')
+        return len(orphans)
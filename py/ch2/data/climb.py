@@ -4,7 +4,7 @@ from collections import namedtuple
 from itertools import groupby
 from logging import getLogger
 
-from .frame import linear_resample, present
+from .frame import linear_resample, present, mean_by_intervals
 from ..common.math import is_nan
 from ..lib.data import nearest_index, get_index_loc, safe_yield, safe_none
 from ..names import Names as N
@@ -173,16 +173,16 @@ def climbs_for_activity(s, ajournal):
 
 @safe_none
 def add_climb_stats(df, climbs):
-    for climb in climbs:
-        finish = climb[N.TIME]
-        start = finish - dt.timedelta(seconds=climb[N.CLIMB_TIME])
-        if N.POWER_ESTIMATE in df.columns:
-            # mean() returns a series!
-            power = df.loc[start:finish, [N.POWER_ESTIMATE]].mean()[0]
+    if N.POWER_ESTIMATE in df.columns:
+        finishes = [climb[N.TIME] for climb in climbs]
+        starts = [finish - dt.timedelta(seconds=climb[N.CLIMB_TIME]) for finish, climb in zip(finishes, climbs)]
+        # climbs may touch or overlap, so each mean uses all its rows (as .loc[start:finish])
+        powers = mean_by_intervals(df[N.POWER_ESTIMATE], starts, finishes)
+        for power, climb in zip(powers, climbs):
             if not is_nan(power):
                 climb[N.CLIMB_POWER] = power
             else:
                 log.warning(f'Invalid {N.POWER_ESTIMATE} in climb data')
-        else:
+    else:
+        for climb in climbs:
             log.warning(f'Missing {N.POWER_ESTIMATE} in climb data')
-
@@ -3,9 +3,12 @@ from re import compile
 
 import numpy as np
 import pandas as pd
+from pandas.api.types import is_datetime64tz_dtype
 from sqlalchemy import inspect
 
+from .cache import ActivityFrameCache, FRAME_CACHE
 from .coasting import CoastingBookmark
+from ..commands.args import BASE
 from ..lib.data import kargs_to_attr
 from ..names import Names as N, like
 from ..sql import StatisticName, StatisticJournal, StatisticJournalInteger, ActivityJournal, \
@@ -15,14 +18,126 @@ from ..sql.database import connect, ActivityTimespan, ActivityBookmark, Composit
 
 log = getLogger(__name__)
 
+STREAM_ROWS = 10000
 
 
-def read_query(query, index=None):
+
+def read_query(query, index=None, stream=False, rows=STREAM_ROWS):
     '''
     Convert s.query(OrmClass) to a dataframe
     https://stackoverflow.com/questions/29525808/sqlalchemy-orm-conversion-to-pandas-dataframe
+
+    With stream, the frame is built from chunks of `rows` rows, read with a server-side cursor, so
+    the full result set is never held by the client as row objects.  The chunks are still concatenated,
+    so peak memory is a few times the size of the final frame (rather than the many times needed for
+    row objects).  Callers that need memory bounded by `rows` must use read_query_chunks.
+    '''
+    if stream:
+        chunks = list(read_query_chunks(query, index=index, rows=rows))
+        if len(chunks) == 1:
+            return chunks[0]
+        else:
+            # chunks with only missing values may be objects; without an index, number rows as read_sql
+            return pd.concat(chunks, ignore_index=index is None).infer_objects()
+    else:
+        return pd.read_sql(query.statement, query.session.bind, index_col=index)
+
+
+def read_query_chunks(query, index=None, rows=STREAM_ROWS):
+    '''
+    As read_query, but yield a dataframe for each chunk of (up to) `rows` rows (at least one, which may
+    be empty).
+    '''
+    result = execute_streamed(query, rows=rows)
+    columns, empty = result.keys(), True
+    for chunk in fetch_chunks(result, rows=rows):
+        empty = False
+        yield records_to_frame(chunk, columns, index=index)
+    if empty:
+        yield records_to_frame([], columns, index=index)
+
+
+def records_to_frame(records, columns, index=None):
+    df = pd.DataFrame.from_records(records, columns=columns, coerce_float=True)
+    # as pd.read_sql
+    for column in df.columns:
+        if is_datetime64tz_dtype(df[column].dtype):
+            df[column] = pd.to_datetime(df[column], utc=True)
+    return df.set_index(index) if index else df
+
+
+def execute_streamed(query, rows=STREAM_ROWS):
+    '''
+    Execute the query with a server-side (named) cursor.
+    '''
+    return query.session.connection(). \
+        execution_options(stream_results=True, max_row_buffer=rows).execute(query.statement)
+
+
+def fetch_chunks(result, rows=STREAM_ROWS):
+    '''
+    Lists of (up to) `rows` rows, as plain tuples, from a result.
+    '''
+    try:
+        while True:
+            chunk = result.fetchmany(rows)
+            if not chunk: break
+            yield [tuple(row) for row in chunk]
+    finally:
+        result.close()
+
+
+def label_by_intervals(index, starts, finishes, labels, default=np.nan):
+    '''
+    An array with a value for each entry in the (pandas) index: the label of the interval that contains it,
+    or default.
+
+    Intervals include both start and finish (as .loc[start:finish]), and later intervals take precedence
+    where they overlap.  All intervals are located with a single searchsorted, so this replaces a loop
+    of .loc assignments.
+    '''
+    labels = np.asarray(labels)
+    result = np.full(len(index), default, dtype=object if labels.dtype == object else
+                     np.result_type(labels, default))
+    if not len(labels) or not len(index):
+        return result
+    order = None if index.is_monotonic_increasing else index.argsort(kind='stable')
+    if order is not None: index = index[order]
+    firsts = index.searchsorted(pd.Index(list(starts)), side='left')
+    lasts = index.searchsorted(pd.Index(list(finishes)), side='right')
+    lengths = np.maximum(lasts - firsts, 0)
+    # each row in each interval, then the last interval that contains each row
+    owners = np.repeat(np.arange(len(labels)), lengths)
+    rows = np.repeat(firsts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+    winners = np.full(len(index), -1, dtype=np.int64)
+    np.maximum.at(winners, rows, owners)
+    found = np.nonzero(winners >= 0)[0]
+    result[found if order is None else order[found]] = labels[winners[found]]
+    return result
+
+
+def mean_by_intervals(series, starts, finishes):
+    '''
+    An array with the mean of the (non-NaN) values in each interval (NaN if none).
+
+    Intervals include both start and finish (as .loc[start:finish].mean()) and each is independent, so
+    overlapping intervals share rows.  Means are found from cumulative sums (so may differ from .mean()
+    by rounding), which replaces a loop of .loc slices.
     '''
-    return pd.read_sql(query.statement, query.session.bind, index_col=index)
+    starts, finishes = list(starts), list(finishes)
+    if not starts:
+        return np.array([], dtype=float)
+    if not series.index.is_monotonic_increasing:
+        series = series.sort_index(kind='stable')
+    values = series.values.astype(float)
+    valid = ~np.isnan(values)
+    sums = np.concatenate([[0], np.cumsum(np.where(valid, values, 0))])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    firsts = series.index.searchsorted(pd.Index(starts), side='left')
+    lasts = np.maximum(series.index.searchsorted(pd.Index(finishes), side='right'), firsts)
+    n = counts[lasts] - counts[firsts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n > 0, (sums[lasts] - sums[firsts]) / n, np.nan)
 
 
 def session(*args):
@@ -30,7 +145,9 @@ def session(*args):
     Create a database session (used in Jupyter templates)
     '''
     ns, db = connect(args)
-    return db.session()
+    s = db.session()
+    s.info[FRAME_CACHE] = ActivityFrameCache(ns[BASE])
+    return s
 
 
 def _tables():
@@ -1,13 +1,15 @@
+from collections import defaultdict
 from logging import getLogger
 import datetime as dt
 
 import numpy as np
 import pandas as pd
 import pytz
-from sqlalchemy import asc, desc, distinct
+from sqlalchemy import asc, desc, distinct, cast, func, BigInteger
 from sqlalchemy.orm import aliased
 
-from ch2.data import read_query
+from .frame import read_query, execute_streamed, fetch_chunks, label_by_intervals
+from .cache import FRAME_CACHE
 from ..common.date import YMD, format_seconds
 from ..data import session, present
 from ..lib import local_date_to_time, to_date, time_to_local_time
@@ -17,22 +19,33 @@ from ..names import Names as N, like, MED_WINDOW, SPACE
 from ch2.common.names import TIME_ZERO
 from ..sql import StatisticName, ActivityGroup, StatisticJournal, ActivityTimespan, ActivityJournal, Source, \
     ActivityTopic
-from ..sql.tables.statistic import STATISTIC_JOURNAL_CLASSES
+from ..sql.tables.statistic import STATISTIC_JOURNAL_CLASSES, StatisticJournalInteger, StatisticJournalFloat, \
+    StatisticJournalText
 from ..sql.types import short_cls
 
 log = getLogger(__name__)
 
+BULK_TYPES = {StatisticJournalInteger: np.int64, StatisticJournalFloat: float, StatisticJournalText: object}
+
 
 class Statistics:
 
     def __init__(self, s, start=None, finish=None, sources=None, with_timespan=False, with_source=False,
-                 activity_journal=None, activity_group=None, bookmarks=None, warn_over=1):
+                 activity_journal=None, activity_group=None, bookmarks=None, warn_over=1, bulk=False,
+                 frame_cache=None):
         '''
         Specify any general constraints when constructing the object, then request particular statistics
         using by_name and by_group.
 
+        With bulk, statistics requested by by_name are retrieved together, when the dataframe is needed,
+        with one query per journal type, and pivoted into columns (instead of a query and join per name).
+        For a single source, statistics in the frame_cache are read from disk instead.
+
         The activity_group argument is used only to constrain any activity_journal (which may be given by date).
 
+        With bookmarks, data are read for the bookmarked activities and only rows within a bookmark are
+        kept, with the bookmark id in the Bookmark column.
+
         The final dataframe can be retrieved directly via df or, via with_, additional processing can
         be made to rename columns, add statistics, etc.
         '''
@@ -44,13 +57,19 @@ class Statistics:
             if not isinstance(activity_journal, Source):
                 activity_journal = ActivityJournal.at(s, activity_journal, activity_group=activity_group)
             self.__sources.append(activity_journal)
+        self.__bookmarks = list(bookmarks) if bookmarks else []
+        for bookmark in self.__bookmarks:
+            if bookmark.activity_journal not in self.__sources:
+                self.__sources.append(bookmark.activity_journal)
         self.__with_timespan = with_timespan
         self.__with_source = with_source
         self.__activity_group = activity_group
         self.__warn_over = warn_over
+        self.__bulk = bulk
+        self.__frame_cache = frame_cache
+        self.__pending = []
         self.__statistic_names = {}
         self.__df = None
-        if bookmarks: raise Exception('TODO')
 
     def __save_name(self, statistic_name):
         if statistic_name.name in self.__statistic_names:
@@ -87,13 +106,16 @@ class Statistics:
     def by_name(self, owner, *names, like=False):
         for name in names:
             for statistic_name, type_class in self.__name_and_type(name, owner, like):
+                if self.__bulk and type_class in BULK_TYPES:
+                    self.__pending.append((statistic_name, type_class))
+                    continue
                 label = statistic_name.name
                 log.info(f'Retrieving {label}')
                 q = self.__s.query(*self.__columns(type_class, label)). \
                     filter(type_class.statistic_name_id == statistic_name.id)
                 q = self.__constrain_journal(q).order_by(N.INDEX)
                 with timing(f'Slow query for {label}?\n{q}', self.__warn_over):
-                    df = read_query(q, index=N.INDEX)
+                    df = read_query(q, index=N.INDEX, stream=True)
                 self.__merge(df)
         return self
 
@@ -121,7 +143,7 @@ class Statistics:
                         filter(Source.activity_group_id == activity_group_id)
                     q = self.__constrain_journal(q).order_by(N.INDEX)
                     with timing(f'Slow query for {label}?\n{q}', self.__warn_over):
-                        df = read_query(q, index=N.INDEX)
+                        df = read_query(q, index=N.INDEX, stream=True)
                     self.__merge(df)
         return self
 
@@ -137,6 +159,94 @@ class Statistics:
                 filter(source.activity_group_id == self.__activity_group.id)
         return q
 
+    def __retrieve_pending(self):
+        '''
+        Retrieve all pending statistics, with one (streamed) query per journal type, then pivot the
+        (time, name, value) rows into a single frame.
+        '''
+        by_type = defaultdict(list)
+        for statistic_name, type_class in self.__pending:
+            by_type[type_class].append(statistic_name)
+        times, columns = [], {}
+        frame = self.__cached_frame()
+        for type_class, statistic_names in by_type.items():
+            parts, queried = [], [statistic_name.id for statistic_name in statistic_names]
+            if frame:
+                cached = [id for id in queried if id in frame]
+                queried = [id for id in queried if id not in frame]
+                if cached:
+                    parts.append(frame.rows(cached, BULK_TYPES[type_class]))
+            if queried:
+                names = [statistic_name.name for statistic_name in statistic_names if statistic_name.id in queried]
+                log.info(f'Retrieving {", ".join(names)}')
+                q = self.__s.query(cast(func.date_part('epoch', type_class.time) * 1e6, BigInteger),
+                                   type_class.statistic_name_id, type_class.source_id, type_class.value). \
+                    filter(type_class.statistic_name_id.in_(queried))
+                q = self.__constrain_journal(q)
+                with timing(f'Slow query for {type_class.__name__}?\n{q}', self.__warn_over):
+                    parts.append(self.__stream(q, type_class))
+            time, name_id, source_id, value = [np.concatenate(part) for part in zip(*parts)]
+            times.append(time)
+            columns[type_class] = (statistic_names, name_id, value, source_id)
+        times, rows = np.unique(np.concatenate(times), return_inverse=True)
+        start = 0
+        for type_class, (statistic_names, name_id, value, source_id) in columns.items():
+            finish = start + len(name_id)
+            row, ids = rows[start:finish], np.array([statistic_name.id for statistic_name in statistic_names])
+            order = np.argsort(ids)
+            col = order[np.searchsorted(ids, name_id, sorter=order)]
+            columns[type_class] = (statistic_names, self.__pivot(len(times), row, col, len(ids), value),
+                                   self.__pivot(len(times), row, col, len(ids), source_id)
+                                   if self.__with_source else None)
+            start = finish
+        data = {}
+        for statistic_name, type_class in self.__pending:
+            statistic_names, values, source_ids = columns[type_class]
+            k = statistic_names.index(statistic_name)
+            data[statistic_name.name] = values[k]
+            if self.__with_source:
+                data[N._src(statistic_name.name)] = source_ids[k]
+        self.__pending = []
+        index = pd.DatetimeIndex(pd.to_datetime(times, unit='us', utc=True), name=N.INDEX)
+        self.__merge(pd.DataFrame(data, index=index))
+
+    def __cached_frame(self):
+        '''
+        The cached frame, if all data come from a single source.
+        '''
+        if self.__frame_cache and len(self.__sources) == 1 and not (self.__start or self.__finish):
+            return self.__frame_cache.read(self.__s, self.__sources[0])
+
+    def __stream(self, q, type_class):
+        '''
+        Read (time, name id, source id, value) with a server-side cursor into arrays, chunk by chunk.
+        Times are read as integer microseconds (exact, and much faster than datetime instances).
+        '''
+        dtype = BULK_TYPES[type_class]
+        chunks = []
+        for rows in fetch_chunks(execute_streamed(q)):
+            # a single conversion for each chunk (integer values are exact as floats)
+            chunk = np.array(rows, dtype=dtype)
+            chunks.append((chunk[:, 0].astype(np.int64), chunk[:, 1].astype(np.int64),
+                           chunk[:, 2].astype(np.int64), chunk[:, 3]))
+        if chunks:
+            return [np.concatenate(chunk) for chunk in zip(*chunks)]
+        else:
+            return [np.zeros((0,), dtype=type) for type in (np.int64, np.int64, np.int64, dtype)]
+
+    @staticmethod
+    def __pivot(n_rows, row, col, n_cols, values):
+        '''
+        Place values in a (row, col) grid, in a single step, and return the columns.  Missing values are NaN;
+        integer columns with no missing values remain integers.
+        '''
+        grid = np.full((n_rows, n_cols), np.nan, dtype=object if values.dtype == object else float)
+        grid[row, col] = values
+        present = np.zeros((n_rows, n_cols), dtype=bool)
+        present[row, col] = True
+        return [grid[:, k].astype(values.dtype) if values.dtype == np.int64 and present[:, k].all() else grid[:, k]
+                for k in range(n_cols)]
+
     def __merge(self, df):
         if self.__df is None:
             self.__df = df
@@ -145,20 +255,32 @@ class Statistics:
                 self.__df = self.__df.join(df, how='outer')
 
     def __add_timespan(self):
-        self.__df[N.TIMESPAN_ID] = np.nan
-        for id, start, finish in self.__s.query(ActivityTimespan.id,
-                                                ActivityTimespan.start, ActivityTimespan.finish). \
-                filter(ActivityTimespan.activity_journal_id.in_([source.id for source in self.__sources])):
-            self.__df.loc[start:finish, [N.TIMESPAN_ID]] = id
+        timespans = self.__s.query(ActivityTimespan.id, ActivityTimespan.start, ActivityTimespan.finish). \
+            filter(ActivityTimespan.activity_journal_id.in_([source.id for source in self.__sources])). \
+            order_by(ActivityTimespan.start).all()
+        self.__df[N.TIMESPAN_ID] = self.__label(timespans)
+
+    def __add_bookmarks(self):
+        self.__df[N.BOOKMARK] = self.__label(self.__bookmarks)
+        self.__df = self.__df.loc[~self.__df[N.BOOKMARK].isna()]
+
+    def __label(self, intervals):
+        return label_by_intervals(self.__df.index, [interval.start for interval in intervals],
+                                  [interval.finish for interval in intervals], [interval.id for interval in intervals])
 
     @property
     def df(self):
+        if self.__pending:
+            self.__retrieve_pending()
         if self.__df is None:
             log.warning('Have no data!')
             self.__df = pd.DataFrame()  # if everything failed, allow code to continue with no data
         if self.__with_timespan:
             self.__add_timespan()
             self.__with_timespan = False
+        if self.__bookmarks:
+            self.__add_bookmarks()
+            self.__bookmarks = []
         return self.__df
 
     @property
@@ -329,7 +451,7 @@ def std_health_statistics(s, freq='1h'):
     return stats
 
 
-def std_activity_statistics(s, activity_journal, activity_group=None):
+def std_activity_statistics(s, activity_journal, activity_group=None, frame_cache=None):
 
     # the choice of which values have units is somewhat arbitrary, but less so than it was...
 
@@ -341,7 +463,9 @@ def std_activity_statistics(s, activity_journal, activity_group=None):
     if not isinstance(activity_journal, ActivityJournal):
         activity_journal = ActivityJournal.at(s, activity_journal, activity_group=activity_group)
 
-    stats = Statistics(s, activity_journal=activity_journal, with_timespan=True). \
+    # values read from the activity file may be cached (the session may provide a cache)
+    stats = Statistics(s, activity_journal=activity_journal, with_timespan=True, bulk=True,
+                       frame_cache=frame_cache or s.info.get(FRAME_CACHE)). \
         by_name(SegmentReader, N.LATITUDE, N.LONGITUDE, N.SPHERICAL_MERCATOR_X, N.SPHERICAL_MERCATOR_Y,
                 N.DISTANCE, N.SPEED, N.CADENCE, N.ALTITUDE, N.HEART_RATE).with_. \
         rename_with_units(N.LATITUDE, N.LONGITUDE, N.DISTANCE, N.SPEED, N.CADENCE, N.ALTITUDE, N.HEART_RATE). \
@@ -350,12 +474,12 @@ def std_activity_statistics(s, activity_journal, activity_group=None):
         copy({N.CADENCE_RPM: N.MED_CADENCE_RPM}, median=MED_WINDOW). \
         add_times().df
 
-    stats = Statistics(s, activity_journal=activity_journal). \
+    stats = Statistics(s, activity_journal=activity_journal, bulk=True). \
         by_name(ElevationCalculator, N.ELEVATION, N.GRADE).with_. \
         rename_with_units().into(stats, tolerance='1s')
 
     hr_impulse_10 = N.DEFAULT + SPACE + N.HR_IMPULSE_10
-    stats = Statistics(s, activity_journal=activity_journal). \
+    stats = Statistics(s, activity_journal=activity_journal, bulk=True). \
         by_name(ImpulseCalculator, N.HR_ZONE, hr_impulse_10).with_. \
         drop_prefix(N.DEFAULT + SPACE).into(stats, tolerance='10s', interpolate=True)
 
@@ -1,13 +1,16 @@
 
+from json import dumps, loads
 from logging import getLogger
 
 from .model import text, value
+from .views.web import rewrite_db
 from ..lib import to_date
-from ..common.date import YMD
+from ..lib.schedule import Schedule
+from ..common.date import YMD, now_local, time_to_local_date
 from ..pipeline.calculate.summary import SummaryCalculator
 from ..pipeline.display.utils import Displayer
 from ..sql.tables.pipeline import sort_pipelines
-from ..sql import StatisticJournal, Pipeline, PipelineType, StatisticName
+from ..sql import StatisticJournal, Pipeline, PipelineType, StatisticName, DiaryModel, ActivityJournal
 
 log = getLogger(__name__)
 
@@ -22,6 +25,51 @@ def read_schedule(s, schedule, date):
     yield from read_pipeline(s, date, schedule=schedule)
 
 
+def read_model(s, schedule, date, save=True):
+    '''
+    The model for a diary page (as returned to the web interface), where schedule is the frame type
+    ('d' for a single day).  Clean pages are read from DiaryModel; others are built and (if save) saved.
+    '''
+    schedule = Schedule(schedule)
+    json = DiaryModel.get(s, schedule, date)
+    if json is None:
+        model = build_model(s, schedule, date)
+        if save:
+            DiaryModel.set(s, schedule, date, dumps(model))
+        return model
+    else:
+        log.debug(f'Using saved model for {date} ({schedule})')
+        return loads(json)
+
+
+def build_model(s, schedule, date):
+    if schedule.frame_type == 'd':
+        data = read_date(s, date)
+    else:
+        data = read_schedule(s, schedule, date)
+    return rewrite_db(list(data))
+
+
+def refresh_models(s):
+    '''
+    Rebuild dirty pages, and pages for the latest activity (where the web interface starts).
+    '''
+    DiaryModel.create(s)
+    pages = set((str(schedule), start) for schedule, start in DiaryModel.dirty_pages(s))
+    latest = ActivityJournal.before_local_time(s, now_local())
+    if latest:
+        date = time_to_local_date(latest.start)
+        pages.update((schedule, Schedule(schedule).start_of_frame(date)) for schedule in 'dmy')
+    n = 0
+    for schedule, start in sorted(pages, key=lambda page: page[1]):
+        schedule = Schedule(schedule)
+        if DiaryModel.get(s, schedule, start) is None:
+            log.debug(f'Building model for {start} ({schedule})')
+            DiaryModel.set(s, schedule, start, dumps(build_model(s, schedule, start)))
+            n += 1
+    log.info(f'Rebuilt {n} diary pages')
+
+
 def summary_column(s, schedule, start, name):
     journals = StatisticJournal.at_interval(s, start, schedule, SummaryCalculator, name, SummaryCalculator)
     for named, journal in enumerate(journal for journal in journals if journal.value != 0):
@@ -0,0 +1,526 @@
+from collections import defaultdict
+from logging import getLogger
+
+import numpy as np
+
+from .tokens import State, FileHeader, Checksum, token_factory, FIELD_DESCRIPTION
+from ..profile.fields import CompositeField, DynamicField
+from ..profile.types import Date, Date16, Mapping
+from ...common.date import to_time
+
+log = getLogger(__name__)
+
+'''
+An alternative to the token-by-token parsing in read.py.
+
+The file is scanned once, reading definitions and noting where each data message starts, but decoding
+nothing else.  All the data messages for a definition are then decoded together, with numpy, into one
+column per field.  Timestamps (including compressed timestamps) and accumulated fields are resolved
+afterwards in a single pass over all messages, in file order.
+
+Values follow the record-based parser (scale and offset applied, enums mapped to profile names, composite
+fields expanded, dynamic fields resolved) except that:
+* numerical values are floats, with bad values as NaN;
+* mapped values and strings are objects, with bad values as None;
+* times are numpy datetime64 (UTC, second resolution), with bad values as NaT;
+* fields with more than one value give two dimensional columns;
+* repeated names are merged, with earlier fields taking precedence when both are valid.
+'''
+
+EPOCH = np.datetime64('1989-12-31T00:00:00', 's')
+COMPRESSED, ABSOLUTE, RELATIVE_16 = 0, 1, 2
+
+
+class Batch:
+    '''
+    The data messages that share a single Definition.
+    '''
+
+    def __init__(self, definition):
+        self.definition = definition
+        self.index = []  # position in the sequence of all data messages
+        self.offsets = []
+        self.compressed = []  # time offset from a compressed timestamp header (or -1)
+
+
+def scan(data, state, no_validate=False):
+    '''
+    Read definitions (and developer fields) into the state and group the offsets of the remaining
+    data messages by definition.
+    '''
+    view, offset, batches, current, n = memoryview(data), 0, [], {}, 0
+    try:
+        file_header = FileHeader(view)
+        offset = len(file_header)
+        file_header.validate(data, log, quiet=no_validate)
+        while len(data) - offset > 2:
+            header = data[offset]
+            if header & 0x80:
+                local, compressed = (header & 0x60) >> 5, header & 0x1f
+            elif header & 0x40:
+                offset += len(token_factory(view[offset:], state))
+                continue
+            else:
+                local, compressed = header & 0x0f, -1
+            definition = state.definitions[local]
+            if len(data) - offset < definition.size:
+                raise Exception('Insufficient data for %s (%d/%d)' %
+                                (definition.identity, len(data) - offset, definition.size))
+            if definition.global_message_no == FIELD_DESCRIPTION and compressed < 0:
+                token_factory(view[offset:], state)  # adds developer field to state
+            else:
+                batch = current.get(local, None)
+                if batch is None or batch.definition is not definition:
+                    batch = current[local] = Batch(definition)
+                    batches.append(batch)
+                batch.index.append(n)
+                batch.offsets.append(offset)
+                batch.compressed.append(compressed)
+                n += 1
+            offset += definition.size
+        Checksum(view[offset:]).validate(data, log, quiet=no_validate)
+    except Exception as e:
+        log.warning('"%s" at offset %d' % (e, offset))
+        raise
+    return batches, n
+
+
+def read_values(rows, start, type, count, endian):
+    data = np.ascontiguousarray(rows[:, start:start + type.n_bytes * count])
+    return data.view(type.dtype(endian)).reshape(len(rows), count)
+
+
+def read_bad(rows, start, type, count, endian):
+    bad = np.frombuffer(type.bad(endian), dtype=np.uint8)
+    data = rows[:, start:start + type.n_bytes * count].reshape(len(rows), count, type.n_bytes)
+    return np.all(data == bad, axis=2)
+
+
+def read_bits(rows, start, finish, endian):
+    data = rows[:, start:finish]
+    if endian: data = data[:, ::-1]
+    if finish - start > 8:
+        return np.array([int.from_bytes(row.tobytes(), byteorder='little') for row in data], dtype=object)
+    bits = np.zeros(len(rows), dtype=np.uint64)
+    for i in range(finish - start):
+        bits |= data[:, i].astype(np.uint64) << np.uint64(8 * i)
+    return bits
+
+
+def is_missing(values):
+    if values.dtype.kind == 'f':
+        missing = np.isnan(values)
+    elif values.dtype.kind == 'M':
+        missing = np.isnat(values)
+    elif values.dtype.kind == 'O':
+        missing = np.equal(values, None)
+    else:
+        missing = np.zeros(values.shape, dtype=bool)
+    return missing.all(axis=tuple(range(1, missing.ndim)))
+
+
+def empty(dtype, shape):
+    if dtype.kind == 'f':
+        return np.full(shape, np.nan)
+    elif dtype.kind == 'M':
+        return np.full(shape, np.datetime64('NaT'), dtype=dtype)
+    else:
+        return np.zeros(shape, dtype=dtype) if dtype.kind == 'b' else np.full(shape, None, dtype=object)
+
+
+def times(values):
+    '''
+    Convert datetime64 values to a list of (UTC) datetimes (with None for NaT).
+    '''
+    return [to_time(value, none=True) for value in values.astype('datetime64[s]').tolist()]
+
+
+class Decoder:
+    '''
+    Decode all the messages in a batch.  Fields are handled in the same order as the definition
+    (which is sorted so that dynamic fields follow the fields they reference).
+    '''
+
+    def __init__(self, batch, buffer, state, map_values=True):
+        self.definition = batch.definition
+        self.index = np.array(batch.index, dtype=np.int64)
+        self.compressed = np.array(batch.compressed, dtype=np.int64)
+        offsets = np.array(batch.offsets, dtype=np.int64)
+        self.__rows = buffer[offsets[:, None] + np.arange(self.definition.size)]
+        self.__message = self.definition.message
+        self.__endian = self.definition.endian
+        self.__accumulators = state.accumulators
+        self.__map_values = map_values
+        self.__accumulated_only = False
+        self.timestamp = None
+        self.columns = {}
+        self.units = {}
+        self.accumulated = []
+        self.__references = {}  # name: (internal values, valid)
+
+    def __len__(self):
+        return len(self.index)
+
+    def read_timestamp(self):
+        '''
+        The kind and (raw) value of the timestamp in each message.
+        '''
+        field = self.definition.timestamp_field
+        if field:
+            type = field.field.type
+            if type.dtype(self.__endian) is None:
+                raise Exception('Cannot read timestamp for %s' % self.definition.identity)
+            kind = RELATIVE_16 if isinstance(type, Date16) else ABSOLUTE
+            return kind, read_values(self.__rows, field.start, type, 1, self.__endian)[:, 0].astype(np.int64)
+        else:
+            return None, None
+
+    def decode(self, timestamp, accumulated_only=False):
+        '''
+        With accumulated_only, only accumulated values (and references to resolve dynamic fields) are
+        read, for messages that are not returned but still contribute to accumulated totals.
+        '''
+        self.timestamp = timestamp[self.index]
+        self.__accumulated_only = accumulated_only
+        everything = np.ones(len(self), dtype=bool)
+        for field in self.definition.fields:
+            if field.field:
+                self.__field(field.field, everything, field)
+            else:
+                self.__typed('@%d:%d' % (field.start, field.finish), field.base_type, everything, field,
+                             1, 0, None)
+        return self
+
+    def __field(self, field, mask, defn_field, values=None, n_bits=None, scale=None, offset=None):
+        if isinstance(field, CompositeField):
+            self.__composite(field, mask, defn_field, values=values, scale=scale, offset=offset)
+        elif isinstance(field, DynamicField):
+            self.__dynamic(field, mask, defn_field, values=values, n_bits=n_bits, scale=scale, offset=offset)
+        else:
+            self.__typed(field.name, field.type, mask, defn_field,
+                         field._scale if scale is None else scale, field._offset if offset is None else offset,
+                         field._units, values=values, n_bits=n_bits)
+
+    def __composite(self, field, mask, defn_field, values=None, scale=None, offset=None):
+        if values is None:
+            rows = self.__rows[mask]
+            bad = read_bad(rows, defn_field.start, field.type, defn_field.count, self.__endian).all(axis=1)
+            values = read_bits(rows, defn_field.start, defn_field.finish, self.__endian)[~bad]
+            mask = self.__submask(mask, ~bad)
+        integer = values.dtype.type  # uint64 or (for large fields) python int
+        for n_bits, component in field._components:
+            delegate = self.__message.profile_to_field(component.name)
+            self.__field(delegate, mask, defn_field, values=values & integer((1 << n_bits) - 1), n_bits=n_bits,
+                         scale=component._scale if scale is None else scale,
+                         offset=component._offset if offset is None else offset)
+            values = values >> integer(n_bits)
+
+    def __dynamic(self, field, mask, defn_field, values=None, n_bits=None, scale=None, offset=None):
+        targets = np.full(len(self), None, dtype=object)
+        for name in field.references:
+            if name in self.__references:
+                references, valid = self.__references[name]
+                unresolved = mask & valid & np.equal(targets, None)
+                for reference in np.unique(references[unresolved]).tolist():
+                    targets[unresolved & (references == reference)] = field.lookup(name, reference)
+        for target in set(targets[mask].tolist()):
+            selected = np.equal(targets[mask], target)
+            submask = self.__submask(mask, selected)
+            subvalues = None if values is None else values[selected]
+            if target:
+                self.__field(self.__message.profile_to_field(target), submask, defn_field,
+                             values=subvalues, n_bits=n_bits, scale=scale, offset=offset)
+            else:
+                self.__typed(field.name, field.type, submask, defn_field,
+                             field._scale if scale is None else scale, field._offset if offset is None else offset,
+                             field._units, values=subvalues, n_bits=n_bits)
+
+    def __typed(self, name, type, mask, defn_field, scale, offset, units, values=None, n_bits=None):
+        # the equivalent of AbstractType.parse_type for each subclass
+        endian, n = self.__endian, np.count_nonzero(mask)
+        if not n: return
+        if values is None and type.dtype(endian) is None:
+            if not self.__accumulated_only:
+                self.__add(name, mask, self.__parse_rows(type, mask, defn_field), units)
+            return
+        struct = type.base_type if isinstance(type, Mapping) else type
+        if values is None:  # read from data and check for bad values
+            rows = self.__rows[mask]
+            values = read_values(rows, defn_field.start, type, defn_field.count, endian)
+            bad = read_bad(rows, defn_field.start, type, defn_field.count, endian)
+        else:  # values from a composite field, which are never bad
+            values = values.astype(np.uint64).astype(np.dtype(type.dtype(endian)).newbyteorder('='))[:, None]
+            bad = np.zeros(values.shape, dtype=bool)
+        all_bad = bad.all(axis=1)
+        if not all_bad.all():
+            self.__reference(name, mask, values[:, 0], ~all_bad)
+        if name in self.__accumulators:
+            if values.shape[1] > 1:
+                raise Exception('Cannot accumulate multiple fields (%s: %d)' % (name, values.shape[1]))
+            self.columns.setdefault(name, None)  # preserve order
+            self.accumulated.append((name, self.__submask(mask, ~all_bad), values[~all_bad, 0].astype(np.int64),
+                                     n_bits, type, scale, offset, units))
+        elif not self.__accumulated_only:
+            if (scale != 1 or offset != 0) and struct.name != 'enum':
+                scaled = values / scale - offset
+                values = scaled if values.shape[1] == 1 else np.where(bad, values, scaled)
+            self.__add(name, self.__submask(mask, ~all_bad), self.convert(type, values[~all_bad], mask), units)
+
+    def convert(self, type, values, mask):
+        if isinstance(type, Date16):
+            values = np.repeat(self.timestamp[mask][:, None], values.shape[1], axis=1)
+        elif isinstance(type, Date):
+            values = EPOCH + values.astype(np.int64).astype('timedelta64[s]')
+        elif isinstance(type, Mapping) and self.__map_values:
+            internal, inverse = np.unique(values, return_inverse=True)
+            profile = np.empty(len(internal), dtype=object)
+            profile[:] = [type.safe_internal_to_profile(value) for value in internal.tolist()]
+            values = profile[inverse].reshape(values.shape)
+        else:
+            values = values.astype(np.float64)
+        return values[:, 0] if values.shape[1] == 1 else values
+
+    def __parse_rows(self, type, mask, defn_field):
+        # fallback for strings, booleans etc
+        values = np.empty(np.count_nonzero(mask), dtype=object)
+        for i, row in enumerate(self.__rows[mask]):
+            value = type.parse_type(row[defn_field.start:defn_field.finish].tobytes(), defn_field.count,
+                                    self.__endian, None)
+            values[i] = None if value is None else tuple(value)
+        return values
+
+    def __reference(self, name, mask, values, valid):
+        if name not in self.__references:
+            self.__references[name] = (np.zeros(len(self), dtype=np.int64), np.zeros(len(self), dtype=bool))
+        references, all_valid = self.__references[name]
+        indices = np.flatnonzero(mask)[valid]
+        references[indices] = values[valid].astype(np.int64)
+        all_valid[indices] = True
+
+    def __submask(self, mask, selected):
+        submask = np.zeros(len(self), dtype=bool)
+        submask[np.flatnonzero(mask)[selected]] = True
+        return submask
+
+    def __add(self, name, mask, values, units):
+        column = self.columns.get(name, None)
+        if column is None:
+            column = self.columns[name] = empty(values.dtype, (len(self),) + values.shape[1:])
+            self.units[name] = units
+        if column.shape[1:] != values.shape[1:]:
+            log.debug('Dropping %s with inconsistent shape for %s' % (name, self.definition.identity))
+            return
+        if column.dtype != values.dtype:
+            column = self.columns[name] = column.astype(object)
+        indices = np.flatnonzero(mask)
+        missing = is_missing(column[indices])
+        column[indices[missing]] = values[missing]
+
+    def add_accumulated(self, name, mask, values, units):
+        self.__add(name, mask, values, units)
+
+
+def resolve_timestamps(decoders, n, max_delta_t=None):
+    '''
+    Each message can update the timestamp twice (compressed header and then a timestamp field) so
+    expand into a sequence of updates which, when there are no timestamp_16 fields, can be resolved
+    with vectorized operations.
+    '''
+    messages, kinds, values = [], [], []
+    for decoder in decoders:
+        compressed = decoder.compressed >= 0
+        messages.append(decoder.index[compressed])
+        kinds.append(np.full(np.count_nonzero(compressed), COMPRESSED))
+        values.append(decoder.compressed[compressed])
+        kind, value = decoder.read_timestamp()
+        if kind:
+            messages.append(decoder.index)
+            kinds.append(np.full(len(decoder), kind))
+            values.append(value)
+    timestamp = np.full(n, np.datetime64('NaT'), dtype='datetime64[s]')
+    if not messages: return timestamp
+    messages, kinds, values = np.concatenate(messages), np.concatenate(kinds), np.concatenate(values)
+    if not len(messages): return timestamp
+    order = np.lexsort((kinds != COMPRESSED, messages))
+    messages, kinds, values = messages[order], kinds[order], values[order]
+    if np.any(kinds == RELATIVE_16):
+        updates = resolve_sequential(kinds, values)
+    else:
+        updates = resolve_vectorized(kinds, values)
+    if max_delta_t:
+        delta = np.diff(updates)
+        if np.any(delta > max_delta_t):
+            i = np.argmax(delta > max_delta_t)
+            raise Exception('Too large shift in timestamp (%.1fs: %s/%s' %
+                            (delta[i], EPOCH + updates[i], EPOCH + updates[i+1]))
+        if np.any(delta < 0):
+            i = np.argmax(delta < 0)
+            raise Exception('Timestep decreased (%s/%s)' % (EPOCH + updates[i], EPOCH + updates[i+1]))
+    last = np.append(messages[1:] != messages[:-1], True)
+    known = np.full(n, -1, dtype=np.int64)
+    known[messages[last]] = np.arange(len(messages))[last]
+    known = np.maximum.accumulate(known)
+    valid = known >= 0
+    timestamp[valid] = EPOCH + updates[known[valid]].astype('timedelta64[s]')
+    return timestamp
+
+
+def resolve_vectorized(kinds, values):
+    absolute = kinds == ABSOLUTE
+    start = np.maximum.accumulate(np.where(absolute, np.arange(len(kinds)), -1))
+    if np.any(start < 0):
+        raise Exception('Compressed timestamp with no preceding absolute timestamp')
+    # the low 5 bits of each compressed timestamp advance from the low bits of the previous timestamp
+    step = np.where(absolute, 0, (values - np.roll(values, 1)) & 0x1f)
+    total = np.cumsum(step)
+    return values[start] + total - total[start]
+
+
+def resolve_sequential(kinds, values):
+    updates, current = np.empty(len(kinds), dtype=np.int64), None
+    for i, (kind, value) in enumerate(zip(kinds.tolist(), values.tolist())):
+        if kind == ABSOLUTE:
+            current = value
+        elif current is None:
+            raise Exception('Relative timestamp with no preceding absolute timestamp')
+        elif kind == COMPRESSED:
+            current += (value - current) & 0x1f
+        else:  # see Date16
+            delta = value - (current & 0xffff)
+            if delta < 0 and abs(delta) < 0x8000:
+                log.warning(f'Time travel - timestamp_16 moved back in time: '
+                            f'{EPOCH + current} -> {EPOCH + current + delta}')
+                current += delta
+            else:
+                current += delta & 0xffff
+        updates[i] = current
+    return updates
+
+
+def resolve_accumulated(decoders):
+    '''
+    Accumulated values are shared (by name) across all messages, so are resolved in file order.
+    With n_bits each value is the low bits of a counter that (may) roll over; otherwise the value is
+    complete.
+    '''
+    by_name = defaultdict(list)
+    for decoder in decoders:
+        for accumulated in decoder.accumulated:
+            by_name[accumulated[0]].append((decoder,) + accumulated[1:])
+    for name, entries in by_name.items():
+        index = np.concatenate([decoder.index[mask] for decoder, mask, *_ in entries])
+        short = np.concatenate([values for _, _, values, *_ in entries])
+        n_bits = np.concatenate([np.full(len(values), n_bits or 0) for _, _, values, n_bits, *_ in entries])
+        if not len(index): continue
+        order = np.argsort(index, kind='stable')
+        short, n_bits = short[order], n_bits[order]
+        complete = n_bits == 0
+        complete[0] = True
+        step = np.where(complete, 0, (short - np.roll(short, 1)) & ((1 << n_bits) - 1))
+        start = np.maximum.accumulate(np.where(complete, np.arange(len(short)), 0))
+        total = np.cumsum(step)
+        long = short[start] + total - total[start]
+        decreased = complete[1:] & (short[1:] < long[:-1])
+        if np.any(decreased):
+            i = np.argmax(decreased)
+            raise Exception('Full accumulated field has decreased in value (%s: %d/%d)' %
+                            (name, short[i+1], long[i]))
+        unsorted = np.empty_like(long)
+        unsorted[order] = long
+        offset = 0
+        for decoder, mask, values, n_bits, type, scale, delta, units in entries:
+            long = unsorted[offset:offset+len(values)]
+            offset += len(values)
+            if scale != 1 or delta != 0:
+                long = long / scale - delta
+            decoder.add_accumulated(name, mask, decoder.convert(type, long[:, None], mask), units)
+
+
+class Columns:
+    '''
+    The data for one message type, from all definitions, in file order.
+
+    data is a numpy structured array with one field per FIT field; timestamp is the (datetime64)
+    timestamp for each message; index is the position of each message in the file (relative to all
+    data messages, so different message types can be interleaved).
+    '''
+
+    def __init__(self, name, number, index, timestamp, data, units):
+        self.name = name
+        self.number = number
+        self.index = index
+        self.timestamp = timestamp
+        self.data = data
+        self.units = units
+
+    @property
+    def names(self):
+        return self.data.dtype.names
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name == 'timestamp' or name in self.data.dtype.names
+
+    def __getitem__(self, name):
+        if name == 'timestamp' and name not in self.data.dtype.names:
+            return self.timestamp
+        return self.data[name]
+
+    def __str__(self):
+        return '%s: %d x (%s)' % (self.name, len(self), ', '.join(self.names))
+
+
+def merge(decoders):
+    first = decoders[0]
+    index = np.concatenate([decoder.index for decoder in decoders])
+    order = np.argsort(index, kind='stable')
+    columns, units = {}, {}
+    for decoder in decoders:
+        for name, column in decoder.columns.items():
+            if column is None: continue
+            units.setdefault(name, decoder.units[name])
+            if name not in columns:
+                columns[name] = column
+            elif columns[name].shape[1:] != column.shape[1:]:
+                log.debug('Dropping %s with inconsistent shape for %s' % (name, decoder.definition.identity))
+            elif columns[name].dtype != column.dtype:
+                columns[name] = columns[name].astype(object)
+    data = np.empty(len(index), dtype=[(name, column.dtype, column.shape[1:]) for name, column in columns.items()])
+    for name, column in columns.items():
+        parts = []
+        for decoder in decoders:
+            part = decoder.columns.get(name, None)
+            if part is None or part.shape[1:] != column.shape[1:]:
+                part = empty(column.dtype, (len(decoder),) + column.shape[1:])
+            parts.append(part.astype(column.dtype, copy=False))
+        data[name] = np.concatenate(parts)[order]
+    timestamp = np.concatenate([decoder.timestamp for decoder in decoders])[order]
+    return Columns(first.definition.message.name, first.definition.message.number, index[order], timestamp,
+                   data, units)
+
+
+def parse_columns(data, types, messages, record_names=None, no_validate=False, max_delta_t=None,
+                  map_values=True):
+    '''
+    Returns a map from message name to Columns.  If record_names is given then only those
+    messages are returned (other messages are decoded only for accumulated values, which are resolved
+    over the whole file, as in the record-based parser).
+    '''
+    state = State(types, messages, max_delta_t=max_delta_t)
+    batches, n = scan(data, state, no_validate=no_validate)
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    decoders = [Decoder(batch, buffer, state, map_values=map_values) for batch in batches]
+    timestamp = resolve_timestamps(decoders, n, max_delta_t=max_delta_t)
+    selected = []
+    for decoder in decoders:
+        if not record_names or decoder.definition.message.name in record_names:
+            selected.append(decoder.decode(timestamp))
+        elif state.accumulators:
+            decoder.decode(timestamp, accumulated_only=True)
+    resolve_accumulated(decoders)
+    by_name = defaultdict(list)
+    for decoder in selected:
+        by_name[decoder.definition.message.name].append(decoder)
+    return dict((name, merge(decoders)) for name, decoders in by_name.items())
@@ -0,0 +1,87 @@
+from logging import getLogger
+
+import numpy as np
+
+log = getLogger(__name__)
+
+'''
+The FIT checksum (CRC-16, reflected polynomial 0xa001, zero initial value).
+
+Small inputs use a byte-wide table.  Larger inputs are split into equal chunks whose checksums are
+calculated together, with numpy (one step per byte position), and then combined.  Combining works
+because the CRC is linear: the checksum of a + b is the checksum of a advanced over len(b) zero bytes,
+xored with the checksum of b (from zero).  Advancing over zeros is itself linear, so is tabulated for
+the chunk length.
+'''
+
+
+def _byte_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xa001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+TABLE = _byte_table()
+NP_TABLE = np.array(TABLE, dtype=np.uint16)
+MIN_CHUNKED = 4096
+
+
+def crc(data, checksum=0):
+    '''
+    The checksum of data (bytes, bytearray, memoryview or mmap).  An initial checksum can be given
+    to continue a previous calculation (so crc(a + b) == crc(b, checksum=crc(a))).
+    '''
+    if len(data) < MIN_CHUNKED:
+        return _crc_bytes(data, checksum)
+    else:
+        return _crc_chunked(data, checksum)
+
+
+def _crc_bytes(data, checksum=0):
+    for byte in bytes(data):
+        checksum = (checksum >> 8) ^ TABLE[(checksum ^ byte) & 0xff]
+    return checksum
+
+
+def _apply(operator, checksum):
+    # linear operators on the checksum are represented by the images of the 16 bits
+    result = 0
+    for bit in range(16):
+        if checksum & (1 << bit):
+            result ^= operator[bit]
+    return result
+
+
+def _compose(a, b):
+    return [_apply(a, image) for image in b]
+
+
+def _advance_tables(n):
+    # the operator for n zero bytes (by squaring), tabulated for the low and high bytes
+    zero = [(TABLE[(1 << bit) & 0xff] ^ ((1 << bit) >> 8)) for bit in range(16)]
+    operator = [1 << bit for bit in range(16)]
+    while n:
+        if n & 1:
+            operator = _compose(zero, operator)
+        zero = _compose(zero, zero)
+        n >>= 1
+    return [_apply(operator, byte) for byte in range(256)], [_apply(operator, byte << 8) for byte in range(256)]
+
+
+def _crc_chunked(data, checksum=0):
+    n_chunks = int(np.sqrt(len(data)))
+    size = len(data) // n_chunks
+    # transpose so that each step reads contiguous memory
+    chunks = np.frombuffer(data, dtype=np.uint8, count=n_chunks * size).reshape(n_chunks, size)
+    chunks = np.ascontiguousarray(chunks.T)
+    lanes = np.zeros(n_chunks, dtype=np.uint16)
+    for byte in chunks:
+        lanes = (lanes >> 8) ^ NP_TABLE[(lanes ^ byte) & 0xff]
+    low, high = _advance_tables(size)
+    for lane in lanes.tolist():
+        checksum = low[checksum & 0xff] ^ high[checksum >> 8] ^ lane
+    return _crc_bytes(memoryview(data)[n_chunks * size:], checksum)
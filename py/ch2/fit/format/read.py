@@ -1,5 +1,6 @@
 from logging import getLogger
 
+from .columns import parse_columns
 from .records import restrict_names
 from .tokens import State, FileHeader, token_factory, Checksum
 from ..profile.profile import read_profile
@@ -13,19 +14,20 @@ def parse_data(data, types, messages, no_validate=False, max_delta_t=None):
     state = State(types, messages, max_delta_t=max_delta_t)
 
     def generator():
-        offset = 0
+        # tokens hold slices of the view, so nothing is copied (data can be bytes, bytearray or mmap)
+        view, offset = memoryview(data), 0
         try:
-            file_header = FileHeader(data[offset:])
+            file_header = FileHeader(view[offset:])
             yield offset, file_header
             offset = len(file_header)
-            file_header.validate(data, log, quiet=no_validate)
-            while len(data) - offset > 2:
-                token = token_factory(data[offset:], state)
+            file_header.validate(view, log, quiet=no_validate)
+            while len(view) - offset > 2:
+                token = token_factory(view[offset:], state)
                 yield offset, token
                 offset += len(token)
-            checksum = Checksum(data[offset:])
+            checksum = Checksum(view[offset:])
             yield offset, checksum
-            checksum.validate(data, log, quiet=no_validate)
+            checksum.validate(view, log, quiet=no_validate)
         except Exception as e:
             log.warning('"%s" at offset %d' % (e, offset))
             dump(data, offset)
@@ -95,3 +97,11 @@ def filtered_records(data,
                 yield i, offset, record
 
     return types, messages, generator()
+
+
+def filtered_columns(data, record_names=None, warn=False, no_validate=False, max_delta_t=None, profile_path=None):
+
+    types, messages = read_profile(warn=warn, profile_path=profile_path)
+    columns = parse_columns(data, types, messages, record_names=record_names,
+                            no_validate=no_validate, max_delta_t=max_delta_t)
+    return types, messages, columns
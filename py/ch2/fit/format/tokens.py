@@ -5,8 +5,10 @@ from logging import getLogger
 from re import sub
 from struct import unpack, pack
 
+from .crc import crc
 from .records import LazyRecord, merge_duplicates
 from ..profile.fields import TypedField, TIMESTAMP_GLOBAL_TYPE, DynamicField, CompositeField
+from ..profile.messages import Plan
 from ..profile.types import timestamp_to_time, time_to_timestamp
 from ...names import Units
 from ...lib.data import WarnDict, tohex
@@ -215,7 +217,7 @@ class Defined(Token):
     the Definition for that type, which itself contains a reference to the Message and Fields the data contain.
     '''
 
-    __slots__ = ('definition', 'timestamp', '_accumulators')
+    __slots__ = ('definition', 'timestamp', '_accumulators', '_plan')
 
     def __init__(self, tag, data, state, local_message_type):
         self.definition = state.definitions[local_message_type]
@@ -223,6 +225,7 @@ class Defined(Token):
             self.__parse_timestamp(data, state)
         self.timestamp = state.timestamp
         self._accumulators = state.accumulators
+        self._plan = state.plan(self.definition)
         if len(data) < self.definition.size:
             raise Exception('Insufficient data for %s (%d/%d)' %
                             (self.definition.identity, len(data), self.definition.size))
@@ -237,9 +240,10 @@ class Defined(Token):
         else:
             raise Exception('Could not parse timestamp')
 
-    def parse_token(self, **options):
+    def parse_token(self, compiled=True, **options):
         return self.definition.message.parse_message(self.data, self.definition, self.timestamp,
-                                                     accumulators=self._accumulators, **options)
+                                                     accumulators=self._accumulators,
+                                                     plan=self._plan if compiled else None, **options)
 
     def describe_fields(self, types):
         yield '%s - header (local message type %d - %s)' % \
@@ -305,7 +309,7 @@ class CompressedTimestamp(Defined):
         state.timestamp = timestamp_to_time((timestamp & 0xffffffe0) + offset + (0x20 if rollover else 0))
         super().__init__('DTT', data, state, (data[0] & 0x60) >> 5)
 
-    def parse_token(self, raw_time=False, **options):
+    def parse_token(self, raw_time=False, compiled=True, **options):
         timestamp = time_to_timestamp(self.timestamp) if raw_time else self.timestamp
         if self.definition.timestamp_field:
             extra = {}
@@ -313,7 +317,8 @@ class CompressedTimestamp(Defined):
             extra = {'timestamp': ((timestamp,), Units.S)}
         return self.definition.message.parse_message(self.data, self.definition, self.timestamp,
                                                      extra=extra, raw_time=raw_time,
-                                                     accumulators=self._accumulators, **options)
+                                                     accumulators=self._accumulators,
+                                                     plan=self._plan if compiled else None, **options)
 
     def describe_fields(self, types):
         yield '%s - header (local message type %d - %s; time delta %d)' % \
@@ -367,7 +372,8 @@ class Definition(Token):
         self.identity = Identity(self.message.name, state.definition_counter)
         self.fields = self.__process_fields(self._make_fields(data, state), state)
         self.accumulators = state.accumulators
-        super().__init__(tag, False, data[0:overhead+3*len(self.fields)])
+        # definitions are kept in the state, so copy (they are small) rather than reference the data
+        super().__init__(tag, False, bytes(data[0:overhead+3*len(self.fields)]))
         state.definitions[self.local_message_type] = self
 
     def _make_fields(self, data, state):
@@ -458,8 +464,8 @@ class Definition(Token):
     def parse_token(self, raw_data=False, **options):
         data = {'local_message_type': ((self.data[0:1],
                                         str(self.local_message_type)), '') if raw_data else self.local_message_type,
-                'reserved': self.data[1:2],
-                'architecture': self.data[2:3],
+                'reserved': bytes(self.data[1:2]),
+                'architecture': bytes(self.data[2:3]),
                 'message_number': ((self.data[3:5], self.message.name), '') if raw_data else self.global_message_no,
                 'no_of_fields': self.data[5:6] if raw_data else self.data[5]}
         if not raw_data:
@@ -505,20 +511,8 @@ class DeveloperDefinition(Definition):
 class Checksum(ValidateToken):
 
     @staticmethod
-    def crc(data):
-
-        CRC = [0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
-               0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400]
-
-        checksum = 0
-        for byte in data:
-            tmp = CRC[checksum & 0xf]
-            checksum = (checksum >> 4) & 0xfff
-            checksum = checksum ^ tmp ^ CRC[byte & 0xf]
-            tmp = CRC[checksum & 0xf]
-            checksum = (checksum >> 4) & 0xfff
-            checksum = checksum ^ tmp ^ CRC[(byte >> 4) & 0xf]
-        return checksum
+    def crc(data, checksum=0):
+        return crc(data, checksum=checksum)
 
     def __init__(self, data):
         super().__init__('CRC', False, data)
@@ -570,6 +564,7 @@ class State:
         self.definitions = WarnDict(log, 'No definition for local message type %s')
         self.definition_counter = Counter()
         self.accumulators = {}
+        self.plans = {}
         self._timestamp = None
 
     @property
@@ -589,11 +584,23 @@ class State:
                 raise Exception('Timestep decreased (%s/%s)' % (self._timestamp, timestamp))
         return timestamp
 
+    def plan(self, definition):
+        '''
+        The compiled parser for data with this definition (cached by local message type and
+        recompiled if the definition or accumulators change).
+        '''
+        plan = self.plans.get(definition.local_message_type, None)
+        if plan is None or plan.definition is not definition or plan.n_accumulators != len(self.accumulators):
+            plan = Plan(definition, self.accumulators)
+            self.plans[definition.local_message_type] = plan
+        return plan
+
     def copy(self):
         copy = State(self.types, self.messages, self.max_delta_t)
         copy.dev_fields.update(self.dev_fields)
         copy.definitions.update(self.definitions)
         copy.definition_counter.update(self.definition_counter)
         copy.accumulators.update(self.accumulators)
+        copy.plans.update(self.plans)
         copy._timestamp = self._timestamp
         return copy
@@ -0,0 +1,178 @@
+
+from io import BytesIO
+from logging import getLogger
+from mmap import mmap, ACCESS_READ
+from pickle import Pickler, Unpickler, dumps, loads
+from struct import Struct
+
+from .messages import Missing
+from .support import NullableLog
+from .types import AbstractType, AutoFloat, AutoInteger
+from ...lib.data import WarnDict, WarnList
+
+log = getLogger(__name__)
+
+'''
+The profile, stored so that it can be read quickly and used partially.
+
+Each type and message is pickled separately, with references to other types (and to the shared log)
+replaced by names, so that only the types and messages that are actually used are unpickled.
+The file starts with the length of an index (pickled) that gives the location of each, by name.
+'''
+
+LENGTH = Struct('<Q')
+LOG, TYPE = 'log', 'type'
+
+
+class CompactPickler(Pickler):
+
+    def __init__(self, output, nlog, root):
+        super().__init__(output)
+        self.__nlog = nlog
+        self.__root = root
+
+    def persistent_id(self, obj):
+        if obj is self.__nlog:
+            return LOG,
+        elif isinstance(obj, AbstractType) and obj is not self.__root:
+            return TYPE, obj.name
+        else:
+            return None
+
+
+class CompactUnpickler(Unpickler):
+
+    def __init__(self, data, profile):
+        super().__init__(BytesIO(data))
+        self.__profile = profile
+
+    def persistent_load(self, pid):
+        if pid[0] == LOG:
+            return self.__profile.log
+        else:
+            return self.__profile.types.profile_to_type(pid[1])
+
+
+def write_compact(path, nlog, types, messages):
+    '''
+    Save types and messages (from read_external_profile()) in the format read by CompactProfile.
+    '''
+    blobs, offset = [], 0
+
+    def add(value):
+        nonlocal offset
+        output = BytesIO()
+        CompactPickler(output, nlog, value).dump(value)
+        blobs.append(output.getvalue())
+        offset += len(blobs[-1])
+        return offset - len(blobs[-1]), offset
+
+    index = {'types': {type.name: add(type) for type in types.values()},
+             'messages': {message.name: add(message) for message in messages.values()},
+             'numbers': {message.number: message.name for message in messages.values()
+                         if message.number is not None},
+             'base_types': [type.name for type in types.base_types],
+             'overrides': set(types.overrides)}
+    index = dumps(index)
+    with open(path, 'wb') as output:
+        output.write(LENGTH.pack(len(index)))
+        output.write(index)
+        for blob in blobs:
+            output.write(blob)
+
+
+class CompactProfile:
+    '''
+    The profile from write_compact(), mapped into memory.  Only the index is read on creation.
+    '''
+
+    def __init__(self, path, log):
+        self.log = NullableLog(log)
+        with open(path, 'rb') as input:
+            self.__data = mmap(input.fileno(), 0, access=ACCESS_READ)
+        try:
+            length = LENGTH.unpack_from(self.__data)[0]
+            index = loads(self.__data[LENGTH.size:LENGTH.size+length])
+            index['types'], index['messages']
+        except Exception as e:
+            # most likely a profile pickled by an earlier version
+            raise Exception(f'{path} is not a compact profile ({e}); '
+                            f'regenerate with ch2 package-fit-profile')
+        self.__base = LENGTH.size + length
+        self.types = CompactTypes(self, index['types'], index['base_types'], index['overrides'])
+        self.messages = CompactMessages(self, index['messages'], index['numbers'])
+
+    def load(self, start, finish):
+        return CompactUnpickler(self.__data[self.__base+start:self.__base+finish], self).load()
+
+
+class CompactTypes:
+    '''
+    Provides the same interface as Types, but unpickles each type when first used.
+    '''
+
+    def __init__(self, profile, index, base_types, overrides):
+        self.__profile = profile
+        self.__index = index
+        self.__profile_to_type = WarnDict(profile.log, 'No type for profile %r')
+        self.__base_type_names = base_types
+        self.__base_types = None
+        self.overrides = overrides
+
+    @property
+    def base_types(self):
+        if self.__base_types is None:
+            self.__base_types = WarnList(self.__profile.log, 'No base type for number %r')
+            self.__base_types.extend(self.profile_to_type(name) for name in self.__base_type_names)
+        return self.__base_types
+
+    def is_type(self, name):
+        return name in self.__profile_to_type or name in self.__index
+
+    def values(self):
+        return [self.profile_to_type(name) for name in self.__index]
+
+    def profile_to_type(self, name, auto_create=False):
+        if name not in self.__profile_to_type:
+            if name in self.__index:
+                self.__profile_to_type[name] = self.__profile.load(*self.__index[name])
+            elif auto_create:
+                for cls in (AutoFloat, AutoInteger):
+                    match = cls.pattern.match(name)
+                    if match:
+                        self.__profile.log.info('Auto-adding type %s for %r' % (cls.__name__, name))
+                        self.__profile_to_type[name] = cls(self.__profile.log, name)
+                        break
+        return self.__profile_to_type[name]
+
+
+class CompactMessages:
+    '''
+    Provides the same interface as Messages, but unpickles each message when first used.
+    '''
+
+    def __init__(self, profile, index, numbers):
+        self.__profile = profile
+        self.__index = index
+        self.__numbers = numbers
+        self.__profile_to_message = dict()
+        self.__number_to_message = dict()
+
+    def profile_to_message(self, name):
+        if name not in self.__profile_to_message:
+            message = self.__profile.load(*self.__index[name])
+            self.__profile_to_message[name] = message
+            if message.number is not None:
+                self.__number_to_message[message.number] = message
+        return self.__profile_to_message[name]
+
+    def values(self):
+        return [self.profile_to_message(name) for name in self.__index]
+
+    def number_to_message(self, number):
+        if number not in self.__number_to_message:
+            if number in self.__numbers:
+                self.profile_to_message(self.__numbers[number])
+            else:
+                self.__number_to_message[number] = Missing(self.__profile.log, number)
+        return self.__number_to_message[number]
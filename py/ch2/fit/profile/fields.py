@@ -152,12 +152,18 @@ class DynamicField(Zip, RowField):
             value = types.profile_to_type(message.profile_to_field(name).type.name).profile_to_internal(value)
             self.__dynamic_lookup[(name, value)] = field
 
+    def lookup(self, name, value):
+        '''
+        The name of the field selected when the referenced field has the given value (or None).
+        '''
+        return self.__dynamic_lookup.get((name, value), None)
+
     def parse_field(self, data, count, endian, timestamp, references, message, warn=False, **options):
         for name in self.references:
             if name in references:
-                lookup = (name, references[name][0][0])  # drop units and take first value
-                if lookup in self.__dynamic_lookup:
-                    yield from message.profile_to_field(self.__dynamic_lookup[lookup]).parse_field(
+                lookup = self.lookup(name, references[name][0][0])  # drop units and take first value
+                if lookup:
+                    yield from message.profile_to_field(lookup).parse_field(
                         data, count, endian, timestamp, references, message, warn=warn, **options)
                     return
         if warn:
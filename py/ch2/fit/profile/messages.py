@@ -1,7 +1,11 @@
 
-from .fields import Row, MessageField, TypedField
+from itertools import repeat
+from struct import Struct
+
+from .fields import Row, MessageField, TypedField, CompositeField, DynamicField
 from .support import Named
 from .support import Rows
+from .types import Mapping, AutoInteger, AutoFloat, Date, Date16
 from ..format.records import LazyRecord
 from ...lib.data import WarnDict
 
@@ -38,11 +42,11 @@ class Message(Named):
         for field in self._number_to_field.values():
             field.post(self, types)
 
-    def parse_message(self, data, defn, timestamp, extra=None, **options):
+    def parse_message(self, data, defn, timestamp, extra=None, plan=None, **options):
         return LazyRecord(self.name, self.number, defn.identity, timestamp,
-                          self.__parse(data, defn, timestamp, extra=extra, **options))
+                          self.__parse(data, defn, timestamp, extra=extra, plan=plan, **options))
 
-    def __parse(self, data, defn, timestamp, extra=None, **options):
+    def __parse(self, data, defn, timestamp, extra=None, plan=None, **options):
         # this is the generator that lives inside a record and is evaluated on demand
         if extra is None: extra = {}
         references = {}
@@ -50,7 +54,14 @@ class Message(Named):
             if name in defn.references and value[0] is not None:
                 references[name] = value
             yield name, value
-        for field in defn.fields:
+        unpacked = plan.unpack(data, **options) if plan else repeat(None)
+        for field, simple in zip(defn.fields, unpacked):
+            if simple:
+                name, value = simple
+                if name in defn.references and value[0] is not None:
+                    references[name] = value
+                yield name, value
+                continue
             bytes = data[field.start:field.finish]
             if field.field:
                 for name, value in self._parse_field(
@@ -68,6 +79,80 @@ class Message(Named):
         yield from field.parse_field(bytes, count, endian, timestamp, references, message, **options)
 
 
+class Plan:
+    '''
+    Parsing for a Definition, compiled once.  Fields with simple struct-based types (that are not
+    accumulated, dynamic or composite) are unpacked together, with a single call, and then checked
+    for bad values, scaled and mapped as in StructSupport._unpack and Mapping.parse_type.
+
+    unpack() gives a value for each field in the definition, with None for fields that must be
+    parsed as usual.
+    '''
+
+    def __init__(self, defn, accumulators):
+        self.definition = defn
+        self.n_accumulators = len(accumulators)
+        formats, simple, end, n_values = ['<>'[defn.endian]], {}, 0, 0
+        # unknown fields can appear more than once in defn.fields (same instance)
+        for field in sorted(set(defn.fields), key=lambda field: field.start):
+            compiled = self.__compile(field, accumulators)
+            if compiled:
+                name, type, scale, offset, units = compiled
+                base = type.base_type if isinstance(type, Mapping) else type
+                if field.start > end:
+                    formats.append('%dx' % (field.start - end))
+                formats.append('%d%s' % (field.count, base.dtype(defn.endian)[1:]))
+                end = field.start + base.n_bytes * field.count
+                bad = base.bad(defn.endian)
+                scaled = (scale != 1 or offset != 0) and base.name != 'enum'
+                # unknown fields are always checked (base_type.parse_type is called without check_bad)
+                simple[field] = (name, n_values, field.count, field.start, end, bad, bad * field.count,
+                                 scale if scaled else None, offset, units, type if type is not base else None,
+                                 not field.field)
+                n_values += field.count
+        self.__struct = Struct(''.join(formats))
+        self.__steps = [simple.get(field, None) for field in defn.fields]
+
+    @staticmethod
+    def __compile(field, accumulators):
+        if field.field:
+            if not isinstance(field.field, TypedField) or isinstance(field.field, (CompositeField, DynamicField)):
+                return None
+            name, type, units = field.field.name, field.field.type, field.field._units
+            scale, offset = field.field._scale or 1, field.field._offset
+            if name in accumulators:
+                return None
+        else:
+            name, type, units = '@%d:%d' % (field.start, field.finish), field.base_type, None
+            scale, offset = 1, 0
+        base = type.base_type if isinstance(type, Mapping) else type
+        if field.count and isinstance(base, (AutoInteger, AutoFloat)) and not isinstance(base, (Date, Date16)) \
+                and base.n_bytes * field.count == field.size:
+            return name, type, scale, offset, units
+
+    def unpack(self, data, map_values=True, check_bad=True, **options):
+        values = self.__struct.unpack_from(data)
+        for step in self.__steps:
+            if step is None:
+                yield None
+            else:
+                name, index, count, start, finish, bad, all_bad, scale, offset, units, mapping, unknown = step
+                if (check_bad or unknown) and data[start:finish] == all_bad:
+                    yield name, (None, units)
+                    continue
+                parsed = values[index:index+count]
+                if scale is not None:
+                    if count == 1:
+                        parsed = (parsed[0] / scale - offset,)
+                    else:  # match weird CSV behaviour (isolated bad values are not scaled)
+                        size = len(bad)
+                        parsed = tuple(value if data[start+size*i:start+size*(i+1)] == bad else value / scale - offset
+                                       for i, value in enumerate(parsed))
+                if mapping and map_values:
+                    parsed = tuple(mapping.safe_internal_to_profile(value) for value in parsed)
+                yield name, (parsed, units)
+
+
 class RowMessage(Message):
 
     def __init__(self, log, row, rows, types, warn=False):
@@ -110,6 +195,9 @@ class Messages:
     def profile_to_message(self, name):
         return self.__profile_to_message[name]
 
+    def values(self):
+        return self.__profile_to_message.values()
+
     def number_to_message(self, number):
         try:
             return self.__number_to_message[number]
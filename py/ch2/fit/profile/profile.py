@@ -1,11 +1,14 @@
 
+from contextlib import contextmanager
 from logging import getLogger
-from os.path import join, dirname
-from pickle import load, dump
+from mmap import mmap, ACCESS_READ
+from os.path import join, dirname, getsize
+from traceback import clear_frames
 
 import openpyxl as xls
-from pkg_resources import resource_stream
+from pkg_resources import resource_filename
 
+from .compact import CompactProfile, write_compact
 from .messages import Messages
 from .support import NullableLog
 from .types import Types
@@ -27,19 +30,16 @@ def read_external_profile(path, warn=False):
 
 def read_internal_profile():
     if not PROFILE:
-        log.debug('Unpickling profile')
+        log.debug('Mapping profile')
         try:
-            input = resource_stream(__name__, PROFILE_NAME)
-            PROFILE.append(load(input))
-            input.close()
-        except FileNotFoundError:
-            log.warning('There was a problem reading the pickled profile.')
+            PROFILE.append(CompactProfile(resource_filename(__name__, PROFILE_NAME), log))
+        except Exception as e:
+            log.warning(f'There was a problem reading the pickled profile: {e}')
             log.warning('If you installed via pip then please create an issue at')
             log.warning('https://github.com/andrewcooke/choochoo for support.')
             log.warning('If you installed via git please see `ch2 help %s`' % PACKAGE_FIT_PROFILE)
             raise FatalException('Could not read %s (see log for more details)' % PROFILE_NAME)
-        PROFILE[0][0].set_log(log)
-    return PROFILE[0][1:]
+    return PROFILE[0].types, PROFILE[0].messages
 
 
 def read_profile(warn=False, profile_path=None):
@@ -58,14 +58,34 @@ def read_fit(fit_path):
         return input.read()
 
 
+@contextmanager
+def map_fit(fit_path):
+    '''
+    An alternative to read_fit() that maps the file into memory (read-only) instead of reading it.
+    The parser works with memoryviews, so the data are never copied.
+
+    Anything that references the data (tokens, raw values) must be released before the context exits
+    (otherwise the file cannot be unmapped and closing raises BufferError).
+    '''
+    log.debug('Mapping fit file from %s' % fit_path)
+    if not getsize(fit_path):
+        yield b''  # cannot map empty files
+        return
+    with open(fit_path, 'rb') as input, mmap(input.fileno(), 0, access=ACCESS_READ) as data:
+        try:
+            yield data
+        except BaseException as e:
+            # the parser's frames (in the traceback) still reference the data
+            clear_frames(e.__traceback__)
+            raise
+
+
 def pickle_profile(in_path, warn=False):
     log.info('Reading from %s' % in_path)
     nlog, types, messages = read_external_profile(in_path, warn=warn)
     out_path = join(dirname(__file__), PROFILE_NAME)
-    nlog.set_log(None)
     log.info('Writing to %s' % out_path)
-    with open(out_path, 'wb') as output:
-        dump((nlog, types, messages), output)
+    write_compact(out_path, nlog, types, messages)
     # test loading
     log.info('Test loading from %r' % PROFILE_NAME)
     log.info('Loaded %s, %s' % read_internal_profile())
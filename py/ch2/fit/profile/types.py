@@ -26,6 +26,12 @@ class AbstractType(Named):
     def is_bad(self, bytes, count, endian):
         return False
 
+    def dtype(self, endian):
+        '''
+        The numpy dtype (as a string) used when decoding many values at once, or None if not supported.
+        '''
+        return None
+
     @abstractmethod
     def profile_to_internal(self, cell_contents):
         raise NotImplementedError('%s: %s' % (self.__class__.__name__, self.name))
@@ -221,6 +227,12 @@ class AutoInteger(StructSupport):
     def is_bad(self, bytes, count, endian):
         return self._all_bad(bytes, self.__bad[endian], count)
 
+    def bad(self, endian):
+        return bytes(self.__bad[endian])
+
+    def dtype(self, endian):
+        return self.__formats[endian].replace('%d', '')
+
     def parse_type(self, data, count, endian, timestamp, check_bad=True, **options):
         return self._unpack(data, self.__formats, self.__bad, count, endian, check_bad=check_bad, **options)
 
@@ -338,6 +350,12 @@ class AutoFloat(StructSupport):
     def is_bad(self, bytes, count, endian):
         return self._all_bad(bytes, self.__bad[endian], count)
 
+    def bad(self, endian):
+        return bytes(self.__bad[endian])
+
+    def dtype(self, endian):
+        return self.__formats[endian].replace('%d', '')
+
     def parse_type(self, data, count, endian, timestamp, check_bad=True, **options):
         return self._unpack(data, self.__formats, self.__bad, count, endian, check_bad=check_bad, **options)
 
@@ -369,6 +387,12 @@ class Mapping(AbstractType):
         except KeyError:
             return value
 
+    def bad(self, endian):
+        return self.base_type.bad(endian)
+
+    def dtype(self, endian):
+        return self.base_type.dtype(endian)
+
     # default here for check_bad sets whether mappings can be considered bad or not
     # tests against CSV suggest they can (battery_level)
     def parse_type(self, bytes, size, endian, timestamp, map_values=True, check_bad=True, **options):
@@ -441,6 +465,9 @@ class Types:
     def is_type(self, name):
         return name in self.__profile_to_type
 
+    def values(self):
+        return self.__profile_to_type.values()
+
     def profile_to_type(self, name, auto_create=False):
         try:
             return self.__profile_to_type[name]
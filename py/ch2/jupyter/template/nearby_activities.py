@@ -25,7 +25,7 @@ def nearby_activities():
     ## Load Group
     '''
     s = session('-v2')
-    groups = read_query(s.query(ActivityNearby))
+    groups = read_query(s.query(ActivityNearby), stream=True)
     n_groups = len(groups.group.unique())
 
     '''
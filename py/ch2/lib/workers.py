@@ -1,13 +1,24 @@
 from contextlib import contextmanager
 from logging import getLogger
-from os import getpid
-from sys import argv
+from os import getpid, dup, dup2, fdopen
+from sys import argv, stdout
 
 from math import floor
 
 log = getLogger(__name__)
 
 
+def reserve_stdout():
+    '''
+    Return a file that writes to the original stdout, and send everything else (including output
+    from libraries) to stderr instead, so that a channel back to the parent process is not corrupted.
+    '''
+    stdout.flush()
+    output = fdopen(dup(1), 'w')
+    dup2(2, 1)
+    return output
+
+
 def command_root():
     try:
         with open(f'/proc/{getpid()}/cmdline', 'rb') as f:
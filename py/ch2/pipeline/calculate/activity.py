@@ -38,7 +38,8 @@ class ActivityCalculator(LoaderMixin, OwnerInMixin,
 
     def _read_dataframe(self, s, ajournal):
         try:
-            adf = Statistics(s, activity_journal=ajournal, with_timespan=True). \
+            adf = Statistics(s, activity_journal=ajournal, with_timespan=True, bulk=True,
+                             frame_cache=self._frame_cache). \
                 by_name(SegmentReader, N.DISTANCE, N.HEART_RATE, N.SPHERICAL_MERCATOR_X, N.SPHERICAL_MERCATOR_Y). \
                 by_name(ElevationCalculator, N.ELEVATION). \
                 by_name(ImpulseCalculator, N.HR_ZONE). \
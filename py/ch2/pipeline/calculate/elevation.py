@@ -1,6 +1,8 @@
 
 from logging import getLogger
 
+import pandas as pd
+
 from .utils import ProcessCalculator, ActivityJournalCalculatorMixin, DataFrameCalculatorMixin
 from ..pipeline import LoaderMixin
 from ...common.math import is_nan
@@ -9,6 +11,7 @@ from ...data.elevation import smooth_elevation
 from ...data.frame import present
 from ...names import N, Titles, Units
 from ...sql import StatisticJournalFloat
+from ...srtm.bilinear import bilinear_elevation_from_constant
 
 log = getLogger(__name__)
 
@@ -19,10 +22,15 @@ class ElevationCalculator(LoaderMixin, ActivityJournalCalculatorMixin, DataFrame
         self.smooth = smooth
         super().__init__(*args, **kargs)
 
+    def _startup(self, s):
+        super()._startup(s)
+        self.__oracle = bilinear_elevation_from_constant(s)
+
     def _read_dataframe(self, s, ajournal):
         from ..owners import SegmentReader
         try:
-            return Statistics(s, activity_journal=ajournal, with_timespan=True). \
+            return Statistics(s, activity_journal=ajournal, with_timespan=True, bulk=True,
+                              frame_cache=self._frame_cache). \
                 by_name(SegmentReader, N.DISTANCE, N.RAW_ELEVATION, N.ELEVATION, N.ALTITUDE).df
         except Exception as e:
             log.warning(f'Failed to generate statistics for elevation: {e}')
@@ -30,6 +38,8 @@ class ElevationCalculator(LoaderMixin, ActivityJournalCalculatorMixin, DataFrame
 
     def _calculate_stats(self, s, ajournal, df):
         if not present(df, N.ELEVATION):
+            if not present(df, N.RAW_ELEVATION):
+                self._add_raw_elevation(s, ajournal, df)
             if present(df, N.RAW_ELEVATION):
                 df = smooth_elevation(df, smooth=self.smooth)
             elif present(df, N.ALTITUDE):
@@ -39,6 +49,22 @@ class ElevationCalculator(LoaderMixin, ActivityJournalCalculatorMixin, DataFrame
         else:
             return None
 
+    def _add_raw_elevation(self, s, ajournal, df):
+        # if srtm data were not available when the activity was read, calculate for the whole activity now
+        from ..owners import SegmentReader
+        positions = Statistics(s, activity_journal=ajournal). \
+            by_name(SegmentReader, N.LATITUDE, N.LONGITUDE).df
+        if present(positions, N.LATITUDE, N.LONGITUDE):
+            try:
+                elevations = self.__oracle.elevations(positions[N.LATITUDE].values, positions[N.LONGITUDE].values)
+            except Exception as e:
+                # eg a missing tile - fall back to altitude
+                log.warning(f'Cannot calculate {N.RAW_ELEVATION} from position: {e}')
+                return
+            if elevations is not None:
+                log.debug(f'Calculated {N.RAW_ELEVATION} from position')
+                df[N.RAW_ELEVATION] = pd.Series(elevations, index=positions.index)
+
     def _copy_results(self, s, ajournal, loader, df):
         for time, row in df.iterrows():
             if N.ELEVATION in row and not is_nan(row[N.ELEVATION]):
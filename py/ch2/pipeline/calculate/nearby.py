@@ -1,6 +1,6 @@
 
 from collections import defaultdict, namedtuple
-from itertools import groupby
+from itertools import groupby, chain
 from logging import getLogger
 from random import uniform
 
@@ -15,7 +15,8 @@ from ...lib.dbscan import DBSCAN
 from ...lib.optimizn import expand_max
 from ...names import Names
 from ...rtree import MatchType
-from ...rtree.spherical import SQRTree
+from ...rtree.grid import SGrid
+from ...rtree.spherical import SQRTree, SSTRTree, LocalTangent
 from ...sql import ActivityJournal, ActivityGroup, ActivitySimilarity, ActivityNearby, StatisticName, \
     StatisticJournal, StatisticJournalFloat, Timestamp
 
@@ -26,9 +27,10 @@ Nearby = namedtuple('Nearby', 'constraint, activity_group, border, start, finish
 
 class SimilarityCalculator(OwnerInMixin, ProcessCalculator):
 
-    def __init__(self, *args, fraction=0.01, border=150, **kargs):
+    def __init__(self, *args, fraction=0.01, border=150, grid=False, **kargs):
         self.fraction = fraction
         self.border = border
+        self.grid = grid  # use SGrid rather than rtrees
         super().__init__(*args, **kargs)
 
     def startup(self):
@@ -53,47 +55,52 @@ class SimilarityCalculator(OwnerInMixin, ProcessCalculator):
 
     def _run_one(self, missed):
         with self._config.db.session_context() as s:
-            rtree = SQRTree(default_match=MatchType.OVERLAP, default_border=self.border)
             n_points = defaultdict(lambda: 0)
-            self._prepare(s, rtree, n_points, 30000)
+            old, new = self._prepare(s, n_points, 30000)
             n_overlaps = defaultdict(lambda: defaultdict(lambda: 0))
-            new_ids, affected_ids = self._count_overlaps(s, rtree, n_points, n_overlaps, 10000)
+            new_ids, affected_ids = self._count_overlaps(s, old, new, n_points, n_overlaps, 10000)
             # this clears itself beforehand
             # use explicit class to distinguish from subclasses (which compare against this)
             with Timestamp(owner=self.owner_out).on_success(s):
                 self._save(s, new_ids, affected_ids, n_points, n_overlaps, 10000)
 
-    def _prepare(self, s, rtree, n_points, delta):
-        n = 0
+    def _prepare(self, s, n_points, delta):
+        items = []
         for aj_id_in, lon, lat in self._filter(self._aj_lon_lat(s, new=False)):
-            posn = [(lon, lat)]
-            rtree[posn] = aj_id_in
+            items.append(([(lon, lat)], aj_id_in))
             n_points[aj_id_in] += 1
-            n += 1
-            if n % delta == 0:
-                log.info(f'Loaded {n} points')
-        if n % delta:
-            log.info(f'Loaded {n} points')
+            if len(items) % delta == 0:
+                log.info(f'Read {len(items)} points')
+        if self.grid:
+            # a single grid for both existing and new points
+            old = new = SGrid(items, default_match=MatchType.OVERLAP, default_border=self.border)
+        else:
+            # existing points are bulk loaded into a packed tree; new points are added incrementally.
+            # both share a plane so that the border is measured as it would be with a single tree.
+            plane = LocalTangent()
+            old = SSTRTree(items, default_match=MatchType.OVERLAP, default_border=self.border, plane=plane)
+            new = SQRTree(default_match=MatchType.OVERLAP, default_border=self.border, plane=plane)
+        log.info(f'Loaded {len(items)} points')
+        return old, new
 
-    def _count_overlaps(self, s, rtree, n_points, n_overlaps, delta):
+    def _count_overlaps(self, s, old, new, n_points, n_overlaps, delta):
         new_aj_ids, affected_aj_ids, n, no = [], set(), 0, 0
         for aj_id_in, aj_lon_lats in groupby(self._aj_lon_lat(s, new=True), key=lambda aj_lon_lat: aj_lon_lat[0]):
-            aj_lon_lats = list(self._filter(aj_lon_lats))  # reuse below
+            posns = [[(lon, lat)] for _, lon, lat in self._filter(aj_lon_lats)]  # reuse below
             seen_posns = set()
             new_aj_ids.append(aj_id_in)
             affected_aj_ids.add(aj_id_in)
-            for _, lon, lat in aj_lon_lats:
-                posn = [(lon, lat)]
-                for other_posn, aj_id_out in rtree.get_items(posn):
-                    if other_posn not in seen_posns:
-                        lo, hi = min(aj_id_in, aj_id_out), max(aj_id_in, aj_id_out)  # ordered pair
-                        affected_aj_ids.add(aj_id_out)
-                        n_overlaps[lo][hi] += 1
-                        no += 1
-                        seen_posns.add(other_posn)
-            for _, lon, lat in aj_lon_lats:  # adding after avoids matching ourselves
-                posn = [(lon, lat)]
-                rtree[posn] = aj_id_in
+            # all points for the activity are matched together
+            indices = (old,) if old is new else (old, new)
+            for _, (other_posn, aj_id_out) in chain(*(index.get_all_items(posns) for index in indices)):
+                if other_posn not in seen_posns:
+                    lo, hi = min(aj_id_in, aj_id_out), max(aj_id_in, aj_id_out)  # ordered pair
+                    affected_aj_ids.add(aj_id_out)
+                    n_overlaps[lo][hi] += 1
+                    no += 1
+                    seen_posns.add(other_posn)
+            for posn in posns:  # adding after avoids matching ourselves
+                new[posn] = aj_id_in
                 n_points[aj_id_in] += 1
                 n += 1
                 if n % delta == 0:
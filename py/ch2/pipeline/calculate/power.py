@@ -61,7 +61,8 @@ class PowerCalculator(LoaderMixin, ActivityGroupCalculatorMixin, DataFrameCalcul
         from ..owners import SegmentReader, ElevationCalculator
         try:
             self._set_power(s, ajournal)
-            df = Statistics(s, activity_journal=ajournal, with_timespan=True). \
+            df = Statistics(s, activity_journal=ajournal, with_timespan=True, bulk=True,
+                            frame_cache=self._frame_cache). \
                 by_name(SegmentReader, N.DISTANCE, N.SPEED, N.CADENCE). \
                 by_name(ElevationCalculator, N.ELEVATION).df
             ldf = linear_resample_time(df)
@@ -1,30 +1,22 @@
 
+from collections import defaultdict
 from logging import getLogger
-from random import choice
 
-from sqlalchemy import func, inspect, and_, select
+from sqlalchemy import func, inspect, and_, select, literal, union_all, null, DateTime, Integer, case, cast, Float
 
 from .utils import ProcessCalculator, IntervalCalculatorMixin
 from ..pipeline import LoaderMixin
 from ...data.frame import _tables
 from ...common.date import local_date_to_time
+from ...common.log import log_current_exception
 from ...names import Summaries as S
-from ...sql.tables.source import Interval, Source
+from ...sql.tables.source import Interval
 from ...sql.tables.statistic import StatisticJournal, StatisticName, StatisticMeasure, StatisticJournalInteger, \
     StatisticJournalFloat, TYPE_TO_JOURNAL_CLASS, STATISTIC_JOURNAL_CLASSES
 
 log = getLogger(__name__)
 
 
-def fuzz(n, q):
-    # n is number of points, q is quartile (0-4).
-    # return index for quartile that is unbiased when location not exact
-    i = (n-1) * q / 4
-    if i != int(i):
-        i = int(i) + choice([0, 1])  # if we're between two points, pick either
-    return int(i)
-
-
 class SummaryCalculator(LoaderMixin, IntervalCalculatorMixin, ProcessCalculator):
 
     # todo - this should have a worker per activity group
@@ -36,6 +28,93 @@ class SummaryCalculator(LoaderMixin, IntervalCalculatorMixin, ProcessCalculator)
         Interval.clean(s)
         super()._startup(s)
 
+    def _run_many(self, missing):
+        # all intervals for the batch are created first and then calculated together
+        with self._config.db.session_context() as s:
+            intervals = [interval for missed in missing for interval in self._add_intervals(s, missed)]
+            if intervals:
+                try:
+                    # a loader per activity group because they share names and times
+                    # (created once per group, since only the first loader gets the batch callback)
+                    loaders = {activity_group_id: self._get_loader(s, add_serial=False, clear_timestamp=False)
+                               for activity_group_id in {interval.activity_group_id for interval in intervals}}
+                    self._calculate_all_results(s, intervals, loaders)
+                    for loader in loaders.values():
+                        if loader: loader.load()
+                except Exception as e:
+                    log.error(f'No statistics for {len(intervals)} intervals due to error ({e})')
+                    log_current_exception()
+
+    def _calculate_all_results(self, s, intervals, loaders):
+        # a single query (per journal table) that groups by time range (shared by all activity groups),
+        # statistic name and activity group.  this replaces _read_data() and _calculate_value() for each
+        # interval, which are still used by _run_one().
+        log.debug(f'Calculating summaries for {len(intervals)} intervals')
+        ranges = sorted(set((local_date_to_time(interval.start), local_date_to_time(interval.finish))
+                            for interval in intervals))
+        range_to_index = {limits: i for i, limits in enumerate(ranges)}
+        rows, names_in_range = {}, defaultdict(set)
+        for row in self._summarise(s, ranges):
+            rows[(row.range, row.statistic_name_id, row.activity_group_id)] = row
+            names_in_range[row.range].add(row.statistic_name_id)
+        statistic_names = {statistic_name.id: statistic_name for statistic_name in
+                           s.query(StatisticName).filter(StatisticName.summary != None).all()}
+        for interval in intervals:
+            start, finish = local_date_to_time(interval.start), local_date_to_time(interval.finish)
+            index = range_to_index[(start, finish)]
+            # as for _read_data(), names with data in the interval for any activity group
+            for statistic_name_id in names_in_range[index]:
+                statistic_name = statistic_names[statistic_name_id]
+                row = rows.get((index, statistic_name_id, interval.activity_group_id))
+                summaries = statistic_name.summaries
+                for summary in summaries:
+                    if summary == S.MSR:
+                        if row:
+                            self._calculate_measures(s, statistic_name, S.MIN in summaries, start, finish,
+                                                     interval)
+                        continue
+                    if row:
+                        value = getattr(row, summary)
+                    else:
+                        value = 0 if summary == S.CNT else None
+                    if value is not None:
+                        units = None if summary == S.CNT else statistic_name.units
+                        title = self.fmt_title(statistic_name.title, summary, self.schedule)
+                        if summary in (S.MAX, S.MIN, S.SUM):
+                            new_type = TYPE_TO_JOURNAL_CLASS[type(value)]
+                        elif summary in (S.AVG,):
+                            new_type = StatisticJournalFloat
+                        else:
+                            new_type = StatisticJournalInteger
+                        loaders[interval.activity_group_id].add(
+                            title, units, None, interval, value, start, new_type,
+                            description=self._describe(statistic_name, summary, interval))
+        s.commit()
+
+    def _summarise(self, s, ranges):
+        t = _tables()
+        bounds = union_all(*[select([literal(i, Integer).label('range'),
+                                     literal(start, DateTime(timezone=True)).label('start'),
+                                     literal(finish, DateTime(timezone=True)).label('finish')])
+                             for i, (start, finish) in enumerate(ranges)]).alias()
+        for sjx in (t.sji, t.sjf, t.sjt):
+            numeric = sjx is not t.sjt
+            stmt = select([bounds.c.range, t.sj.c.statistic_name_id, t.src.c.activity_group_id,
+                           func.max(sjx.c.value).label(S.MAX),
+                           func.min(sjx.c.value).label(S.MIN),
+                           (func.sum(sjx.c.value) if numeric else null()).label(S.SUM),
+                           func.count(sjx.c.value).label(S.CNT),
+                           (func.avg(sjx.c.value) if numeric else null()).label(S.AVG)]). \
+                select_from(sjx.join(t.sj, t.sj.c.id == sjx.c.id).
+                            join(t.src, t.src.c.id == t.sj.c.source_id).
+                            join(t.sn, t.sn.c.id == t.sj.c.statistic_name_id).
+                            join(bounds, and_(t.sj.c.time >= bounds.c.start, t.sj.c.time < bounds.c.finish))). \
+                where(and_(t.sn.c.summary != None,
+                           t.sj.c.time >= ranges[0][0],
+                           t.sj.c.time < max(finish for _, finish in ranges))). \
+                group_by(bounds.c.range, t.sj.c.statistic_name_id, t.src.c.activity_group_id)
+            yield from s.connection().execute(stmt)
+
     def _read_data(self, s, interval):
         # here, data is only statistics names, because calculation also involves loading data
         start, finish = local_date_to_time(interval.start), local_date_to_time(interval.finish)
@@ -52,12 +131,11 @@ class SummaryCalculator(LoaderMixin, IntervalCalculatorMixin, ProcessCalculator)
     def _calculate_results(self, s, interval, data, loader):
         log.debug('Calculating summaries')
         start, finish = local_date_to_time(interval.start), local_date_to_time(interval.finish)
-        measures = []
         for statistic_name in data:
             summaries = statistic_name.summaries
             for summary in summaries:
                 value, units = self._calculate_value(s, statistic_name, summary, S.MIN in summaries,
-                                                     start, finish, interval, measures)
+                                                     start, finish, interval)
                 if value is not None:
                     title = self.fmt_title(statistic_name.title, summary, self.schedule)
                     # we need to infer the type
@@ -69,13 +147,9 @@ class SummaryCalculator(LoaderMixin, IntervalCalculatorMixin, ProcessCalculator)
                         new_type = StatisticJournalInteger
                     loader.add(title, units, None, interval, value, start, new_type,
                                description=self._describe(statistic_name, summary, interval))
-        # add and commit these here - what else can we do?
-        log.debug(f'Adding {len(measures)} measures')
-        for measure in measures:
-            s.add(measure)
         s.commit()
 
-    def _calculate_value(self, s, statistic_name, summary, order_asc, start_time, finish_time, interval, measures):
+    def _calculate_value(self, s, statistic_name, summary, order_asc, start_time, finish_time, interval):
 
         t = _tables()
         sjx = inspect(STATISTIC_JOURNAL_CLASSES[statistic_name.statistic_journal_type]).local_table
@@ -94,7 +168,7 @@ class SummaryCalculator(LoaderMixin, IntervalCalculatorMixin, ProcessCalculator)
         elif summary == S.AVG:
             result = func.avg(sjx.c.value)
         elif summary == S.MSR:
-            self._calculate_measures(s, statistic_name, order_asc, start_time, finish_time, interval, measures)
+            self._calculate_measures(s, statistic_name, order_asc, start_time, finish_time, interval)
             return None, None
         else:
             raise Exception('Bad summary: %s' % summary)
@@ -119,29 +193,33 @@ class SummaryCalculator(LoaderMixin, IntervalCalculatorMixin, ProcessCalculator)
             period = 'one ' + period
         return f'The {adjective} {statistic_name.title} over {period}.'
 
-    def _calculate_measures(self, s, statistic_name, order_asc, start_time, finish_time, interval, measures):
-        data = sorted([x for x in
-                       s.query(StatisticJournal).
-                      join(Source).
-                      filter(StatisticJournal.statistic_name == statistic_name,
-                             StatisticJournal.time >= start_time,
-                             StatisticJournal.time < finish_time,
-                             Source.activity_group == interval.activity_group).all()
-                       if x is not None and x.value is not None],
-                      key=lambda x: x.value, reverse=not order_asc)
-        n, local_measures = len(data), []
-        for rank, journal in enumerate(data, start=1):
-            if n > 1:
-                percentile = (n - rank) / (n - 1) * 100
-            else:
-                percentile = 100
-            measure = StatisticMeasure(statistic_journal=journal, source=interval, rank=rank, percentile=percentile)
-            local_measures.append(measure)
-            measures.append(measure)
-        if n > 8:  # avoid overlap in fuzzing (and also, plot individual points in this case)
-            for q in range(5):
-                local_measures[fuzz(n, q)].quartile = q
-        log.debug('Ranked %s' % statistic_name)
+    def _calculate_measures(self, s, statistic_name, order_asc, start_time, finish_time, interval):
+        # rank (equal values share a rank) and percentile (100 is best) are calculated in the database.
+        # quartile marks the min, 25%, median, 75% and max points (rounding to even when between two points).
+        t = _tables()
+        sjx = inspect(STATISTIC_JOURNAL_CLASSES[statistic_name.statistic_journal_type]).local_table
+        sm = inspect(StatisticMeasure).local_table
+        order = sjx.c.value.asc() if order_asc else sjx.c.value.desc()
+        ranked = select([t.sj.c.id,
+                         func.rank().over(order_by=order).label('rank'),
+                         (100 * (1 - func.percent_rank().over(order_by=order))).label('percentile'),
+                         (func.row_number().over(order_by=(order, t.sj.c.id)) - 1).label('position'),
+                         func.count().over().label('n')]). \
+            select_from(sjx.join(t.sj, t.sj.c.id == sjx.c.id).join(t.src, t.src.c.id == t.sj.c.source_id)). \
+            where(and_(t.sj.c.statistic_name_id == statistic_name.id,
+                       t.sj.c.time >= start_time,
+                       t.sj.c.time < finish_time,
+                       t.src.c.activity_group_id == interval.activity_group_id,
+                       sjx.c.value != None)).alias()
+        # avoid overlap for small n (and also, plot individual points in this case)
+        quartile = case([(and_(ranked.c.n > 8,
+                               ranked.c.position == func.round(cast((ranked.c.n - 1) * q, Float) / 4)), q)
+                         for q in range(5)], else_=null())
+        stmt = sm.insert().from_select(['statistic_journal_id', 'source_id', 'rank', 'percentile', 'quartile'],
+                                       select([ranked.c.id, literal(interval.id, Integer), ranked.c.rank,
+                                               ranked.c.percentile, quartile]))
+        n = s.connection().execute(stmt).rowcount
+        log.debug(f'Ranked {n} values for {statistic_name}')
 
     @classmethod
     def parse_title(cls, name):
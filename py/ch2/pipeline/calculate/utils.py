@@ -5,8 +5,10 @@ from sqlalchemy import not_
 from sqlalchemy.sql.functions import count
 
 from ..pipeline import ProcessPipeline
+from ...commands.args import BASE
 from ...common.date import time_to_local_timeq, format_dateq
 from ...common.log import log_current_exception, log_query
+from ...data.cache import ActivityFrameCache
 from ...lib import local_time_to_time, to_date
 from ...lib.schedule import Schedule
 from ...sql import Timestamp, StatisticName, StatisticJournal, ActivityJournal, ActivityGroup, SegmentJournal, Interval, \
@@ -78,6 +80,7 @@ class DataFrameCalculatorMixin:
         self.__add_serial = add_serial
         self.__timestamp_constraint = timestamp_constraint
         super().__init__(*args, **kargs)
+        self._frame_cache = ActivityFrameCache(self._config.args[BASE])  # values read from activity files
 
     def _run_one(self, missed):
         with self._config.db.session_context() as s:
@@ -132,32 +135,36 @@ class IntervalCalculatorMixin:
                                                      exclude_owners=(SummaryCalculator,))]
 
     def _run_one(self, missed):
-        start = to_date(missed)
         with self._config.db.session_context() as s:
-            activity_groups = [None] + (list(s.query(ActivityGroup).all()) if self.grouped else [])
-            for activity_group in activity_groups:
-                log.debug(f'Activity group: {activity_group}; Schedule: {self.schedule}')
-                if s.query(Interval). \
-                        filter(Interval.schedule == self.schedule,
-                               Interval.owner == self.owner_out,
-                               Interval.start == start,
-                               Interval.activity_group == activity_group).one_or_none():
-                    # we can have some activity groups, but not others
-                    log.warning(f'Interval already exists for '
-                                f'{activity_group} / {self.schedule} at {missed}')
-                else:
-                    interval = add(s, Interval(schedule=self.schedule, owner=self.owner_out,
-                                               start=start, activity_group=activity_group,
-                                               permanent=self.permanent))
-                    s.commit()
-                    try:
-                        data = self._read_data(s, interval)
-                        loader = self._get_loader(s, add_serial=False, clear_timestamp=False)
-                        self._calculate_results(s, interval, data, loader)
-                        loader.load()
-                    except Exception as e:
-                        log.error(f'No statistics for {missed} due to error ({e})')
-                        log_current_exception()
+            for interval in self._add_intervals(s, missed):
+                try:
+                    data = self._read_data(s, interval)
+                    loader = self._get_loader(s, add_serial=False, clear_timestamp=False)
+                    self._calculate_results(s, interval, data, loader)
+                    loader.load()
+                except Exception as e:
+                    log.error(f'No statistics for {missed} due to error ({e})')
+                    log_current_exception()
+
+    def _add_intervals(self, s, missed):
+        start = to_date(missed)
+        activity_groups = [None] + (list(s.query(ActivityGroup).all()) if self.grouped else [])
+        for activity_group in activity_groups:
+            log.debug(f'Activity group: {activity_group}; Schedule: {self.schedule}')
+            if s.query(Interval). \
+                    filter(Interval.schedule == self.schedule,
+                           Interval.owner == self.owner_out,
+                           Interval.start == start,
+                           Interval.activity_group == activity_group).one_or_none():
+                # we can have some activity groups, but not others
+                log.warning(f'Interval already exists for '
+                            f'{activity_group} / {self.schedule} at {missed}')
+            else:
+                interval = add(s, Interval(schedule=self.schedule, owner=self.owner_out,
+                                           start=start, activity_group=activity_group,
+                                           permanent=self.permanent))
+                s.commit()
+                yield interval
 
     @abstractmethod
     def _read_data(self, s, interval):
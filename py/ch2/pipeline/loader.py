@@ -1,53 +1,215 @@
 from abc import ABC
+from array import array
 from collections import defaultdict, namedtuple
+from itertools import compress
 from logging import getLogger
 
-from ..common.date import min_time, max_time
+import numpy as np
+import pandas as pd
+
+from ..common.date import extend_range
 from ..common.math import is_nan
 from ..names import simple_name
-from ..sql import StatisticName, Interval, Source, StatisticJournalTimestamp
+from ..sql import StatisticName, Interval, Source, StatisticJournal, StatisticJournalTimestamp, \
+    StatisticJournalInteger, StatisticJournalFloat
+from ..sql.batch import next_ids, copy_rows, copy_text
 from ..sql.tables.statistic import STATISTIC_JOURNAL_CLASSES, STATISTIC_JOURNAL_TYPES
 
 log = getLogger(__name__)
 
 
+class Staged:
+    '''
+    The values for a single statistic, held as columns (times, values, serials and source ids).
+
+    Integer and float values are packed into arrays; text values are a list; timestamps have no separate
+    values (the value is the time).  Times are references to the (usually shared) datetime instances.
+    Duplicate times are found (and resolved) together, when the data are needed.
+    '''
+
+    def __init__(self, statistic_name, add_serial):
+        self.statistic_name = statistic_name
+        self.journal_class = STATISTIC_JOURNAL_CLASSES[statistic_name.statistic_journal_type]
+        self.times = []
+        if self.journal_class == StatisticJournalInteger:
+            self.values = array('q')
+        elif self.journal_class == StatisticJournalFloat:
+            self.values = array('d')
+        elif self.journal_class == StatisticJournalTimestamp:
+            self.values = self.times
+        else:
+            self.values = []
+        self.serials = array('q') if add_serial else None
+        self.source_ids = array('q')
+        self.__clean = True
+
+    def add(self, time, value, serial, source_id):
+        if self.journal_class == StatisticJournalInteger:
+            if value != int(value):
+                raise Exception(f'Non-integral value for {self.statistic_name.name}: {value}')
+            value = int(value)
+        self.times.append(time)
+        if self.values is not self.times:
+            self.values.append(value)
+        if self.serials is not None:
+            self.serials.append(serial)
+        self.source_ids.append(source_id)
+        self.__clean = False
+
+    def __len__(self):
+        return len(self.times)
+
+    def rows(self):
+        serials = self.serials if self.serials is not None else [None] * len(self)
+        return zip(self.times, self.values, serials, self.source_ids)
+
+    def deduplicate(self, resolve):
+        '''
+        Remove repeated times, keeping the first.  If the values differ, resolve(name, time, value, prev)
+        gives the value to keep.
+        '''
+        if self.__clean: return
+        n = len(self)
+        _, first, inverse = np.unique(pd.to_datetime(self.times, utc=True).asi8,
+                                      return_index=True, return_inverse=True)
+        first = first[inverse]
+        duplicates = np.nonzero(first != np.arange(n))[0]
+        if len(duplicates):
+            name = self.statistic_name.name
+            for i, j in zip(duplicates, first[duplicates]):
+                time, value, prev = self.times[i], self.values[i], self.values[j]
+                if value == prev:
+                    log.warning(f'Discarding duplicate for {name} at {time} (value {value})')
+                else:
+                    self.values[j] = resolve(name, time, value, prev)
+            keep = first == np.arange(n)
+            timestamps = self.values is self.times
+            self.times = list(compress(self.times, keep))
+            if timestamps:
+                self.values = self.times
+            elif isinstance(self.values, array):
+                self.values = array(self.values.typecode, compress(self.values, keep))
+            else:
+                self.values = list(compress(self.values, keep))
+            if self.serials is not None:
+                self.serials = array('q', compress(self.serials, keep))
+            self.source_ids = array('q', compress(self.source_ids, keep))
+        self.__clean = True
+
+    def time_ranges(self):
+        '''
+        The earliest and latest times for each source id.
+        '''
+        if not self.source_ids:
+            return {}
+        source_ids = np.frombuffer(self.source_ids, dtype=np.int64)
+        if (source_ids == source_ids[0]).all():
+            return {int(source_ids[0]): (min(self.times), max(self.times))}
+        ranges = {}
+        for time, source_id in zip(self.times, self.source_ids):
+            ranges[source_id] = extend_range(*ranges.get(source_id, (None, None)), time)
+        return ranges
+
+
 class Loader(ABC):
 
-    def __init__(self, s, owner, add_serial=True, clear_timestamp=True, batch=True):
+    def __init__(self, s, owner, add_serial=True, clear_timestamp=True, batch=True, copy=True):
         self._s = s
         self._owner = owner
         self.__serial = 0 if add_serial else None
         self.__clear_timestamp = clear_timestamp
         self.__batch = batch
+        self.__copy = copy and s.bind.dialect.name == 'postgresql'
 
         self.__statistic_name_cache = dict()
         self.__source_cache = dict()
-        self._staging = defaultdict(list)
-        self.__by_name_then_time = defaultdict(dict)
+        self._staging = dict()
         self.__add_serial = add_serial
-        self._start = None
-        self._finish = None
         self.__last_time = None
-        self.__counts = defaultdict(lambda: 0)
 
     def load(self):
         if self:
-            for type in self._staging:
-                log.debug(f'Adding {len(self._staging[type])} instances of {type}')
-                for instance in self._staging[type]:
-                    self._s.add(instance)
-                self._s.commit()
-            self._postload()
+            for staged in self.__deduplicated():
+                log.debug(f'Loading {len(staged)} values for {staged.statistic_name.name}')
+            dirty = self.__dirty_ranges()
+            if self.__copy:
+                self.__copy_staged()
+            else:
+                self.__add_staged()
+            self._postload(dirty)
         else:
             log.warning('No data to load')
 
+    def __deduplicated(self):
+        for staged in self._staging.values():
+            staged.deduplicate(self._resolve_duplicate)
+            yield staged
+
+    def __add_staged(self):
+        # set statistic_name and source (as well as ids) so that we can correctly test in
+        # Source for dirty intervals
+        for staged in self._staging.values():
+            statistic_name, journal_class = staged.statistic_name, staged.journal_class
+            for time, value, serial, source_id in staged.rows():
+                source = self.__source_cache[source_id]
+                if journal_class == StatisticJournalTimestamp:
+                    instance = journal_class(statistic_name=statistic_name, statistic_name_id=statistic_name.id,
+                                             source=source, source_id=source_id, time=time, serial=serial)
+                else:
+                    instance = journal_class(statistic_name=statistic_name, statistic_name_id=statistic_name.id,
+                                             source=source, source_id=source_id, value=value, time=time,
+                                             serial=serial)
+                self._s.add(instance)
+        self._s.commit()
+
+    def __copy_staged(self):
+        # write directly to the tables with COPY, bypassing the session.  that means ids must be taken from
+        # the sequence here (and that Source.before_flush never sees the values - see _postload).
+        self._s.flush()  # so that names have ids
+        ids = iter(next_ids(self._s, StatisticJournal.__table__, 'id',
+                            sum(len(staged) for staged in self._staging.values())))
+        journals, values = [], defaultdict(list)
+        for staged in self._staging.values():
+            type, timestamp = staged.journal_class, staged.journal_class == StatisticJournalTimestamp
+            type_id = copy_text(int(STATISTIC_JOURNAL_TYPES[type]))
+            name_id = copy_text(staged.statistic_name.id)
+            for time, value, serial, source_id in staged.rows():
+                id = copy_text(next(ids))
+                journals.append((id, type_id, name_id, copy_text(source_id), copy_text(time), copy_text(serial)))
+                values[type].append((id,) if timestamp else (id, copy_text(value)))
+        copy_rows(self._s, StatisticJournal.__table__,
+                  ('id', 'type', 'statistic_name_id', 'source_id', 'time', 'serial'), journals)
+        for type in values:
+            copy_rows(self._s, type.__table__, ('id',) if type == StatisticJournalTimestamp else ('id', 'value'),
+                      values[type])
+        self._s.commit()
+
     def __bool__(self):
         return bool(self._staging)
 
-    def _postload(self):
-        # manually clean out intervals because we're doing a fast load
-        if self.__clear_timestamp and self._start and self._finish:
-            Interval.record_dirty_times(self._s, self._start, self._finish)
+    def __dirty_ranges(self):
+        # the time range of the new data for each activity group.  values for intervals do not make
+        # other intervals dirty (unless clearing timestamps, when everything in range is recalculated).
+        groups = self.__activity_groups()
+        ranges = {}
+        for staged in self._staging.values():
+            for source_id, (start, finish) in staged.time_ranges().items():
+                if self.__clear_timestamp or not isinstance(self.__source_cache[source_id], Interval):
+                    group = groups[source_id]
+                    ranges[group] = extend_range(*extend_range(*ranges.get(group, (None, None)), start), finish)
+        return ranges
+
+    def __activity_groups(self):
+        # a single query (sources may have been expired by an earlier commit)
+        self._s.flush()
+        return dict(self._s.query(Source.id, Source.activity_group_id).
+                    filter(Source.id.in_(list(self.__source_cache.keys()))).all())
+
+    def _postload(self, dirty):
+        # mark intervals that overlap the new data (by activity group) with a single update on commit
+        for activity_group_id, (start, finish) in dirty.items():
+            Interval.record_dirty_times(self._s, start, finish, activity_group_id)
+        if dirty:
             self._s.commit()
 
     def add(self, name, units, summary, source, value, time, cls, description=None, title=None):
@@ -81,8 +243,6 @@ class Loader(ABC):
         if is_nan(value):
             raise Exception(f'Bad value for {statistic_name.name}: {value}')
 
-        journal_class = STATISTIC_JOURNAL_CLASSES[statistic_name.statistic_journal_type]
-
         if self.__add_serial:
             if self.__last_time is None:
                 self.__last_time = time
@@ -93,58 +253,48 @@ class Loader(ABC):
                 raise Exception('Time travel - timestamp for statistic decreased')
 
         if isinstance(source, Source):
-            if source.id not in self.__source_cache:
-                self.__source_cache[source.id] = source
+            if source.id is None:
+                self._s.flush()
+            source_id = source.id
+            if source_id not in self.__source_cache:
+                self.__source_cache[source_id] = source
         else:
-            if source not in self.__source_cache:
-                self.__source_cache[source] = Source.from_id(self._s, source)
-            source = self.__source_cache[source]
+            source_id = int(source)  # may be a float from a dataframe
+            if source_id not in self.__source_cache:
+                self.__source_cache[source_id] = Source.from_id(self._s, source_id)
 
-        self._start = min_time(self._start, time)
-        self._finish = max_time(self._finish, time)
+        if statistic_name.name not in self._staging:
+            self._staging[statistic_name.name] = Staged(statistic_name, self.__add_serial)
+        staged = self._staging[statistic_name.name]
+        if staged.journal_class == StatisticJournalTimestamp:
+            time = value
+        staged.add(time, value, self.__serial, source_id)
 
-        # set statistic_name and source (as well as ids) so that we can correctly test in
-        # Source for dirty intervals
-        if journal_class == StatisticJournalTimestamp:
-            instance = journal_class(statistic_name=statistic_name, statistic_name_id=statistic_name.id,
-                                     source=source, source_id=source.id, time=value, serial=self.__serial)
-        else:
-            instance = journal_class(statistic_name=statistic_name, statistic_name_id=statistic_name.id,
-                                     source=source, source_id=source.id, value=value, time=time, serial=self.__serial)
-
-        if instance.time in self.__by_name_then_time[statistic_name.name]:
-            previous = self.__by_name_then_time[statistic_name.name][instance.time]
-            if instance.value == previous.value:
-                log.warning(f'Discarding duplicate for {statistic_name.name} at {instance.time} '
-                            f'(value {instance.value})')
-            else:
-                self._resolve_duplicate(statistic_name.name, instance, previous)
-            return
-        else:
-            self.__by_name_then_time[statistic_name.name][instance.time] = instance
-
-        self._staging[journal_class].append(instance)
-        self.__counts[statistic_name.name] += 1
-
-    def _resolve_duplicate(self, name, instance, prev):
-        raise Exception(f'Conflict at ({instance.time}) for {name} '
-                        f'(values {instance.value}/{prev.value})')
+    def _resolve_duplicate(self, name, time, value, prev):
+        raise Exception(f'Conflict at ({time}) for {name} (values {value}/{prev})')
 
     def as_waypoints(self, names):
         Waypoint = make_waypoint(names.values())
-        time_to_waypoint = defaultdict(lambda: Waypoint())
-        for type in self._staging:
-            for sjournal in self._staging[type]:
-                name = sjournal.statistic_name.name
-                if name in names:
-                    time_to_waypoint[sjournal.time] = \
-                        time_to_waypoint[sjournal.time]._replace(**{'time': sjournal.time,
-                                                                    names[name]: sjournal.value})
-        return [time_to_waypoint[time] for time in sorted(time_to_waypoint.keys())]
+        time_to_values = defaultdict(dict)
+        for staged in self.__deduplicated():
+            name = staged.statistic_name.name
+            if name in names:
+                for time, value in zip(staged.times, staged.values):
+                    time_to_values[time][names[name]] = value
+        return [Waypoint(time=time, **time_to_values[time]) for time in sorted(time_to_values.keys())]
+
+    def numeric(self):
+        '''
+        (statistic name, times, values) for each integer and float statistic.
+        '''
+        for staged in self.__deduplicated():
+            if staged.journal_class in (StatisticJournalInteger, StatisticJournalFloat):
+                yield staged.statistic_name, staged.times, np.frombuffer(staged.values, dtype=staged.values.typecode)
 
     def coverage_percentages(self):
-        total = max(self.__counts.values())
-        for name, count in self.__counts.items():
+        counts = {staged.statistic_name.name: len(staged) for staged in self.__deduplicated()}
+        total = max(counts.values())
+        for name, count in counts.items():
             yield name, 100 * count / total
 
 
@@ -1,11 +1,12 @@
 
 from abc import abstractmethod
 from logging import getLogger
+from shlex import split
 
 from sqlalchemy.sql.functions import count
 
 from .loader import Loader
-from ..commands.args import LOG, WORKER, DEV, PROCESS, CPROFILE
+from ..commands.args import LOG, WORKER, DEV, PROCESS, CPROFILE, POOL
 from ..common.args import mm
 from ..common.global_ import global_dev
 from ..common.names import BASE, UNDEF
@@ -73,6 +74,9 @@ class ProcessPipeline(BasePipeline):
     * startup(), missing(), command_for_missing() (multiple times, invoking worker threads)
       and shutdown() are called in sequence.  The instance is more like a factory in this case.
     In this way startup and shutdown bracket the entire process and are done just once.
+
+    With a worker pool, command_for_pool() replaces command_for_missing() and the worker calls serve(),
+    which processes many batches of missing values in a single process.
     '''
 
     def __init__(self, config, *args, owner_out=None, worker=None, id=None, cprofile=None,
@@ -124,14 +128,32 @@ class ProcessPipeline(BasePipeline):
             missing = self.__args
         else:
             missing = [missed.strip('"') for missed in self.missing()]  # will call delete if forced
+        self._run_many(missing)
+        self.shutdown()
+
+    def _run_many(self, missing):
+        # override to process a batch together
         for missed in missing:
             self._run_one(missed)
-        self.shutdown()
 
     def _run_one(self, missed):
         # this should accept strings
         raise NotImplementedError('_run_one(missed)')
 
+    def serve(self, input, output):
+        '''
+        Run as a long-lived worker.  Each line read from input is a batch of missing values (quoted as
+        for command_for_missing()).  Each batch is acknowledged on output once processed.
+        '''
+        self.startup()
+        for line in input:
+            missing = split(line)
+            log.debug(f'Received batch of {len(missing)} missing values')
+            self._run_many(missing)
+            output.write('done\n')
+            output.flush()
+        self.shutdown()
+
     def command_for_missing(self, pipeline, missing, log_name):
         from .process import fmt_cmd
         cprofile = ''
@@ -144,6 +166,9 @@ class ProcessPipeline(BasePipeline):
         log.debug(fmt_cmd(cmd))
         return cmd
 
+    def command_for_pool(self, pipeline, log_name):
+        return self.command_for_missing(pipeline, [mm(POOL)], log_name)
+
     def __str__(self):
         return str(short_cls(self.__class__))
 
@@ -1,14 +1,21 @@
 from collections import defaultdict
+from json import loads, dumps
+from math import ceil
 from logging import getLogger
 from multiprocessing import cpu_count
+from os import close
 from os.path import join, exists
-from time import sleep
+from selectors import DefaultSelector, EVENT_READ
+from subprocess import PIPE
+from sys import stdin
+from time import time, sleep
 
 from psutil import NoSuchProcess
 
-from ..commands.args import LOG, LOG_DIR
+from ..commands.args import LOG, LOG_DIR, BASE
 from ..common.date import now, format_seconds, time_to_local_time
-from ..sql import PipelineType, Interval, Pipeline
+from ..lib.workers import reserve_stdout
+from ..sql import PipelineType, Interval, Pipeline, SystemConstant
 from ..sql.tables.pipeline import sort_pipelines
 
 log = getLogger(__name__)
@@ -29,6 +36,52 @@ def run_process_pipeline(config, type, *args, like=tuple(), worker=None, **extra
     with config.db.session_context(expire_on_commit=False) as s:
         pipelines = list(sort_pipelines(Pipeline.all(s, type, like=like, id=worker)))
     ProcessRunner(config, pipelines, *args, worker=worker, **extra_kargs).run()
+    if not worker:
+        from ..data.cache import ActivityFrameCache
+        from ..diary.database import refresh_models
+        with config.db.session_context() as s:
+            refresh_models(s)
+            ActivityFrameCache(config.args[BASE]).prune(s)
+
+
+def pidfds(popens):
+    '''
+    A file descriptor for each process that becomes readable when the process exits (Linux 5.3+), or None.
+    '''
+    fds = []
+    try:
+        from os import pidfd_open
+        for popen in popens:
+            fds.append(pidfd_open(popen.pid))
+        return fds
+    except (ImportError, OSError):
+        for fd in fds: close(fd)
+        return None
+
+
+def wait_first(popens, delay=0.1):
+    '''
+    Block until one of the processes exits and return it (reaped, with returncode set).
+
+    Only the given processes are reaped (poll() is waitpid(pid, WNOHANG)), so other children are left
+    for their owners.  Where possible a selector over pidfds wakes us when a process exits; otherwise
+    we poll with a delay.
+    '''
+    fds = pidfds(popens)
+    try:
+        with DefaultSelector() as selector:
+            for fd in fds or []:
+                selector.register(fd, EVENT_READ)
+            while True:
+                for popen in popens:
+                    if popen.poll() is not None:
+                        return popen
+                if fds:
+                    selector.select()
+                else:
+                    sleep(delay)
+    finally:
+        for fd in fds or []: close(fd)
 
 
 def instantiate_pipeline(pipeline, config, *args, **kargs):
@@ -40,7 +93,8 @@ def instantiate_pipeline(pipeline, config, *args, **kargs):
 
 class ProcessRunner:
 
-    def __init__(self, config, pipelines, *args, worker=None, n_cpu=cpu_count(), load=1, **kargs):
+    def __init__(self, config, pipelines, *args, worker=None, n_cpu=cpu_count(), load=1, pool=True,
+                 pool_size=2, **kargs):
         if worker and len(pipelines) > 1: raise Exception('Worker with multiple pipelines')
         if not pipelines: raise Exception('No pipelines')
         self.__config = config
@@ -48,11 +102,15 @@ class ProcessRunner:
         self.__worker = worker
         self.__n_cpu = n_cpu
         self.__load = load
+        self.__capacity = max(1, int(n_cpu * load))
+        self.__pool = pool
+        self.__pool_size = pool_size
         self.__args = args
         self.__kargs = kargs
         self.__max_wait = 0
         self.__max_wait_procs = 0
         self.__max_wait_proc = None
+        self.__freed = None  # when a slot became free (to measure scheduling latency)
 
     def run(self):
         if self.__worker or self.__n_cpu == 1:
@@ -60,25 +118,119 @@ class ProcessRunner:
                 raise Exception(f'Worker with multiple classes {self.__worker}')
             for pipeline in self.__pipelines:
                 self.__run_local(pipeline)
+        elif self.__pool:
+            self.__run_pool(DependencyQueue(self.__config, self.__pipelines, self.__kargs, capacity=self.__capacity))
         else:
-            self.__run_commands(DependencyQueue(self.__config, self.__pipelines, self.__kargs))
+            self.__run_commands(DependencyQueue(self.__config, self.__pipelines, self.__kargs,
+                                                capacity=self.__capacity))
 
     def __run_local(self, pipeline):
         log.info(f'Running pipeline {pipeline} locally with {self.__kargs}')
-        instantiate_pipeline(pipeline, self.__config, *self.__args,
-                             id=self.__worker, worker=bool(self.__worker), **self.__kargs).run()
+        instance = instantiate_pipeline(pipeline, self.__config, *self.__args,
+                                        id=self.__worker, worker=bool(self.__worker), **self.__kargs)
+        if self.__worker and self.__pool:
+            instance.serve(stdin, reserve_stdout())
+        else:
+            instance.run()
+
+    def __run_pool(self, queue):
+        log.info('Scheduling worker pool')
+        # workers are identified by (pipeline, log_index) and ordered by use (idle workers are kept,
+        # so that pipelines can alternate, up to pool_size * capacity)
+        workers, selector = {}, DefaultSelector()
+        try:
+            while True:
+                try:
+                    pipeline, instance, missing, log_index = queue.pop_missing()
+                    key = (pipeline, log_index)
+                    if key in workers:
+                        workers[key] = workers.pop(key)
+                    else:
+                        if len(workers) >= self.__capacity * self.__pool_size:
+                            self.__close_idle(workers, selector, lambda worker: True, n=1)
+                        worker = Worker(self.__config, pipeline, instance, log_index)
+                        workers[key] = worker
+                        selector.register(worker.popen.stdout, EVENT_READ, worker)
+                    workers[key].send(missing)
+                    self.__scheduled(queue)
+                    if sum(worker.busy for worker in workers.values()) == self.__capacity:
+                        self.__run_pool_til_next(workers, selector, queue)
+                except EmptyException:
+                    if any(worker.busy for worker in workers.values()):
+                        log.debug('Nothing new to add')
+                        self.__run_pool_til_next(workers, selector, queue)
+                    else:
+                        log.debug('Done')
+                        self.__close_idle(workers, selector, lambda worker: True)
+                        queue.shutdown()
+                        log.info(f'Maximum wait {format_seconds(self.__max_wait)} for {self.__max_wait_proc} '
+                                 f'with {self.__max_wait_procs} processes')
+                        return
+        except:
+            self.__abort_pool(workers)
+            raise
+
+    def __run_pool_til_next(self, workers, selector, queue):
+        queue.log()
+        start = now()
+        log.debug('Waiting for a worker to complete a batch')
+        for key, _ in selector.select():
+            worker = key.data
+            if not worker.receive():
+                selector.unregister(worker.popen.stdout)
+                del workers[(worker.pipeline, worker.log_index)]
+                process = self.__config.get_process(worker.pipeline.cls, worker.popen.pid)
+                msg = f'Command "{fmt_cmd(worker.popen.args)}" exited with return code {worker.popen.wait()} ' + \
+                      f'see {process.log} for more info'
+                log.warning(msg)
+                self.__config.delete_process(worker.pipeline.cls, worker.popen.pid)
+                self._copy_log(process.log)
+                raise Exception(msg)
+            self.__freed = time()
+            duration = (now() - start).total_seconds()
+            log.debug(f'Waited {format_seconds(duration)}')
+            if duration > self.__max_wait:
+                self.__max_wait = duration
+                self.__max_wait_procs = sum(worker.busy for worker in workers.values()) + 1
+                self.__max_wait_proc = str(worker.pipeline)
+            if not queue.has_missing(worker.pipeline):
+                # workers must finish (and call shutdown()) before the pipeline is complete
+                self.__close_idle(workers, selector, lambda idle: idle.pipeline == worker.pipeline)
+            queue.complete(worker.pipeline, worker.log_index)
+
+    def __close_idle(self, workers, selector, select, n=None):
+        for key, worker in list(workers.items()):
+            if n == 0: return
+            if not worker.busy and select(worker):
+                selector.unregister(worker.popen.stdout)
+                del workers[key]
+                worker.close()
+                if worker.popen.returncode:
+                    raise Exception(f'Command "{fmt_cmd(worker.popen.args)}" exited with return code '
+                                    f'{worker.popen.returncode}')
+                self.__config.delete_process(worker.pipeline.cls, worker.popen.pid)
+                if n: n -= 1
+
+    def __abort_pool(self, workers):
+        for worker in workers.values():
+            log.warning(f'Killing PID {worker.popen.pid} ({fmt_cmd(worker.popen.args)})')
+            try:
+                worker.popen.kill()
+            except NoSuchProcess:
+                pass
+            self.__config.delete_process(worker.pipeline.cls, worker.popen.pid)
 
     def __run_commands(self, queue):
         log.info('Scheduling worker pipelines')
-        capacity = max(1, int(self.__n_cpu * self.__load))
         pipelines, popens = {}, []
         while True:
             try:
                 pipeline, cmd, log_index = queue.pop()
                 popen = self.__config.run_process(pipeline.cls, cmd, log_name(pipeline, log_index))
+                self.__scheduled(queue)
                 pipelines[popen] = (pipeline, log_index)
                 popens.append(popen)
-                if len(popens) == capacity:
+                if len(popens) == self.__capacity:
                     popens = self._run_til_next(pipelines, popens, queue)
             except EmptyException:
                 if popens:
@@ -95,32 +247,34 @@ class ProcessRunner:
         queue.log()
         start = now()
         log.debug('Waiting for a subprocess to complete')
-        while True:
-            for i, popen in enumerate(popens):
-                popen.poll()
-                process = self.__config.get_process(pipelines[popen][0].cls, popen.pid)
-                if popen.returncode is not None:
-                    del popens[i]
-                    duration = (now() - start).total_seconds()
-                    log.debug(f'Waited {format_seconds(duration)}')
-                    pipeline, log_index = pipelines.pop(popen)
-                    if duration > self.__max_wait:
-                        self.__max_wait = duration
-                        self.__max_wait_procs = len(pipelines) + 1
-                        self.__max_wait_proc = str(pipeline)
-                    self.__config.delete_process(pipeline.cls, popen.pid)
-                    queue.complete(pipeline, log_index)
-                    if popen.returncode:
-                        msg = f'Command "{popen.args}" exited with return code {popen.returncode} ' + \
-                              f'see {process.log} for more info'
-                        log.warning(msg)
-                        self._copy_log(process.log)
-                        self._abort(pipelines, popens)
-                        raise Exception(msg)
-                    else:
-                        log.debug(f'Command "{fmt_cmd(popen.args)}" finished successfully')
-                        return popens
-            sleep(0.1)
+        popen = wait_first(popens)
+        self.__freed = time()
+        popens.remove(popen)
+        duration = (now() - start).total_seconds()
+        log.debug(f'Waited {format_seconds(duration)}')
+        pipeline, log_index = pipelines.pop(popen)
+        if duration > self.__max_wait:
+            self.__max_wait = duration
+            self.__max_wait_procs = len(pipelines) + 1
+            self.__max_wait_proc = str(pipeline)
+        process = self.__config.get_process(pipeline.cls, popen.pid)
+        self.__config.delete_process(pipeline.cls, popen.pid)
+        queue.complete(pipeline, log_index)
+        if popen.returncode:
+            msg = f'Command "{popen.args}" exited with return code {popen.returncode} ' + \
+                  f'see {process.log} for more info'
+            log.warning(msg)
+            self._copy_log(process.log)
+            self._abort(pipelines, popens)
+            raise Exception(msg)
+        else:
+            log.debug(f'Command "{fmt_cmd(popen.args)}" finished successfully')
+            return popens
+
+    def __scheduled(self, queue):
+        if self.__freed is not None:
+            queue.scheduled(time() - self.__freed)
+            self.__freed = None
 
     def _abort(self, pipelines, popens):
         for popen in popens:
@@ -147,12 +301,49 @@ class ProcessRunner:
             log.warning(f'Cannot find {path}')
 
 
+class Worker:
+    '''
+    A long-lived sub-process that processes batches of missing values for a single pipeline
+    (see ProcessPipeline.serve()).
+    '''
+
+    def __init__(self, config, pipeline, instance, log_index):
+        self.pipeline = pipeline
+        self.log_index = log_index
+        cmd = instance.command_for_pool(pipeline, log_name(pipeline, log_index))
+        self.popen = config.run_process(pipeline.cls, cmd, log_name(pipeline, log_index), stdin=PIPE, stdout=PIPE)
+        self.busy = False
+
+    def send(self, missing):
+        self.popen.stdin.write((' '.join(missing) + '\n').encode('utf8'))
+        self.popen.stdin.flush()
+        self.busy = True
+
+    def receive(self):
+        # false if the worker exited
+        self.busy = False
+        return bool(self.popen.stdout.readline())
+
+    def close(self):
+        log.debug(f'Closing worker {self.popen.pid} for {self.pipeline}')
+        self.popen.stdin.close()
+        self.popen.wait()
+        self.popen.stdout.close()
+
+
 class EmptyException(Exception): pass
 
 
 class DependencyQueue:
-
-    def __init__(self, config, pipelines, kargs, min_missing=1, max_missing=20, gamma=0.4):
+    '''
+    Batches of missing values are sized from the measured cost (seconds per value, learnt from previous
+    batches and saved between runs) so that each takes about target seconds, but are never so large that
+    the remaining values cannot be spread over all workers.  Without a cost, the size depends on the total
+    number of missing values (gamma).  The pipeline with the most (estimated) work remaining goes first.
+    '''
+
+    def __init__(self, config, pipelines, kargs, min_missing=1, max_missing=20, gamma=0.4,
+                 capacity=1, target=30, max_target=200, decay=0.5):
         self.__clean_pipelines(pipelines)
         self.__config = config
         self.__blocked = [pipeline for pipeline in pipelines if pipeline.blocked_by]
@@ -165,7 +356,13 @@ class DependencyQueue:
         self.__max_missing = max_missing
         self.__min_missing = min_missing
         self.__gamma = gamma
+        self.__capacity = capacity
+        self.__target = target
+        self.__max_target = max_target
+        self.__decay = decay
+        self.__costs = self.__read_costs()  # key: seconds per missing value
         self.__active_log_indices = defaultdict(lambda: set())
+        self.__latency = []  # time from a slot becoming free to being filled
         self.__start = now()
         # clear out any junk from previous errors?
         for pipeline in self.__unblocked:
@@ -185,7 +382,7 @@ class DependencyQueue:
         # check if completed instance means that a pipeline is complete and, if so,
         # see if that unblocks others
         if log_index is not None:
-            self.__stats[pipeline].finish(log_index)
+            self.__learn_cost(pipeline, *self.__stats[pipeline].finish(log_index))
             self.__active_log_indices[pipeline].remove(log_index)
         if self.__stats[pipeline]:
             log.info(f'{pipeline} complete ({self.__stats[pipeline].done})')
@@ -203,8 +400,14 @@ class DependencyQueue:
                     self.__config.delete_all_processes(unblocked.cls)
 
     def pop(self):
+        pipeline, instance, missing, log_index = self.pop_missing()
+        cmd = instance.command_for_missing(pipeline, missing, log_name(pipeline, log_index))
+        return pipeline, cmd, log_index
+
+    def pop_missing(self):
         # unblocking takes some time, so do it step by step as we need more
         # add the new pipeline to the head of active
+        self.__unblocked.sort(key=self.__cost)  # most expensive last
         while self.__unblocked:
             pipeline = self.__unblocked.pop()
             log.debug(f'Making {pipeline} active')
@@ -222,24 +425,69 @@ class DependencyQueue:
                 self.__order.insert(0, pipeline)
                 self.complete(pipeline)
                 log.debug(f'{pipeline}: no missing data')
+        self.__order.sort(key=self.__remaining, reverse=True)
         for _ in range(len(self.__order)):  # at most, try each once
             pipeline = self.__order.pop(0)
             instance, missing = self.__active[pipeline]
             if missing:
                 log_index = self.__unused_log_index(pipeline)
                 missing_args, missing = self.__split_missing(pipeline, missing)
-                cmd = instance.command_for_missing(pipeline, missing_args, log_name(pipeline, log_index))
                 self.__active[pipeline] = instance, missing
                 self.__order.append(pipeline)
                 log.debug(f'{pipeline}: starting batch of {len(missing_args)} missing values')
                 self.__stats[pipeline].start(log_index, len(missing_args))
-                return pipeline, cmd, log_index
+                return pipeline, instance, missing_args, log_index
             else:
                 log.debug(f'{pipeline} exhausted')
                 self.__active[pipeline] = instance, None
                 self.__order.append(pipeline)
         raise EmptyException()
 
+    @staticmethod
+    def __key(pipeline):
+        return f'{pipeline}:{pipeline.id}'
+
+    def __read_costs(self):
+        costs = self.__config.get_constant(SystemConstant.PIPELINE_COSTS, none=True)
+        return loads(costs) if costs else {}
+
+    def __write_costs(self):
+        # drop costs for pipelines that no longer exist (ids change when the configuration is rebuilt).
+        # this checks all pipelines, not just those scheduled, so that costs survive runs restricted by like.
+        with self.__config.db.session_context() as s:
+            keys = set(self.__key(pipeline) for pipeline in s.query(Pipeline).all())
+        for key in [key for key in self.__costs if key not in keys]:
+            log.debug(f'Dropping cost for {key}')
+            del self.__costs[key]
+        self.__config.set_constant(SystemConstant.PIPELINE_COSTS, dumps(self.__costs), force=True)
+
+    def __cost(self, pipeline):
+        # unknown costs default to the mean, so are neither first nor last
+        key = self.__key(pipeline)
+        if key in self.__costs:
+            return self.__costs[key]
+        elif self.__costs:
+            return sum(self.__costs.values()) / len(self.__costs)
+        else:
+            return 1
+
+    def __remaining(self, pipeline):
+        missing = self.__active[pipeline][1]
+        return self.__cost(pipeline) * len(missing) if missing else 0
+
+    def __learn_cost(self, pipeline, n, seconds):
+        if n:
+            key, cost = self.__key(pipeline), seconds / n
+            if key in self.__costs:
+                cost = self.__decay * self.__costs[key] + (1 - self.__decay) * cost
+            self.__costs[key] = cost
+
+    def scheduled(self, latency):
+        self.__latency.append(latency)
+
+    def has_missing(self, pipeline):
+        return pipeline in self.__active and bool(self.__active[pipeline][1])
+
     def __unused_log_index(self, pipeline):
         index = 0
         while index in self.__active_log_indices[pipeline]: index += 1
@@ -250,6 +498,9 @@ class DependencyQueue:
         log.info(f'Started {time_to_local_time(self.__start)}; '
                  f'duration {format_seconds((now() - self.__start).total_seconds())}; '
                  f'{len(self.__blocked)} blocked')
+        if self.__latency:
+            log.info(f'Scheduling latency: mean {1000 * sum(self.__latency) / len(self.__latency):.1f}ms; '
+                     f'max {1000 * max(self.__latency):.1f}ms ({len(self.__latency)} batches)')
         for pipeline in self.__stats:
             log.info(str(self.__stats[pipeline]))
 
@@ -261,18 +512,24 @@ class DependencyQueue:
         speedup = process_time / clock_time
         log.info(f'Clock time: {format_seconds(clock_time)}; Process time: {format_seconds(process_time)}; '
                  f'Speedup: x{speedup:.1f}')
-        log.info(f'Missing args min {self.__min_missing}; max {self.__max_missing}; gamma {self.__gamma}')
+        log.info(f'Missing args min {self.__min_missing}; max {self.__max_missing}; gamma {self.__gamma}; '
+                 f'target {self.__target}s (max {self.__max_target})')
 
     def __split_missing(self, pipeline, missing):
-        # this (min, min) is a bit weird but makes sense, i think
-        n = min(len(missing),
-                max(self.__min_missing,
-                    min(self.__max_missing, int(pow(self.__stats[pipeline].total, self.__gamma)))))
+        key = self.__key(pipeline)
+        if key in self.__costs and self.__costs[key]:
+            n = min(self.__max_target, int(self.__target / self.__costs[key]))
+        else:
+            # this (min, min) is a bit weird but makes sense, i think
+            n = min(self.__max_missing, int(pow(self.__stats[pipeline].total, self.__gamma)))
+        # leave enough to keep all workers busy
+        n = min(len(missing), max(self.__min_missing, min(n, ceil(len(missing) / self.__capacity))))
         return missing[:n], missing[n:]
 
     def shutdown(self):
         self.log()
         self.__log_efficiency()
+        self.__write_costs()
         if self.__blocked:
             log.warning(f'{len(self.__blocked)} pipelines still blocked')
             for pipeline in self.__blocked:
@@ -301,12 +558,15 @@ class Stats:
         self.active += 1
 
     def finish(self, index):
+        # returns the size and duration of the batch
         log.info(f'{self.__pipeline}: {self.__size[index]} completed')
         self.active -= 1
         self.done += self.__size[index]
-        self.duration_individual += (now() - self.__start_individual[index]).total_seconds()
+        duration = (now() - self.__start_individual[index]).total_seconds()
+        self.duration_individual += duration
         if self:
             self.duration_overall = (now() - self.__start_overall).total_seconds()
+        return self.__size[index], duration
 
     def __bar(self, width):
         solid = int(width * self.done / self.total) if self.total else width
@@ -1,23 +1,26 @@
 from logging import getLogger
 from os.path import splitext, basename
 
+import numpy as np
 from pygeotile.point import Point
 from sqlalchemy.sql.functions import count
 
 from .utils import AbortImportButMarkScanned, ProcessFitReader
 from ... import FatalException
-from ...commands.args import DEFAULT
+from ...commands.args import DEFAULT, BASE
 from ...commands.upload import ACTIVITY
 from ...common.date import to_time, time_to_local_time
+from ...data.cache import ActivityFrameCache
 from ...diary.model import TYPE, EDIT
+from ...fit.format.columns import times
 from ...fit.format.records import fix_degrees, merge_duplicates, no_bad_values
-from ...fit.profile.profile import read_fit
+from ...fit.profile.profile import map_fit
 from ...lib.io import split_fit_path
 from ...names import N, T, Units, Sports, Summaries as S
 from ...sql.database import Timestamp, StatisticJournalText
 from ...sql.tables.activity import ActivityGroup, ActivityJournal, ActivityTimespan
 from ...sql.tables.statistic import StatisticJournalFloat, STATISTIC_JOURNAL_CLASSES, StatisticName, \
-    StatisticJournalType, StatisticJournal
+    StatisticJournalType, StatisticJournal, StatisticJournalInteger
 from ...sql.tables.topic import ActivityTopicField, ActivityTopic, ActivityTopicJournal
 from ...sql.utils import add
 from ...srtm.bilinear import bilinear_elevation_from_constant
@@ -45,6 +48,7 @@ class ActivityReader(ProcessFitReader):
 
     def _startup(self, s):
         self.__oracle = bilinear_elevation_from_constant(s)
+        self.__frame_cache = ActivityFrameCache(self._config.args[BASE])
         super()._startup(s)
 
     def _build_define(self, path):
@@ -62,10 +66,18 @@ class ActivityReader(ProcessFitReader):
 
     def _read_data(self, s, file_scan):
         log.info('Reading activity data from %s' % file_scan)
-        records = self.parse_records(read_fit(file_scan.path))
+        with map_fit(file_scan.path) as data:
+            columns = self.parse_columns(data)
         define = self._build_define(file_scan.path)
-        ajournal, activity_group, first_timestamp = self._create_activity(s, file_scan, define, records)
-        return ajournal, (ajournal, activity_group, first_timestamp, file_scan, define, records)
+        ajournal, activity_group, first_timestamp = self._create_activity(s, file_scan, define, columns)
+        return ajournal, (ajournal, activity_group, first_timestamp, file_scan, define, columns)
+
+    @staticmethod
+    def parse_columns(data):
+        log.debug('Parsing columns')
+        columns = ActivityReader.read_fit_columns(data, 'event', 'record', 'sport', 'session')
+        log.debug('Parsed')
+        return columns
 
     @staticmethod
     def parse_records(data):
@@ -90,11 +102,24 @@ class ActivityReader(ProcessFitReader):
     def read_last_timestamp(path, records):
         return ActivityReader._last(path, records, 'event', 'record').value.timestamp
 
-    def _create_activity(self, s, file_scan, define, records):
-        first_timestamp = self.read_first_timestamp(file_scan.path, records)
-        last_timestamp = self.read_last_timestamp(file_scan.path, records)
+    @staticmethod
+    def read_column_sport(path, columns):
+        # session is an alternative for some garmin devices (florian)
+        for name in ('sport', 'session'):
+            if name in columns and 'sport' in columns[name]:
+                messages = columns[name]
+                for sport in messages['sport'][np.argsort(messages.timestamp, kind='stable')]:
+                    if sport is not None:
+                        return sport.lower()
+        msg = f'No sport in {path}'
+        log.debug(msg)
+        raise AbortImportButMarkScanned(msg)
+
+    def _create_activity(self, s, file_scan, define, columns):
+        timestamps = self._column_timestamps(file_scan.path, columns, 'event', 'record')
+        first_timestamp, last_timestamp = times(timestamps[[0, -1]])
         log.debug(f'Time range: {first_timestamp.timestamp()} - {last_timestamp.timestamp()}')
-        sport = self.read_sport(file_scan.path, records)
+        sport = self.read_column_sport(file_scan.path, columns)
         activity_group = self._activity_group(s, file_scan.path, sport, self.sport_to_activity, define)
         log.info(f'{activity_group} from {sport} / {define}')
         self._check_journals(s, activity_group, first_timestamp, last_timestamp, file_scan)
@@ -214,23 +239,83 @@ class ActivityReader(ProcessFitReader):
             raise Exception(f'Overlapping activities: '
                             f'{time_to_local_time(ajournal.start)} / {time_to_local_time(overlap.start)}')
 
+    @staticmethod
+    def _timer_events(columns, *types):
+        if 'event' not in columns or not all(name in columns['event'] for name in ('event', 'event_type')):
+            return np.zeros(len(columns['event']) if 'event' in columns else 0, dtype=bool)
+        events = columns['event']
+        is_event = np.isin(events['event'], ['timer']) & np.isin(events['event_type'], types) & \
+                   ~np.isnat(events.timestamp)
+        for timestamp in events.timestamp[is_event]:
+            log.debug(f'{types} at {timestamp}')
+        return is_event
+
+    @staticmethod
+    def _column_values(records, field, type):
+        # a list of python values (or None) with the same conversions as the record pipeline
+        if field not in records.names:
+            return [None] * len(records)
+        values = records[field]
+        if values.ndim > 1:
+            values = values[:, 0]
+        if values.dtype.kind == 'f':
+            if records.units.get(field) == 'semicircles':
+                values = values * 180 / 2**31
+            missing = np.isnan(values)
+            if type == StatisticJournalInteger:
+                values = np.where(missing, 0, values).astype(np.int64)
+            values = values.astype(object)
+            values[missing] = None
+            return values.tolist()
+        else:
+            return [value[0] if isinstance(value, tuple) else value for value in values.tolist()]
+
+    def _elevations(self, values):
+        # srtm elevations for all records at once (a list, with None where missing)
+        columns = {title: column for field, title, units, type, column in values}
+        if T.LATITUDE in columns and T.LONGITUDE in columns:
+            try:
+                elevations = self.__oracle.elevations(np.array(columns[T.LATITUDE], dtype=float),
+                                                      np.array(columns[T.LONGITUDE], dtype=float))
+            except Exception as e:
+                # eg a missing tile - the elevation calculator falls back to altitude
+                log.warning(f'Cannot calculate {T.RAW_ELEVATION} from position: {e}')
+                return None
+            if elevations is not None:
+                return [None if np.isnan(elevation) else elevation for elevation in elevations.tolist()]
+        return None
+
     def _load_data(self, s, loader, data):
 
-        ajournal, activity_group, first_timestamp, file_scan, define, records = data
+        ajournal, activity_group, first_timestamp, file_scan, define, columns = data
         timespan, warned, logged, last_timestamp = None, 0, 0, to_time(0.0)
 
         log.debug(f'Loading {self.record_to_db}')
 
-        def is_event(record, *types):
-            event = False
-            if record.name == 'event':
-                event = record.value.event == 'timer' and record.value.event_type in types
-                if event: log.debug(f'{types} at {record.timestamp}')
-            return event
-
-        have_timespan = any(is_event(record, 'start') for record in records)
-        only_records = list(filter(lambda x: x.name == 'record', records))
-        final_timestamp = only_records[-1].timestamp
+        if 'record' not in columns:
+            raise Exception(f'No record entries in {file_scan.path}')
+        records = columns['record']
+        valid = ~np.isnat(records.timestamp)
+
+        # interleave timer events and records, ordered by time (and then position in the file)
+        START, RECORD, STOP = 0, 1, 2
+        starts, stops = self._timer_events(columns, 'start'), self._timer_events(columns, 'stop_all', 'stop')
+        have_timespan = bool(np.any(starts))
+        kinds, rows, timestamps, indices = [np.full(np.count_nonzero(valid), RECORD)], [np.flatnonzero(valid)], \
+                                           [records.timestamp[valid]], [records.index[valid]]
+        if have_timespan:
+            events = columns['event']
+            for kind, mask in ((START, starts), (STOP, stops)):
+                kinds.append(np.full(np.count_nonzero(mask), kind))
+                rows.append(np.flatnonzero(mask))
+                timestamps.append(events.timestamp[mask])
+                indices.append(events.index[mask])
+        kinds, rows, timestamps, indices = [np.concatenate(array) for array in (kinds, rows, timestamps, indices)]
+        order = np.lexsort((indices, timestamps))
+        kinds, rows, timestamps = kinds[order], rows[order], times(timestamps[order])
+
+        record_timestamps = [timestamp for kind, timestamp in zip(kinds, timestamps) if kind == RECORD]
+        final_timestamp = record_timestamps[-1]
 
         self._check_overlap(s, first_timestamp, final_timestamp, ajournal)
         self._load_define(s, define, ajournal)
@@ -238,30 +323,31 @@ class ActivityReader(ProcessFitReader):
         self.__ajournal = ajournal
 
         if not have_timespan:
-            first_timestamp = only_records[0].timestamp
+            first_timestamp = record_timestamps[0]
             log.warning('Experimental handling of data without timespans')
             timespan = add(s, ActivityTimespan(activity_journal=ajournal, start=first_timestamp, finish=final_timestamp))
 
-        for record in records:
+        values = [(field, title, units, type, self._column_values(records, field, type))
+                  for field, title, units, type in self.record_to_db]
+        elevations = self._elevations(values) if self.add_elevation else None
+
+        for kind, row, timestamp in zip(kinds.tolist(), rows.tolist(), timestamps):
 
-            if have_timespan and is_event(record, 'start'):
+            if kind == START:
                 if timespan:
                     log.warning('Ignoring start with no corresponding stop (possible lost data?)')
                 else:
-                    timespan = add(s, ActivityTimespan(activity_journal=ajournal,
-                                                       start=record.value.timestamp,
-                                                       finish=record.value.timestamp))
+                    timespan = add(s, ActivityTimespan(activity_journal=ajournal, start=timestamp, finish=timestamp))
 
-            elif record.name == 'record':
-                if record.value.timestamp > last_timestamp:
-                    lat, lon, timestamp = None, None, record.value.timestamp
+            elif kind == RECORD:
+                if timestamp > last_timestamp:
+                    lat, lon = None, None
                     # customizable loader
-                    for field, title, units, type in self.record_to_db:
-                        value = record.data.get(field, None)
+                    for field, title, units, type, column in values:
+                        value = column[row]
                         if logged < 3:
                             log.debug(f'{title} = {value}')
                         if value is not None:
-                            value = value[0][0]
                             if units == Units.KM:  # internally everything uses M
                                 value /= 1000
                             loader.add(title, units, None, ajournal, value, timestamp, type,
@@ -278,23 +364,23 @@ class ActivityReader(ProcessFitReader):
                                    StatisticJournalFloat, description='The WGS84 X coordinate')
                         loader.add(T.SPHERICAL_MERCATOR_Y, Units.M, None, ajournal, y, timestamp,
                                    StatisticJournalFloat, description='The WGS84 Y coordinate')
-                        if self.add_elevation:
-                            elevation = self.__oracle.elevation(lat, lon)
+                        if elevations:
+                            elevation = elevations[row]
                             if elevation:
                                 loader.add(T.RAW_ELEVATION, Units.M, None, ajournal, elevation,
                                            timestamp, StatisticJournalFloat,
                                            description='The elevation from SRTM1 at this location')
                 else:
                     log.warning('Ignoring duplicate record data for %s at %s - some data may be missing' %
-                                (file_scan.path, record.value.timestamp))
-                last_timestamp = record.value.timestamp
+                                (file_scan.path, timestamp))
+                last_timestamp = timestamp
                 if not have_timespan:
-                    ajournal.finish = record.value.timestamp
+                    ajournal.finish = timestamp
 
-            elif have_timespan and is_event(record, 'stop_all', 'stop'):
+            elif kind == STOP:
                 if timespan:
-                    timespan.finish = record.value.timestamp
-                    ajournal.finish = record.value.timestamp
+                    timespan.finish = timestamp
+                    ajournal.finish = timestamp
                     timespan = None
                 else:
                     log.debug('Ignoring stop with no corresponding start (possible lost data?)')
@@ -310,3 +396,4 @@ class ActivityReader(ProcessFitReader):
                                       self.__ajournal, percent, self.__ajournal.start,
                                       description=f'Coverage (% of FIT records with data) for {title}.')
         s.commit()
+        self.__frame_cache.write(s, self.__ajournal, self.owner_out, loader)
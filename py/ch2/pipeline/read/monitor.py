@@ -12,9 +12,9 @@ from ..calculate import RestHRCalculator
 from ..loader import Loader
 from ..pipeline import LoaderMixin
 from ...common.date import time_to_local_date, format_time, to_time, dates_from, now
-from ...data.frame import read_query
+from ...data.frame import read_query_chunks
 from ...fit.format.records import fix_degrees, unpack_single_bytes, merge_duplicates
-from ...fit.profile.profile import read_fit
+from ...fit.profile.profile import map_fit
 from ...names import N, T, Units
 from ...sql import MonitorJournal, StatisticJournalInteger, StatisticName, StatisticJournal, Interval
 from ...sql.database import StatisticJournalType, Source
@@ -91,7 +91,8 @@ class MonitorReader(LoaderMixin, ProcessFitReader):
         return MonitorReader._last(path, records, MONITORING_ATTR).value.timestamp
 
     def _read_data(self, s, file_scan):
-        records = self.parse_records(read_fit(file_scan.path))
+        with map_fit(file_scan.path) as data:
+            records = self.parse_records(data)
         first_timestamp = self.read_first_timestamp(file_scan.path, records)
         last_timestamp = self.read_last_timestamp(file_scan.path, records)
         if first_timestamp == last_timestamp:
@@ -193,9 +194,16 @@ class MonitorReader(LoaderMixin, ProcessFitReader):
         # this reads CUMULATIVE_STEPS (which is what was in the files) and any existing STEPS
         # then calculates what STEPS should be and fixes up any incorrect or missing data
         # (i guess maybe slightly faster when running incrementally)
-        df = self._read_diff(s)
-        df = self._calculate_diff(df)
-        self._write_diff(s, df)
+        # data are processed in chunks (so memory does not grow with years of data).
+        steps = StatisticName.add_if_missing(s, T.STEPS, StatisticJournalType.INTEGER, Units.STEPS_UNITS,
+                                             None, self.owner_out, description=STEPS_DESCRIPTION)
+        loader = self._get_loader(s, owner=self.owner_out, add_serial=False)
+        previous = None
+        for df in self._read_diff(s):
+            df = self._calculate_diff(df, previous)
+            self._write_diff(s, df, steps, loader)
+            if len(df): previous = df[N.CUMULATIVE_STEPS].iloc[-1]
+        loader.load()
 
     def _read_diff(self, s):
         qs = s.query(StatisticJournalInteger.time.label(N.TIME),
@@ -212,18 +220,18 @@ class MonitorReader(LoaderMixin, ProcessFitReader):
                    StatisticName.owner == self.owner_out). \
             order_by(StatisticJournalInteger.time)
         # log.debug(q)
-        df = read_query(q, index=N.TIME)
-        return df
+        return read_query_chunks(q, index=N.TIME)
 
-    def _calculate_diff(self, df):
+    def _calculate_diff(self, df, previous=None):
+        # previous is the last cumulative value in the preceding chunk
         df[NEW_STEPS] = df[N.CUMULATIVE_STEPS].diff()
+        if previous is not None and len(df):
+            df.iloc[0, df.columns.get_loc(NEW_STEPS)] = df[N.CUMULATIVE_STEPS].iloc[0] - previous
         df.loc[df[NEW_STEPS] < 0, NEW_STEPS] = df[N.CUMULATIVE_STEPS]
         df.loc[df[NEW_STEPS].isna(), NEW_STEPS] = df[N.CUMULATIVE_STEPS]
         return df
 
-    def _write_diff(self, s, df):
-        steps = StatisticName.add_if_missing(s, T.STEPS, StatisticJournalType.INTEGER, Units.STEPS_UNITS,
-                                             None, self.owner_out, description=STEPS_DESCRIPTION)
+    def _write_diff(self, s, df, steps, loader):
         times = df.loc[(df[NEW_STEPS] != df[N.STEPS]) & ~df[N.STEPS].isna()].index.astype(np.int64) / 1e9
         if len(times):
             times = [to_time(time) for time in times]
@@ -234,16 +242,13 @@ class MonitorReader(LoaderMixin, ProcessFitReader):
             s.query(StatisticJournal.id). \
                 filter(StatisticJournal.time.in_(times),
                        StatisticJournal.statistic_name == steps).delete(synchronize_session=False)
-        loader = self._get_loader(s, owner=self.owner_out, add_serial=False)
         for time, row in df.loc[(df[NEW_STEPS] != df[N.STEPS]) & ~df[NEW_STEPS].isna()].iterrows():
             loader.add(T.STEPS, Units.STEPS_UNITS, None, row[N.SOURCE], int(row[NEW_STEPS]),
                        time, StatisticJournalInteger, description=STEPS_DESCRIPTION)
-        loader.load()
 
 
 class MonitorLoader(Loader):
 
-    def _resolve_duplicate(self, name, instance, prev):
-        log.warning(f'Using max of duplicate values at {instance.time} for {name} '
-                    f'({instance.value}/{prev.value})')
-        prev.value = max(prev.value, instance.value)
+    def _resolve_duplicate(self, name, time, value, prev):
+        log.warning(f'Using max of duplicate values at {time} for {name} ({value}/{prev})')
+        return max(prev, value)
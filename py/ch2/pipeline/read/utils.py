@@ -3,13 +3,15 @@ from glob import iglob
 from logging import getLogger
 from os.path import join, exists
 
+import numpy as np
+
 from ..pipeline import ProcessPipeline
 from ... import FatalException
 from ...commands.args import base_system_path, PERMANENT, BASE
 from ...common.date import now
 from ...common.io import touch
 from ...common.log import log_current_exception
-from ...fit.format.read import filtered_records
+from ...fit.format.read import filtered_records, filtered_columns
 from ...lib import to_time
 from ...lib.io import modified_file_scans
 from ...sql import Timestamp, FileScan
@@ -75,6 +77,26 @@ class ProcessFitReader(ProcessPipeline):
                 for _, _, record in sorted(records,
                                            key=lambda r: r[2].timestamp if r[2].timestamp else to_time(0.0))]
 
+    @staticmethod
+    def read_fit_columns(data, *names):
+        '''
+        A faster alternative to read_fit_file() that returns numpy columns for the named messages
+        (see ch2.fit.format.columns).
+        '''
+        types, messages, columns = filtered_columns(data, record_names=names)
+        return columns
+
+    @staticmethod
+    def _column_timestamps(path, columns, *names):
+        timestamps = [columns[name].timestamp for name in names if name in columns]
+        timestamps = np.sort(np.concatenate(timestamps)) if timestamps else np.array([], dtype='M8[s]')
+        timestamps = timestamps[~np.isnat(timestamps)]
+        if not len(timestamps):
+            msg = f'No {names} entry(s) in {path}'
+            log.debug(msg)
+            raise AbortImportButMarkScanned(msg)
+        return timestamps
+
     @staticmethod
     def _first(path, records, *names):
         return ProcessFitReader.assert_contained(path, records, names, 0)
@@ -1,3 +1,4 @@
 
 from .tree import CLRTree, CQRTree, CERTree, LLRTree, LQRTree, LERTree, MatchType
+from .packed import CSTRTree, LSTRTree
 
@@ -0,0 +1,154 @@
+
+from array import array
+from collections import defaultdict
+from logging import getLogger
+from math import floor, ceil
+
+import numpy as np
+
+from .spherical import LocalTangent
+from .tree import MatchType
+
+log = getLogger(__name__)
+
+
+class Cell:
+    '''
+    The points in a single grid cell.  The data are (x, y, lon, lat) for each point (in that order, in a
+    single array), and values is the matching list of values.
+    '''
+
+    __slots__ = ('data', 'values')
+
+    def __init__(self):
+        self.data = array('d')
+        self.values = []
+
+    def append(self, x, y, lon, lat, value):
+        self.data.extend((x, y, lon, lat))
+        self.values.append(value)
+
+    def as_array(self):
+        return np.frombuffer(self.data, dtype=float).reshape(-1, 4)
+
+
+class SGrid:
+    '''
+    Single (lon, lat) points, stored in a uniform grid on the local tangent plane.
+
+    This supports the part of the SQRTree API used to find nearby points (OVERLAP matching against single
+    points, with a border fixed when the grid is created).  Matching is the same as SQRTree: the stored
+    point and the probe both have a (square) border, and they match if these overlap.
+
+    Each probe needs to examine only the neighbouring cells, so queries are independent of the
+    number of points stored (for a given density), and there are no nodes (so less memory is used).
+    Results contain the original (lon, lat) values (not values recovered from the plane).
+    '''
+
+    def __init__(self, items=None, *, default_border=0, default_match=MatchType.OVERLAP, cell_size=None):
+        '''
+        `cell_size` (in m) defaults to twice the border (so a probe with the same border as the stored points
+        needs to examine only the 3x3 cells around it).
+        '''
+        if default_match != MatchType.OVERLAP:
+            raise Exception('SGrid only supports OVERLAP matching')
+        self.__border = default_border
+        self.__cell_size = cell_size or 2 * default_border
+        if self.__cell_size <= 0:
+            raise Exception('SGrid needs a border or cell size')
+        self.__plane = LocalTangent()
+        self.__cells = defaultdict(Cell)
+        self.__size = 0
+        self.add_all(items)
+
+    def __point(self, points):
+        try:
+            (lon, lat), = points
+        except Exception:
+            raise Exception('The `points` argument is a sequence containing a single (lon, lat) point.')
+        return lon, lat
+
+    def __key(self, x, y):
+        return floor(x / self.__cell_size), floor(y / self.__cell_size)
+
+    def add(self, points, value):
+        '''
+        Add a value at the given point.
+        '''
+        lon, lat = self.__point(points)
+        x, y = self.__plane.normalize((lon, lat))
+        self.__cells[self.__key(x, y)].append(x, y, lon, lat, value)
+        self.__size += 1
+
+    def add_all(self, items):
+        '''
+        Add a sequence of (point, value) pairs.
+        '''
+        if items:
+            for points, value in items:
+                self.add(points, value)
+
+    def __setitem__(self, points, value):
+        self.add(points, value)
+
+    def __len__(self):
+        return self.__size
+
+    def get(self, points, value=None, match=None, border=None):
+        '''
+        An iterator over values at points that overlap the given point.
+
+        If `value` is given then only entries with that value are found.
+
+        `border` is added to the probe (in addition to the border for stored points).
+        '''
+        for _, (_, value_entry) in self.get_all_items([points], value=value, match=match, border=border):
+            yield value_entry
+
+    def get_items(self, points, value=None, match=None, border=None):
+        '''
+        An iterator over (points, value) of entries that overlap the given point.
+
+        If `value` is given then only entries with that value are found.
+
+        `border` is added to the probe (in addition to the border for stored points).
+        '''
+        for _, item in self.get_all_items([points], value=value, match=match, border=border):
+            yield item
+
+    def get_all_items(self, many_points, value=None, match=None, border=None):
+        '''
+        An iterator over (index, (points, value)) of entries that overlap any of the given points,
+        where index is the position of the matching points in `many_points`.
+
+        Probes are grouped by cell, so that each cell is tested once for all probes that need it.
+        '''
+        if match not in (None, MatchType.OVERLAP):
+            raise Exception('SGrid only supports OVERLAP matching')
+        border = self.__border if border is None else border
+        reach = self.__border + border
+        n = ceil(reach / self.__cell_size)
+        xys, probes = [], defaultdict(list)
+        for index, points in enumerate(many_points):
+            x, y = self.__plane.normalize(self.__point(points))
+            xys.append((x, y))
+            if self.__size:
+                i, j = self.__key(x, y)
+                for di in range(-n, n + 1):
+                    for dj in range(-n, n + 1):
+                        if (i + di, j + dj) in self.__cells:
+                            probes[(i + di, j + dj)].append(index)
+        if probes:
+            xys = np.array(xys, dtype=float)
+            for key, indices in probes.items():
+                cell = self.__cells[key]
+                data, indices = cell.as_array(), np.array(indices)
+                near = (np.abs(data[:, 0] - xys[indices, 0, None]) <= reach) & \
+                       (np.abs(data[:, 1] - xys[indices, 1, None]) <= reach)
+                i, k = np.nonzero(near)
+                # copy before yielding (the cell cannot grow while its data are viewed)
+                found = list(zip(indices[i].tolist(), data[k, 2].tolist(), data[k, 3].tolist(), k.tolist()))
+                del data
+                for index, lon, lat, k in found:
+                    if value is None or value == cell.values[k]:
+                        yield index, (((lon, lat),), cell.values[k])
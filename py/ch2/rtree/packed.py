@@ -0,0 +1,312 @@
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from .tree import MatchType, CartesianMixin, LatLonMixin, overlaps, contains, contained
+
+
+def concat_ranges(firsts, lasts):
+    '''
+    The indices firsts[0]...lasts[0]-1, firsts[1]...lasts[1]-1, etc, as a single array.
+    '''
+    lengths = lasts - firsts
+    total = lengths.sum()
+    if not total:
+        return np.zeros((0,), dtype=np.int64)
+    # offset each index by the start of its range, relative to its position in the result
+    shifts = np.repeat(firsts - (np.cumsum(lengths) - lengths), lengths)
+    return shifts + np.arange(total)
+
+
+class BasePackedTree(ABC):
+
+    # a read-only tree, built in a single pass by Sort-Tile-Recursive packing.
+    # the tree is a list of levels, from the leaves up, each with the MBRs of the level in a single (n, 4) array.
+    # above the leaves, each entry also has the range of its children in the level below (firsts, lasts).
+    # the root is implicit (the top level has at most max_entries entries).
+    # MBRs are tested for all candidates in a level at once, so there is no per-node python loop.
+
+    # matching semantics are the same as BaseTree, but the order of results differs.
+    # adding values rebuilds the tree, so this is intended for data that are loaded once and then read.
+
+    def __init__(self, items=None, *, max_entries=16, default_match=MatchType.EQUALS, default_border=0):
+        '''
+        Create a tree.
+
+        `items` allows construction from an iterable of `(points, value)` pairs
+        (as returned by `.items()`),
+
+        `max_entries` is the maximum number of children a node can have.
+        Since children are tested together, larger values than for BaseTree work well.
+        '''
+        if max_entries < 2:
+            raise Exception('Max number of entries in a node is too low')
+        self.__max_entries = max_entries
+        self.__default_match = default_match
+        self.__default_border = default_border
+        self.__contents = []
+        self.__mbrs = np.zeros((0, 4))
+        self.__levels = []
+        self.add_all(items)
+
+    @property
+    def global_mbr(self):
+        if self.__contents:
+            x1, y1 = self._denormalize_point(tuple(self.__levels[-1][0][:, :2].min(axis=0)))
+            x2, y2 = self._denormalize_point(tuple(self.__levels[-1][0][:, 2:].max(axis=0)))
+            return x1, y1, x2, y2
+        else:
+            return None
+
+    @property
+    def max_entries(self):
+        return self.__max_entries
+
+    @property
+    def height(self):
+        return max(0, len(self.__levels) - 1)
+
+    def size(self):
+        return len(self.__contents)
+
+    def _check_points(self, points):
+        try:
+            _ = points[0][0]
+        except Exception:
+            raise Exception('The `points` argument is a sequence of (x, y) points. ' +
+                            'You may have entered a single (x, y) point.')
+
+    def add_all(self, items, border=None):
+        '''
+        Add a sequence of (point, value) pairs and rebuild the tree.
+
+        `border` is added to the MBR (eg to account for errors).
+        '''
+        if items:
+            border = self.__default_border if border is None else border
+            contents, mbrs = [], []
+            for points, value in items:
+                self._check_points(points)
+                points = self._normalize_points(points)
+                contents.append((points, value))
+                mbrs.append(self._mbr_of_points(points, border=border))
+            if contents:
+                self.__build(self.__contents + contents,
+                             np.concatenate([self.__mbrs, np.array(mbrs, dtype=float)]))
+
+    def __build(self, contents, mbrs):
+        '''
+        Pack the leaves, and then each level above, until all entries fit in the root.
+        '''
+        order = self.__pack(mbrs)
+        self.__contents = [contents[i] for i in order]
+        self.__mbrs = mbrs[order]
+        self.__levels = [(self.__mbrs, None, None)]
+        mbrs = self.__mbrs
+        while len(mbrs) > self.__max_entries:
+            firsts = np.arange(0, len(mbrs), self.__max_entries)
+            lasts = np.append(firsts[1:], len(mbrs))
+            parents = np.hstack([np.minimum.reduceat(mbrs[:, :2], firsts),
+                                 np.maximum.reduceat(mbrs[:, 2:], firsts)])
+            order = self.__pack(parents)
+            mbrs = parents[order]
+            self.__levels.append((mbrs, firsts[order], lasts[order]))
+
+    def __pack(self, mbrs):
+        '''
+        An ordering of the MBRs where successive runs of max_entries are compact: sort by x into
+        vertical slices (each a whole number of nodes), then by y within each slice.
+        '''
+        n = len(mbrs)
+        n_nodes = -(-n // self.__max_entries)
+        slice_size = int(np.ceil(np.sqrt(n_nodes))) * self.__max_entries
+        x, y = mbrs[:, 0] + mbrs[:, 2], mbrs[:, 1] + mbrs[:, 3]  # centres (doubled)
+        rank = np.empty(n, dtype=np.int64)
+        rank[np.argsort(x, kind='stable')] = np.arange(n)
+        return np.lexsort((y, rank // slice_size))
+
+    def get(self, points, value=None, match=None, border=None):
+        '''
+        An iterator over values of nodes that match the MBR for the given points.
+
+        The `match` describes the kind of matching done.
+
+        If `value` is given then only nodes with that value are found.
+
+        `border` is added to the MBR (eg to account for errors).
+        '''
+        for points_entry, value_entry in self.__get_leaf_contents(points, value, match, border):
+            yield value_entry
+
+    def get_items(self, points, value=None, match=None, border=None):
+        '''
+        An iterator over (MBR, value) of nodes that match the MBR for the given points.
+
+        The `match` describes the kind of matching done.
+
+        If `value` is given then only nodes with that value are found.
+
+        `border` is added to the MBR (eg to account for errors).
+        '''
+        for points_entry, value_entry in self.__get_leaf_contents(points, value, match, border):
+            yield self._denormalize_points(points_entry), value_entry
+
+    def __get_leaf_contents(self, points, value, match, border):
+        '''
+        Internal get - descend level by level, testing all candidates together.
+        '''
+        self._check_points(points)
+        if not self.__contents:
+            return
+        match = self.__default_match if match is None else match
+        border = self.__default_border if border is None else border
+        points = self._normalize_points(points)
+        mbr = self._mbr_of_points(points, border=border)
+        candidates = np.arange(len(self.__levels[-1][0]))
+        for mbrs, firsts, lasts in reversed(self.__levels[1:]):
+            keep = candidates[self.__descend(mbrs[candidates], mbr, match)]
+            candidates = concat_ranges(firsts[keep], lasts[keep])
+        if match != MatchType.EQUALS:
+            candidates = candidates[self.__match(self.__mbrs[candidates], mbr, match)]
+        for i in candidates.tolist():
+            content = self.__contents[i]
+            if (match != MatchType.EQUALS or content[0] == points) and (value is None or value == content[1]):
+                yield content
+
+    def get_all_items(self, many_points, value=None, match=None, border=None):
+        '''
+        An iterator over (index, (MBR, value)) of nodes that match the MBR for any of the given points,
+        where index is the position of the matching points in `many_points`.
+
+        Each level is tested once, for all (request, candidate) pairs together.
+
+        The `match`, `value` and `border` are as for get_items().
+        '''
+        match = self.__default_match if match is None else match
+        border = self.__default_border if border is None else border
+        requests, mbrs = [], []
+        for points in many_points:
+            self._check_points(points)
+            points = self._normalize_points(points)
+            requests.append(points)
+            mbrs.append(self._mbr_of_points(points, border=border))
+        if not self.__contents or not requests:
+            return
+        mbrs = np.array(mbrs, dtype=float)
+        n_top = len(self.__levels[-1][0])
+        indices = np.repeat(np.arange(len(requests)), n_top)
+        candidates = np.tile(np.arange(n_top), len(requests))
+        for level_mbrs, firsts, lasts in reversed(self.__levels[1:]):
+            keep = self.__descend(level_mbrs[candidates], mbrs[indices], match)
+            indices, candidates = indices[keep], candidates[keep]
+            indices = np.repeat(indices, lasts[candidates] - firsts[candidates])
+            candidates = concat_ranges(firsts[candidates], lasts[candidates])
+        if match != MatchType.EQUALS:
+            keep = self.__match(self.__mbrs[candidates], mbrs[indices], match)
+            indices, candidates = indices[keep], candidates[keep]
+        denormalized = {}
+        for index, i in zip(indices.tolist(), candidates.tolist()):
+            points, value_entry = self.__contents[i]
+            if (match != MatchType.EQUALS or points == requests[index]) and (value is None or value == value_entry):
+                if i not in denormalized:
+                    denormalized[i] = self._denormalize_points(points)
+                yield index, (denormalized[i], value_entry)
+
+    @staticmethod
+    def __descend(mbrs, mbr, match):
+        '''
+        Descend in search?  (For each MBR).
+        '''
+        if match in (MatchType.EQUALS, MatchType.CONTAINED):
+            return contains(mbrs, mbr)
+        else:
+            return overlaps(mbrs, mbr)
+
+    @staticmethod
+    def __match(mbrs, mbr, match):
+        '''
+        Match search?  (For each MBR, excluding EQUALS, which compares points).
+        '''
+        if match == MatchType.CONTAINED:
+            return contains(mbrs, mbr)
+        elif match == MatchType.CONTAINS:
+            return contained(mbrs, mbr)
+        else:
+            return overlaps(mbrs, mbr)
+
+    # standard container API
+
+    def __len__(self):
+        return len(self.__contents)
+
+    def keys(self):
+        '''
+        All MBRs.
+        '''
+        for points, value in self.__contents:
+            yield self._denormalize_points(points)
+
+    def values(self):
+        '''
+        All values.
+        '''
+        for points, value in self.__contents:
+            yield value
+
+    def items(self):
+        '''
+        All (points, value) pairs.
+        '''
+        yield from self.__contents
+
+    def __contains__(self, points):
+        '''
+        Equivalent to calling get() with the standard arguments and testing for result.
+        '''
+        try:
+            next(self.get(points))
+            return True
+        except StopIteration:
+            return False
+
+    def __iter__(self):
+        '''
+        Iterable over keys.
+        '''
+        return self.keys()
+
+    def __getitem__(self, points):
+        '''
+        Call get() with equality and no value..
+        '''
+        return self.get(points)
+
+    def __str__(self):
+        return 'STR RTree (%s leaves, %d height, %d entries)' % (len(self), self.height, self.max_entries)
+
+    # allow different coordinate systems (via the same mixins as BaseTree).
+    # the vectorized tests below assume that normalized points are cartesian.
+
+    def _normalize_points(self, points):
+        return tuple(self._normalize_point(p) for p in points)
+
+    @abstractmethod
+    def _normalize_point(self, point):
+        raise NotImplementedError()
+
+    def _denormalize_points(self, points):
+        return tuple(self._denormalize_point(p) for p in points)
+
+    def _denormalize_point(self, point):
+        return point
+
+    @abstractmethod
+    def _mbr_of_points(self, points, border=0):
+        raise NotImplementedError()
+
+
+class CSTRTree(CartesianMixin, BasePackedTree): pass
+
+
+class LSTRTree(LatLonMixin, BasePackedTree): pass
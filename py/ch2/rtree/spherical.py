@@ -2,6 +2,7 @@ from logging import getLogger
 
 from math import pi, cos
 
+from .packed import BasePackedTree
 from .tree import LinearMixin, BaseTree, QuadraticMixin, ExponentialMixin, CartesianMixin
 
 log = getLogger(__name__)
@@ -43,8 +44,8 @@ class LocalTangent:
 
 class SphericalMixin(CartesianMixin):
 
-    def __init__(self, *args, **kargs):
-        self.__plane = LocalTangent()
+    def __init__(self, *args, plane=None, **kargs):
+        self.__plane = plane or LocalTangent()  # trees that share a plane agree on distances
         super().__init__(*args, **kargs)
 
     def _normalize_point(self, point):
@@ -63,6 +64,9 @@ class SQRTree(QuadraticMixin, SphericalMixin, BaseTree): pass
 class SERTree(ExponentialMixin, SphericalMixin, BaseTree): pass
 
 
+class SSTRTree(SphericalMixin, BasePackedTree): pass
+
+
 class Global:
     '''
     Tile a globe.
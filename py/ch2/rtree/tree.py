@@ -2,6 +2,8 @@
 from abc import ABC, abstractmethod
 from enum import IntEnum
 
+import numpy as np
+
 
 class MatchType(IntEnum):
     '''
@@ -14,6 +16,33 @@ class MatchType(IntEnum):
     OVERLAP = 3  # request and node overlap
 
 
+def overlaps(mbrs, mbr):
+    '''
+    Does each of the MBRs intersect the given MBR (or the corresponding MBR, if many)?
+    '''
+    mbr = np.asarray(mbr)
+    return (mbrs[:, 0] <= mbr[..., 2]) & (mbrs[:, 2] >= mbr[..., 0]) & \
+           (mbrs[:, 1] <= mbr[..., 3]) & (mbrs[:, 3] >= mbr[..., 1])
+
+
+def contains(mbrs, mbr):
+    '''
+    Does each of the MBRs contain the given MBR (or the corresponding MBR, if many)?
+    '''
+    mbr = np.asarray(mbr)
+    return (mbrs[:, 0] <= mbr[..., 0]) & (mbrs[:, 2] >= mbr[..., 2]) & \
+           (mbrs[:, 1] <= mbr[..., 1]) & (mbrs[:, 3] >= mbr[..., 3])
+
+
+def contained(mbrs, mbr):
+    '''
+    Is each of the MBRs contained by the given MBR (or the corresponding MBR, if many)?
+    '''
+    mbr = np.asarray(mbr)
+    return (mbr[..., 0] <= mbrs[:, 0]) & (mbr[..., 2] >= mbrs[:, 2]) & \
+           (mbr[..., 1] <= mbrs[:, 1]) & (mbr[..., 3] >= mbrs[:, 3])
+
+
 class BaseTree(ABC):
 
     # nodes in the tree are
@@ -136,6 +165,77 @@ class BaseTree(ABC):
         for points_entry, value_entry in self.__get_leaf_contents(self.__root, mbr_request, content_request, match):
             yield self._denormalize_points(points_entry), value_entry
 
+    def get_all_items(self, many_points, value=None, match=None, border=None):
+        '''
+        An iterator over (index, (MBR, value)) of nodes that match the MBR for any of the given points,
+        where index is the position of the matching points in `many_points`.
+
+        The tree is traversed once, for all requests, so this is faster than calling get_items() repeatedly.
+
+        The `match`, `value` and `border` are as for get_items().
+        '''
+        match = self.__default_match if match is None else match
+        border = self.__default_border if border is None else border
+        requests = []
+        for points in many_points:
+            self._check_points(points)
+            points = self._normalize_points(points)
+            requests.append((self._mbr_of_points(points, border=border), (points, value)))
+        found = []
+        if requests:
+            mbrs = np.array([mbr for mbr, _ in requests], dtype=float)
+            self.__get_all_leaf_contents(self.__root, requests, mbrs, np.arange(len(requests)), match, found)
+        for indices, (points_entry, value_entry) in found:
+            points_entry = self._denormalize_points(points_entry)
+            for index in indices:
+                yield index, (points_entry, value_entry)
+
+    def __get_all_leaf_contents(self, node, requests, mbrs, indices, match, found):
+        '''
+        Internal get from node for many requests (appends the indices of all requests that match each leaf).
+
+        The requests are tested together for each entry (this assumes normalized points are cartesian).
+        '''
+        height, entries = node
+        for mbr_entry, content_entry in entries:
+            if height:
+                descend = indices[self.__descend_all(mbrs[indices], mbr_entry, match)]
+                if len(descend):
+                    self.__get_all_leaf_contents(content_entry, requests, mbrs, descend, match, found)
+            elif match == MatchType.EQUALS:
+                matched = [i for i in indices.tolist()
+                           if self.__match(None, mbr_entry, requests[i][1], content_entry, match)]
+                if matched:
+                    found.append((matched, content_entry))
+            else:
+                value_request = requests[indices[0]][1][1]
+                if value_request is None or value_request == content_entry[1]:
+                    matched = indices[self.__match_all(mbrs[indices], mbr_entry, match)]
+                    if len(matched):
+                        found.append((matched.tolist(), content_entry))
+
+    @staticmethod
+    def __descend_all(mbrs_request, mbr_entry, match):
+        '''
+        Descend in search?  (For each request).
+        '''
+        if match in (MatchType.EQUALS, MatchType.CONTAINED):
+            return contained(mbrs_request, mbr_entry)
+        else:
+            return overlaps(mbrs_request, mbr_entry)
+
+    @staticmethod
+    def __match_all(mbrs_request, mbr_entry, match):
+        '''
+        Match search?  (For each request, excluding EQUALS, which compares points).
+        '''
+        if match == MatchType.CONTAINED:
+            return contained(mbrs_request, mbr_entry)
+        elif match == MatchType.CONTAINS:
+            return contains(mbrs_request, mbr_entry)
+        else:
+            return overlaps(mbrs_request, mbr_entry)
+
     def __get_leaf_contents(self, node, mbr_request, content_request, match):
         '''
         Internal get from node.
@@ -1,5 +1,6 @@
 from weakref import WeakSet
 from collections import defaultdict
+from io import StringIO
 from itertools import groupby
 from logging import getLogger
 
@@ -59,18 +60,9 @@ class BatchLoader:
             self.warning(f'Composite primary key for {mapper}')
         return False
 
-    @staticmethod
-    def __ids(session, mapper, column, n):
-        id_seq_name = f'{mapper.entity.__tablename__}_{column}_seq'
-        schema = mapper.entity.__table__.metadata.schema
-        sequence = Sequence(id_seq_name, schema=schema)
-        return [int(row[0]) for row in session.connection().execute(
-            select([sequence.next_value()]).select_from(text("generate_series(1, :num_values)")),
-            num_values=n)]
-
     def __set_ids(self, session, mapper, column, missing):
         n = len(missing)
-        for id, instance in zip(self.__ids(session, mapper, column, n), missing):
+        for id, instance in zip(next_ids(session, mapper.entity.__table__, column, n), missing):
             setattr(instance, column, id)
         self.rows += 1
 
@@ -111,3 +103,37 @@ class BatchLoader:
         except Exception as e:
             self.error(e)
             raise
+
+
+def next_ids(session, table, column, n):
+    '''
+    Take n ids from the sequence for the given (integer, autoincrement) column.
+    '''
+    sequence = Sequence(f'{table.name}_{column}_seq', schema=table.metadata.schema)
+    return [int(row[0]) for row in session.connection().execute(
+        select([sequence.next_value()]).select_from(text("generate_series(1, :num_values)")),
+        num_values=n)]
+
+
+def copy_text(value):
+    if value is None:
+        return '\\N'
+    else:
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(session, table, columns, rows):
+    '''
+    Write rows (tuples of strings already formatted with copy_text) to the table with COPY FROM STDIN.
+    This is postgres only and bypasses the ORM entirely (so no events, no identity map, no cascades).
+    '''
+    buffer = StringIO()
+    for row in rows:
+        buffer.write('\t'.join(row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f'copy {table.fullname} ({", ".join(columns)}) from stdin', buffer)
+    finally:
+        cursor.close()
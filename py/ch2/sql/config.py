@@ -39,9 +39,9 @@ class Config(BaseConfig):
             s.expunge(process)
             return process
 
-    def run_process(self, owner, cmd, log_name):
+    def run_process(self, owner, cmd, log_name, **kargs):
         with self.db.session_context() as s:
-            return Process.run(s, owner, cmd, log_name)  # todo change order
+            return Process.run(s, owner, cmd, log_name, **kargs)  # todo change order
 
     def delete_process(self, owner, pid, delta_seconds=3):
         with self.db.session_context() as s:
@@ -1,3 +1,4 @@
+from collections import defaultdict
 from contextlib import contextmanager
 from logging import getLogger
 
@@ -25,6 +26,7 @@ MonitorJournal
 Constant, SystemConstant, Process
 ActivitySimilarity, ActivityNearby
 Timestamp, Process, SystemConstant
+DiaryModel
 
 
 log = getLogger(__name__)
@@ -35,23 +37,51 @@ def scheme(uri):
 
 
 class DirtySession(Session):
-    '''Extend Session to record dirty intervals and then mark those intervals when the current transaction ends.'''
+    '''Extend Session to record dirty intervals and then mark those intervals (and the matching diary pages)
+    when the current transaction ends.'''
 
     def __init__(self, *args, **kargs):
         super().__init__(*args, **kargs)
         self.__dirty_ids = set()
+        self.__dirty_dates = defaultdict(list)  # activity group id (None for all) -> [(start, finish), ...]
 
     def record_dirty_intervals(self, ids):
         self.__dirty_ids.update(ids)
 
+    def record_dirty_dates(self, start, finish, activity_group_id=None):
+        self.__dirty_dates[activity_group_id].append((start, finish))
+
+    @staticmethod
+    def __merge(ranges):
+        merged = []
+        for start, finish in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(finish, merged[-1][1]))
+            else:
+                merged.append((start, finish))
+        return merged
+
     def __mark_dirty_intervals(self):
-        if self.__dirty_ids:
-            log.debug(f'Marking {len(self.__dirty_ids)} intervals dirty')
-            for ids in grouper(self.__dirty_ids, 900):
-                self.query(Interval).filter(Interval.id.in_(ids)). \
-                    update({Interval.dirty: True}, synchronize_session=False)
+        if self.__dirty_ids or self.__dirty_dates:
+            if self.__dirty_ids:
+                log.debug(f'Marking {len(self.__dirty_ids)} intervals dirty')
+                for ids in grouper(self.__dirty_ids, 900):
+                    self.query(Interval).filter(Interval.id.in_(ids)). \
+                        update({Interval.dirty: True}, synchronize_session=False)
+                DiaryModel.mark_dirty_intervals(self, self.__dirty_ids)
+            for activity_group_id, ranges in self.__dirty_dates.items():
+                ranges = self.__merge(ranges)
+                n, m = Interval.mark_dirty_dates(self, ranges, activity_group_id)
+                log.debug(f'Marked {n} intervals and {m} diary pages dirty for {ranges} '
+                          f'(activity group {activity_group_id})')
+            if self.__dirty_dates:
+                # diary pages include all activity groups
+                ranges = self.__merge(dates for ranges in self.__dirty_dates.values() for dates in ranges)
+                n = DiaryModel.mark_dirty_dates(self, ranges)
+                log.debug(f'Marked {n} diary pages dirty for {ranges}')
             super().commit()
             self.__dirty_ids = set()
+            self.__dirty_dates = defaultdict(list)
 
     def commit(self):
         super().commit()
@@ -60,6 +90,7 @@ class DirtySession(Session):
     def rollback(self):
         super().rollback()
         self.__dirty_ids = set()
+        self.__dirty_dates = defaultdict(list)
 
 
 class CannotConnect(Exception): pass
@@ -2,6 +2,7 @@
 from .achievement import Achievement
 from .activity import ActivityGroup, ActivityTimespan, ActivityJournal, ActivityBookmark
 from .constant import Constant
+from .diary import DiaryModel
 from .file import FileScan, FileHash
 from .kit import KitGroup, KitItem, KitComponent, KitModel
 from .monitor import MonitorJournal
@@ -0,0 +1,110 @@
+
+from functools import reduce
+from logging import getLogger
+from weakref import WeakSet
+
+from sqlalchemy import Column, Integer, Text, Boolean, Date, UniqueConstraint, or_, and_, exists
+
+from ..support import Base
+from ..types import OpenSched
+from ...lib.utils import grouper
+
+log = getLogger(__name__)
+
+AVAILABLE = WeakSet()  # engines whose databases have the table
+
+
+class DiaryModel(Base):
+    '''
+    The model (as JSON) for a diary page (a day, or the summary for a month or year), saved so that
+    the web interface does not need to run the display pipelines for pages whose data have not changed.
+
+    Pages are marked dirty (with intervals, by DirtySession) when data in their date range change, and
+    are rebuilt when next read, or after processing.
+
+    Databases created before this table was added do not have it until create() is called (after
+    processing).  Until then the methods below do nothing, so pages are built on every read.
+    '''
+
+    __tablename__ = 'diary_model'
+
+    id = Column(Integer, primary_key=True)
+    schedule = Column(OpenSched, nullable=False)
+    start = Column(Date, nullable=False)  # index via unique
+    finish = Column(Date, nullable=False, index=True)
+    dirty = Column(Boolean, default=False, nullable=False)
+    json = Column(Text, nullable=False)
+    UniqueConstraint(start, schedule)
+
+    @classmethod
+    def available(cls, s):
+        engine = s.get_bind()
+        if engine not in AVAILABLE:
+            if not engine.dialect.has_table(s.connection(), cls.__tablename__):
+                return False
+            AVAILABLE.add(engine)
+        return True
+
+    @classmethod
+    def create(cls, s):
+        '''
+        Add the table to databases created before it existed.
+        '''
+        if not cls.available(s):
+            log.info(f'Creating {cls.__tablename__}')
+            cls.__table__.create(s.connection(), checkfirst=True)
+            s.commit()
+
+    @classmethod
+    def get(cls, s, schedule, start):
+        '''
+        The JSON for a clean page, or None.
+        '''
+        if not cls.available(s): return None
+        return s.query(DiaryModel.json). \
+            filter(DiaryModel.schedule == schedule,
+                   DiaryModel.start == start,
+                   DiaryModel.dirty == False).scalar()
+
+    @classmethod
+    def set(cls, s, schedule, start, json):
+        if not cls.available(s): return
+        # commit first so that any changes made while building the page do not mark the new entry dirty
+        s.commit()
+        s.query(DiaryModel). \
+            filter(DiaryModel.schedule == schedule,
+                   DiaryModel.start == start).delete(synchronize_session=False)
+        s.add(DiaryModel(schedule=schedule, start=start, finish=schedule.next_frame(start), json=json))
+        s.commit()
+
+    @classmethod
+    def dirty_pages(cls, s):
+        if not cls.available(s): return []
+        return s.query(DiaryModel.schedule, DiaryModel.start).filter(DiaryModel.dirty == True).all()
+
+    @classmethod
+    def mark_dirty_dates(cls, s, ranges):
+        '''
+        Mark pages that overlap any of the given DATE ranges (inclusive) as dirty (a single update).
+        '''
+        if not cls.available(s): return 0
+        return s.query(DiaryModel). \
+            filter(reduce(or_, [and_(DiaryModel.start <= finish, DiaryModel.finish > start)
+                                for start, finish in ranges])). \
+            update({DiaryModel.dirty: True}, synchronize_session=False)
+
+    @classmethod
+    def mark_dirty_intervals(cls, s, ids):
+        '''
+        Mark pages that overlap any of the given intervals as dirty.
+        '''
+        from .source import Interval
+        if not cls.available(s): return 0
+        n = 0
+        for ids in grouper(ids, 900):
+            n += s.query(DiaryModel). \
+                filter(exists().where(and_(Interval.id.in_(list(ids)),
+                                           Interval.start < DiaryModel.finish,
+                                           Interval.finish > DiaryModel.start))). \
+                update({DiaryModel.dirty: True}, synchronize_session=False)
+        return n
@@ -1,10 +1,12 @@
 import datetime as dt
 from abc import abstractmethod
 from enum import IntEnum
+from functools import reduce
 from logging import getLogger
-from operator import or_
+from operator import or_, and_
 
-from sqlalchemy import ForeignKey, Column, Integer, func, UniqueConstraint, Boolean, Date
+from sqlalchemy import ForeignKey, Column, Integer, func, UniqueConstraint, Boolean, Date, update, select, \
+    exists, true
 from sqlalchemy.event import listens_for
 from sqlalchemy.orm import Session, relationship
 from sqlalchemy.sql.functions import count
@@ -200,6 +202,9 @@ class Interval(Source):
     def missing_starts(cls, s, expected, schedule, interval_owner, exclude_owners=None):
         '''
         Previous approach was way too complicated and not thread-safe.  Instead, just enumerate intervals and test.
+
+        The frames are enumerated here (so follow the schedule exactly) and compared with the number of existing
+        intervals at each start, which are counted in a single query.
         '''
         try:
             stats_start_time, stats_finish_time = cls._raw_statistics_time_range(s, exclude_owners=exclude_owners)
@@ -208,12 +213,14 @@ class Interval(Source):
             log.debug('Statistics (in general) exist %s - %s' % (start, finish))
             start = schedule.start_of_frame(start)
             finish = schedule.next_frame(finish)
+            existing = dict(s.query(Interval.start, count(Interval.id)).
+                            filter(Interval.start >= start,
+                                   Interval.start < finish,
+                                   Interval.schedule == schedule,
+                                   Interval.owner == interval_owner).
+                            group_by(Interval.start).all())
             while start < finish:
-                existing = s.query(Interval). \
-                    filter(Interval.start == start,
-                           Interval.schedule == schedule,
-                           Interval.owner == interval_owner).count()
-                if existing != expected:
+                if existing.get(start, 0) != expected:
                     yield start
                 start = schedule.next_frame(start)
         except NoStatistics:
@@ -225,15 +232,40 @@ class Interval(Source):
         s.record_dirty_intervals(interval.id for interval in s.query(Interval).all())
 
     @classmethod
-    def record_dirty_times(cls, s, start, finish):
+    def record_dirty_times(cls, s, start, finish, activity_group_id=None):
         '''
-        Record dirty intervals that include data in the given TIME range,
+        Record dirty intervals that include data in the given TIME range.  If an activity group is given then
+        only intervals for that group (and intervals without a group) are affected.
         '''
-        start, finish = time_to_local_date(start), time_to_local_date(finish)
-        q = s.query(Interval.id).filter(Interval.start <= finish, Interval.finish > start)
         # do not mark in-place because we can get deadlock transactions.
         # instead, save in session and update at end of transaction
-        s.record_dirty_intervals(row[0] for row in q.all())
+        s.record_dirty_dates(time_to_local_date(start), time_to_local_date(finish), activity_group_id)
+
+    @classmethod
+    def mark_dirty_dates(cls, s, ranges, activity_group_id=None):
+        '''
+        Mark intervals that overlap any of the given DATE ranges as dirty and, in the same statement, any
+        diary pages that overlap those intervals (pages show values calculated over the whole interval,
+        like ranks, so they change even when their own dates do not overlap the ranges).
+
+        Returns the number of intervals and pages marked.
+        '''
+        from .diary import DiaryModel
+        condition = reduce(or_, [and_(Interval.start <= finish, Interval.finish > start) for start, finish in ranges])
+        if activity_group_id is not None:
+            condition = and_(condition, Interval.id.in_(select([Source.id]).
+                                                        where(or_(Source.activity_group_id == activity_group_id,
+                                                                  Source.activity_group_id == None))))
+        intervals = update(Interval.__table__).where(condition).values(dirty=true())
+        if not DiaryModel.available(s):
+            return s.execute(intervals).rowcount, 0
+        intervals = intervals.returning(Interval.start, Interval.finish).cte('intervals')
+        pages = update(DiaryModel.__table__). \
+            where(exists().where(and_(intervals.c.start < DiaryModel.finish,
+                                      intervals.c.finish > DiaryModel.start))). \
+            values(dirty=true()).returning(DiaryModel.id).cte('pages')
+        return tuple(s.execute(select([select([count()]).select_from(intervals).as_scalar(),
+                                       select([count()]).select_from(pages).as_scalar()])).first())
 
     @classmethod
     def clean(cls, s, owner=None):
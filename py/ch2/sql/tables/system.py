@@ -55,6 +55,7 @@ class SystemConstant(Base):
     LAST_GARMIN = 'last-garmin'
     DB_VERSION = 'db-version'
     LOG_COLOR = 'log-color'
+    PIPELINE_COSTS = 'pipeline-costs'
 
 
 class Process(Base):
@@ -69,9 +70,9 @@ class Process(Base):
     log = Column(Text, nullable=True)
 
     @classmethod
-    def run(cls, s, owner, cmd, log_name):
+    def run(cls, s, owner, cmd, log_name, **kargs):
         from ...pipeline.process import fmt_cmd
-        popen = ps.Popen(args=cmd, shell=True)
+        popen = ps.Popen(args=cmd, shell=True, **kargs)
         log.debug(f'Adding command [{fmt_cmd(cmd)}]; pid {popen.pid}')
         s.add(Process(command=cmd, owner=owner, pid=popen.pid, log=log_name))
         s.commit()
@@ -1,10 +1,13 @@
 
-from functools import lru_cache
+from collections import OrderedDict
 from genericpath import exists
 from logging import getLogger
 
 from math import floor
+from os import makedirs, remove, replace
 from os.path import join
+from shutil import copyfileobj
+from tempfile import mkstemp
 from zipfile import ZipFile
 
 import numpy as np
@@ -21,37 +24,100 @@ SAMPLES = 3601
 # from view-source:http://dwtkns.com/srtm30m/
 BASE_URL = 'http://e4ftl01.cr.usgs.gov/MEASURES/SRTMGL1.003/2000.02.11/'
 EXTN = '.SRTMGL1.hgt.zip'
+CACHE_DIR = 'unpacked'
+MAX_TILES = 16  # maps are cheap (pages are only read when used) so this can be larger than a read cache
 
 
 # lots of credit to https://github.com/aatishnn/srtm-python/blob/master/srtm.py
 # (although that has bugs...)
 
 
-@lru_cache(4)  # 4 means our tests are quick (and should tile a local patch)
+class TileStore:
+    '''
+    SRTM tiles, read as memory-mapped arrays.
+
+    Zipped tiles are unpacked once into `cache_dir` (by default a sub-directory of `dir`), so later reads
+    (from any process) map the file directly and the OS page cache is shared.  Open maps are kept in an
+    LRU of (at most) `max_tiles` entries; hits and misses are counted and logged.
+    '''
+
+    def __init__(self, dir, cache_dir=None, max_tiles=MAX_TILES):
+        if max_tiles < 1:
+            raise Exception('The tile cache must hold at least one tile')
+        self.__dir = dir
+        self.__cache_dir = cache_dir or join(dir, CACHE_DIR)
+        self.max_tiles = max_tiles
+        self.__tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, flat, flon):
+        key = (flat, flon)
+        if key in self.__tiles:
+            self.hits += 1
+            self.__tiles.move_to_end(key)
+        else:
+            self.misses += 1
+            self.__tiles[key] = self.__map(flat, flon)
+            while len(self.__tiles) > self.max_tiles:
+                (elat, elon), _ = self.__tiles.popitem(last=False)
+                log.debug(f'Evicted tile {elat},{elon} from cache')
+            log.debug(f'Tile cache for {self.__dir}: {self.hits} hits, {self.misses} misses, '
+                      f'{len(self.__tiles)}/{self.max_tiles} tiles')
+        return self.__tiles[key]
+
+    def __map(self, flat, flon):
+        # https://wiki.openstreetmap.org/wiki/SRTM
+        # The official 3-arc-second and 1-arc-second data for versions 2.1 and 3.0 are divided into 1°×1° data tiles.
+        # The tiles are distributed as zip files containing HGT files labeled with the coordinate of the southwest cell.
+        # For example, the file N20E100.hgt contains data from 20°N to 21°N and from 100°E to 101°E inclusive.
+        root = '%s%02d%s%03d' % ('S' if flat < 0 else 'N', abs(flat), 'W' if flon < 0 else 'E', abs(flon))
+        hgt_file = root + '.hgt'
+        hgt_path = join(self.__dir, hgt_file)
+        if not exists(hgt_path):
+            hgt_path = join(self.__cache_dir, hgt_file)
+            if not exists(hgt_path):
+                self.__unpack(root, hgt_file, hgt_path)
+        log.debug(f'Mapping {hgt_path}')
+        data = np.memmap(hgt_path, dtype=np.dtype('>i2'), mode='r', shape=(SAMPLES, SAMPLES))
+        return np.flip(data, 0)  # a view (no copy)
+
+    def __unpack(self, root, hgt_file, hgt_path):
+        zip_path = join(self.__dir, root + EXTN)
+        if not exists(zip_path):
+            # i tried automating download, but couldn't get ouath2 to work
+            log.warning(f'Download {BASE_URL + root + EXTN}')
+            raise Exception(f'Missing {hgt_file}')
+        log.info(f'Unpacking {zip_path} to {self.__cache_dir}')
+        makedirs(self.__cache_dir, exist_ok=True)
+        # write to a temporary file and rename so that other processes never see a partial tile
+        fd, tmp_path = mkstemp(dir=self.__cache_dir, suffix='.tmp')
+        try:
+            with open(fd, 'wb') as output, ZipFile(zip_path) as zip:
+                with zip.open(hgt_file) as input:
+                    copyfileobj(input, output)
+            replace(tmp_path, hgt_path)
+        except:
+            if exists(tmp_path): remove(tmp_path)
+            raise
+
+
+_TILE_STORES = {}
+
+
+def tile_store(dir, cache_dir=None, max_tiles=None):
+    '''
+    The shared store for the given directory (created if needed).  If given, `max_tiles` resizes the LRU.
+    '''
+    if dir not in _TILE_STORES:
+        _TILE_STORES[dir] = TileStore(dir, cache_dir=cache_dir, max_tiles=max_tiles or MAX_TILES)
+    elif max_tiles:
+        _TILE_STORES[dir].max_tiles = max_tiles
+    return _TILE_STORES[dir]
+
+
 def cached_file_reader(dir, flat, flon):
-    # https://wiki.openstreetmap.org/wiki/SRTM
-    # The official 3-arc-second and 1-arc-second data for versions 2.1 and 3.0 are divided into 1°×1° data tiles.
-    # The tiles are distributed as zip files containing HGT files labeled with the coordinate of the southwest cell.
-    # For example, the file N20E100.hgt contains data from 20°N to 21°N and from 100°E to 101°E inclusive.
-    root = '%s%02d%s%03d' % ('S' if flat < 0 else 'N', abs(flat), 'W' if flon < 0 else 'E', abs(flon))
-    hgt_file = root + '.hgt'
-    hgt_path = join(dir, hgt_file)
-    zip_path = join(dir, root + EXTN)
-    if exists(hgt_path):
-        log.debug(f'Reading {hgt_path}')
-        with open(hgt_path, 'rb') as input:
-            data = input.read()
-    elif exists(zip_path):
-        log.debug(f'Reading {zip_path}')
-        with open(zip_path, 'rb') as input:
-            zip = ZipFile(input)
-            log.debug(f'Found {zip.filelist}')
-            data = zip.open(hgt_file).read()
-    else:
-        # i tried automating download, but couldn't get ouath2 to work
-        log.warning(f'Download {BASE_URL + root + EXTN}')
-        raise Exception(f'Missing {hgt_file}')
-    return np.flip(np.frombuffer(data, np.dtype('>i2'), SAMPLES * SAMPLES).reshape((SAMPLES, SAMPLES)), 0)
+    return tile_store(dir).read(flat, flon)
 
 
 class ElevationSupport:
@@ -65,6 +131,32 @@ class ElevationSupport:
         # construct the path in the reader so it's skipped if we hit the cache
         return flat, flon, self._reader(self._dir, flat, flon)
 
+    def elevations(self, lats, lons):
+        '''
+        Elevations for arrays of lat and lon (NaN where either is NaN).
+
+        Points are grouped by tile and each group is interpolated together.
+        '''
+        if self._dir:
+            lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+            elevations = np.full(lats.shape, np.nan)
+            valid = ~np.isnan(lats) & ~np.isnan(lons)
+            lats, lons = lats[valid], lons[valid]
+            tiles, inverse = np.unique(np.stack([np.floor(lats), np.floor(lons)], axis=1).astype(int),
+                                       axis=0, return_inverse=True)
+            found = np.empty(lats.shape)
+            for k, (flat, flon) in enumerate(tiles.tolist()):
+                tile = inverse.reshape(-1) == k
+                found[tile] = self._interpolate(flat, flon, self._reader(self._dir, flat, flon),
+                                                lats[tile], lons[tile])
+            elevations[valid] = found
+            return elevations
+        else:
+            return None
+
+    def _interpolate(self, flat, flon, data, lats, lons):
+        raise NotImplementedError()
+
 
 def elevation_from_constant(s, interp, dir_name=SRTM1_DIR_CNAME):
     try:
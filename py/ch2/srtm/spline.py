@@ -1,20 +1,29 @@
 
+from collections import OrderedDict
 from functools import lru_cache
+from logging import getLogger
 
 import numpy as np
 from scipy.interpolate import RectBivariateSpline
 
 from .file import SRTM1_DIR_CNAME, SAMPLES, ElevationSupport, elevation_from_constant, cached_file_reader
 
+log = getLogger(__name__)
 
-def spline_elevation_from_constant(s, dir_name=SRTM1_DIR_CNAME, smooth=0):
-    return elevation_from_constant(s, lambda dir: SplineElevation(dir, smooth), dir_name=dir_name)
+PATCH = 128  # samples along each side of a patch (excluding margins)
+MARGIN = 16  # extra samples fitted around each patch so that splines agree at the edges
+MAX_PATCHES = 64
+
+
+def spline_elevation_from_constant(s, dir_name=SRTM1_DIR_CNAME, smooth=0, windowed=False):
+    cls = WindowedSplineElevation if windowed else SplineElevation
+    return elevation_from_constant(s, lambda dir: cls(dir, smooth), dir_name=dir_name)
 
 
 class SplineElevation(ElevationSupport):
 
-    def __init__(self, dir, smooth=0):
-        super().__init__(dir, make_cached_spline_builder(smooth))
+    def __init__(self, dir, smooth=0, reader=None):
+        super().__init__(dir, reader or make_cached_spline_builder(smooth))
 
     def elevation(self, lat, lon):
         if self._dir:
@@ -23,6 +32,9 @@ class SplineElevation(ElevationSupport):
         else:
             return None
 
+    def _interpolate(self, flat, flon, spline, lats, lons):
+        return spline.ev(lats, lons)  # at each point (not a grid)
+
 
 def make_cached_spline_builder(smooth):
 
@@ -35,3 +47,65 @@ def make_cached_spline_builder(smooth):
         return RectBivariateSpline(x, y, h, s=smooth * SAMPLES * SAMPLES * 10)
 
     return cached_spline_builder
+
+
+class WindowedSplineElevation(SplineElevation):
+    '''
+    As SplineElevation, but splines are fitted to small patches of a tile, when a point in the patch is
+    first needed.  So a track needs only the patches around it (rather than the whole tile, which takes
+    seconds and hundreds of MB).
+
+    Each patch is fitted with a margin of extra samples so that results match the full spline closely
+    (not exactly - the full spline depends, weakly, on all data).  Fitted patches are kept in an LRU of
+    (at most) `max_patches` entries.
+    '''
+
+    def __init__(self, dir, smooth=0, patch=PATCH, margin=MARGIN, max_patches=MAX_PATCHES):
+        super().__init__(dir, smooth=smooth, reader=cached_file_reader)
+        self.__smooth = smooth
+        self.__patch = patch
+        self.__margin = margin
+        self.__max_patches = max_patches
+        self.__splines = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def elevation(self, lat, lon):
+        if self._dir:
+            return self.elevations([lat], [lon])[0]
+        else:
+            return None
+
+    def _interpolate(self, flat, flon, h, lats, lons):
+        # group points by patch and evaluate each group together
+        rows = np.minimum(((lats - flat) * (SAMPLES - 1)).astype(int) // self.__patch, (SAMPLES - 2) // self.__patch)
+        cols = np.minimum(((lons - flon) * (SAMPLES - 1)).astype(int) // self.__patch, (SAMPLES - 2) // self.__patch)
+        patches, inverse = np.unique(np.stack([rows, cols], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        elevations = np.empty(lats.shape)
+        for k, (row, col) in enumerate(patches.tolist()):
+            patch = inverse == k
+            elevations[patch] = self.__spline(flat, flon, h, row, col).ev(lats[patch], lons[patch])
+        return elevations
+
+    def __spline(self, flat, flon, h, row, col):
+        key = (flat, flon, row, col)
+        if key in self.__splines:
+            self.hits += 1
+            self.__splines.move_to_end(key)
+        else:
+            self.misses += 1
+            self.__splines[key] = self.__fit(flat, flon, h, row, col)
+            while len(self.__splines) > self.__max_patches:
+                self.__splines.popitem(last=False)
+            log.debug(f'Spline patches: {self.hits} hits, {self.misses} misses')
+        return self.__splines[key]
+
+    def __fit(self, flat, flon, h, row, col):
+        j0, i0 = max(0, row * self.__patch - self.__margin), max(0, col * self.__patch - self.__margin)
+        j1 = min(SAMPLES, (row + 1) * self.__patch + self.__margin + 1)
+        i1 = min(SAMPLES, (col + 1) * self.__patch + self.__margin + 1)
+        x = flat + np.arange(j0, j1) / (SAMPLES - 1)
+        y = flon + np.arange(i0, i1) / (SAMPLES - 1)
+        # scale smoothing by the number of points, as for the full tile
+        return RectBivariateSpline(x, y, h[j0:j1, i0:i1], s=self.__smooth * len(x) * len(y) * 10)
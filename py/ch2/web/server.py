@@ -97,7 +97,7 @@ class WebServer:
 
         analysis = Analysis()
         configure = Configure(config)
-        diary = Diary()
+        diary = Diary(config)
         jupyter = Jupyter(config, self.__config.args[JUPYTER])
         kit = Kit()
         static = Static('.static')
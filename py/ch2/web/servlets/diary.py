@@ -3,12 +3,10 @@ import time as t
 from logging import getLogger
 
 from ..json import JsonResponse
-from ...diary.database import read_date, read_schedule
-from ...diary.views.web import rewrite_db
+from ...diary.database import read_model
 from ...lib import time_to_local_time
 from ...common.date import now_local, time_to_local_date, format_date
-from ...lib.schedule import Schedule
-from ...sql import ActivityJournal, StatisticJournal
+from ...sql import ActivityJournal, StatisticJournal, DiaryModel
 from ...pipeline.display.activity.utils import active_days, active_months
 
 log = getLogger(__name__)
@@ -18,14 +16,13 @@ class Diary:
 
     FMT = ('%Y', '%Y-%m', '%Y-%m-%d')
 
-    @staticmethod
-    def read_diary(request, s, date):
+    def __init__(self, config):
+        self.__config = config
+
+    def read_diary(self, request, s, date):
         schedule, date = parse_date(date)
-        if schedule == 'd':
-            data = read_date(s, date)
-        else:
-            data = read_schedule(s, Schedule(schedule), date)
-        return rewrite_db(list(data))
+        # pages built while processing may be missing data that are still to be calculated
+        return read_model(s, schedule, date, save=not self.__config.exists_any_process())
 
     def read_neighbour_activities(self, request, s, date):
         # used in the sidebar menu to advance/retreat to the next activity
@@ -56,15 +53,18 @@ class Diary:
         # used to write modified fields back to the database
         data = request.json
         log.info(data)
-        n = 0
+        n, dates = 0, set()
         for key, value in data.items():
             try:
                 id = int(key)
                 journal = s.query(StatisticJournal).filter(StatisticJournal.id == id).one()
                 journal.set(value)
+                dates.add(time_to_local_date(journal.time))
                 n += 1
             except Exception as e:
                 log.error(f'Could not save {key}:{value}: {e}')
+        # text values do not make intervals dirty, so mark the pages directly
+        if dates: DiaryModel.mark_dirty_dates(s, [(date, date) for date in dates])
         s.commit()
         log.info(f'Saved {n} values')
 
@@ -48,6 +48,27 @@ class TestActivities(LogTestCase):
             self.assertNotEqual(journal.start, journal.finish)
             print(n)
 
+    def test_missing_tile(self):
+        # an srtm directory without the tile for the activity - elevation comes from altitude
+        user = random_test_user()
+        with TemporaryDirectory() as srtm:
+            bootstrap_db(user, m(V), '5', mm(DEV), configurator=default)
+            config = bootstrap_db(user, m(V), '5', 'constants', 'set', 'SRTM1.dir', srtm, mm(FORCE))
+            constants(config)
+            with TemporaryDirectory() as f:
+                config = bootstrap_db(user, mm(BASE), f, m(V), '5', mm(DEV), 'upload',
+                                      'data/test/source/python-fitparse/garmin-edge-820-bike.fit')
+                upload(config)
+
+        with config.db.session_context() as s:
+            def n_values(name):
+                return s.query(count(StatisticJournalFloat.id)). \
+                    join(StatisticName). \
+                    filter(StatisticName.name == name).scalar()
+            self.assertEqual(0, n_values(N.RAW_ELEVATION))
+            self.assertTrue(n_values(N.ALTITUDE) > 0)
+            self.assertEqual(n_values(N.ALTITUDE), n_values(N.ELEVATION))
+
     def test_segment_bug(self):
         user = random_test_user()
         with TemporaryDirectory() as f:
@@ -1,10 +1,26 @@
+import datetime as dt
+import tracemalloc
 from json import loads
+from os import listdir
+from os.path import join
+from tempfile import TemporaryDirectory
 
-from ch2.commands.args import V, bootstrap_db
+import numpy as np
+import pandas as pd
+from sqlalchemy import literal_column, func
+
+from ch2.commands.args import V, DB_VERSION, bootstrap_db
 from ch2.common.args import m
+from ch2.config.profiles.default import default
+from ch2.data import Statistics, read_query, read_query_chunks, label_by_intervals, mean_by_intervals
+from ch2.data.cache import ActivityFrameCache, FRAME_DIR
+from ch2.data.climb import add_climb_stats
 from ch2.lib.data import MutableAttr, reftuple
-from ch2.sql import StatisticJournalFloat, StatisticJournalText, Source
-from ch2.sql.tables.source import SourceType
+from ch2.names import Names as N
+from ch2.pipeline.loader import Loader
+from ch2.sql import StatisticJournalFloat, StatisticJournalInteger, StatisticJournalText, Source, Timestamp
+from ch2.sql.tables.source import SourceType, Composite
+from ch2.sql.utils import add
 from tests import LogTestCase, random_test_user
 
 
@@ -37,3 +53,165 @@ class TestData(LogTestCase):
         from ch2.pipeline.calculate.power import PowerModel, BikeModel
         self.assertEqual(BikeModel.__module__, 'ch2.pipeline.calculate.power')
         self.assertEqual(PowerModel.__module__, 'ch2.pipeline.calculate.power')
+
+    def test_bulk(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5', configurator=default)
+        start = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        with config.db.session_context() as s:
+            source = add(s, Composite(n_components=0))
+            s.commit()
+            loader = Loader(s, 'Bulk', add_serial=False)
+            for i in range(20000):
+                time = start + dt.timedelta(seconds=i)
+                loader.add('float', None, None, source, i / 3, time, StatisticJournalFloat, description='float')
+                loader.add('integer', None, None, source, i, time, StatisticJournalInteger, description='int')
+                if i % 3:
+                    loader.add('gaps', None, None, source, i, time, StatisticJournalInteger, description='gaps')
+                if not i % 7:
+                    loader.add('text', None, None, source, f'{i}', time, StatisticJournalText, description='text')
+            loader.load()
+        names = ('float', 'gaps', 'text', 'integer')
+        with config.db.session_context() as s:
+            source = s.query(Composite).one()
+            expected, df = [Statistics(s, sources=[source], with_source=True, bulk=bulk).by_name('Bulk', *names).df
+                            for bulk in (False, True)]
+            self.assertEqual(len(df), 20000)
+            self.assertEqual(list(df.columns), [name for name in names for name in (name, N._src(name))])
+            self.assertEqual(df['integer'].dtype, np.int64)
+            pd.testing.assert_frame_equal(expected, df)
+
+    def test_frame_cache(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5', configurator=default)
+        start = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        with TemporaryDirectory() as base, config.db.session_context() as s:
+            cache = ActivityFrameCache(base)
+            source = add(s, Composite(n_components=0))
+            s.commit()
+            loader = Loader(s, 'Cache', add_serial=False)
+            for i in range(20000):
+                time = start + dt.timedelta(seconds=i)
+                loader.add('float', None, None, source, i / 3, time, StatisticJournalFloat, description='float')
+                if i % 3:
+                    loader.add('gaps', None, None, source, i, time, StatisticJournalInteger, description='gaps')
+                if not i % 7:
+                    loader.add('text', None, None, source, f'{i}', time, StatisticJournalText, description='text')
+            loader.load()
+            Timestamp.set(s, 'Cache', source=source)
+            cache.write(s, source, 'Cache', loader)
+            names = ('gaps', 'text', 'float')
+            expected, df = [Statistics(s, sources=[source], bulk=True, frame_cache=frame_cache).
+                                by_name('Cache', *names).df for frame_cache in (None, cache)]
+            self.assertEqual(len(df), 20000)
+            pd.testing.assert_frame_equal(expected, df)
+            self.assertEqual((cache.hits, cache.misses), (1, 0))
+            # a subset of columns has only the rows with values
+            df = Statistics(s, sources=[source], bulk=True, frame_cache=cache).by_name('Cache', 'gaps').df
+            self.assertEqual(len(df), len(expected['gaps'].dropna()))
+            self.assertEqual(df['gaps'].dtype, np.int64)
+            # re-reading the data (or deleting the source) clears the timestamp
+            Timestamp.set(s, 'Cache', source=source)
+            self.assertIsNone(cache.read(s, source))
+            self.assertEqual(listdir(join(base, DB_VERSION, FRAME_DIR)), [])
+            # files for deleted sources are pruned
+            cache.write(s, source, 'Cache', loader)
+            self.assertEqual(cache.prune(s), 0)
+            s.delete(source)
+            s.commit()
+            self.assertEqual(cache.prune(s), 1)
+            self.assertEqual(listdir(join(base, DB_VERSION, FRAME_DIR)), [])
+
+    def test_stream(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5', configurator=default)
+        start = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        with config.db.session_context() as s:
+            source = add(s, Composite(n_components=0))
+            s.commit()
+            loader = Loader(s, 'Stream', add_serial=True)
+            # enough rows for several chunks at the default size
+            for i in range(25000):
+                time = start + dt.timedelta(seconds=i)
+                loader.add('float', None, None, source, i / 3, time, StatisticJournalFloat, description='float')
+                loader.add('text', None, None, source, f'{i}', time, StatisticJournalText, description='text')
+            loader.load()
+            for type in StatisticJournalFloat, StatisticJournalText:
+                q = s.query(type.time.label(N.INDEX), type.serial, type.value). \
+                    filter(type.source_id == source.id).order_by(type.time)
+                expected = read_query(q, index=N.INDEX)
+                self.assertEqual(len(expected), 25000)
+                pd.testing.assert_frame_equal(expected, read_query(q, index=N.INDEX, stream=True, rows=999))
+                pd.testing.assert_frame_equal(expected.reset_index(), read_query(q, stream=True))
+            self.assertEqual([len(df) for df in read_query_chunks(q)], [10000, 10000, 5000])
+            empty = q.filter(type.id < 0)
+            pd.testing.assert_frame_equal(read_query(empty, index=N.INDEX), read_query(empty, index=N.INDEX, stream=True))
+
+    def test_stream_memory(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5')
+
+        def peak(read):
+            tracemalloc.start()
+            read()
+            size = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return size
+
+        with config.db.session_context() as s:
+            g = literal_column('g')
+            q = s.query(g.label('i'), (g / 3.0).label('x')).select_from(func.generate_series(1, 100000).alias('g'))
+            size = read_query(q).memory_usage().sum()
+            unstreamed = peak(lambda: read_query(q))
+            streamed = peak(lambda: read_query(q, stream=True, rows=500))
+            chunked = peak(lambda: sum(len(df) for df in read_query_chunks(q, rows=500)))
+            # row objects are avoided when streaming, and only chunks bound memory
+            self.assertLess(streamed, unstreamed / 3)
+            self.assertLess(chunked, size / 2)
+
+    def test_mean_by_intervals(self):
+        start = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        index = pd.DatetimeIndex([start + dt.timedelta(seconds=i) for i in range(100000)], name=N.INDEX)
+        rng = np.random.default_rng(42)
+        power = pd.Series(rng.uniform(0, 300, len(index)), index=index)
+        power[rng.random(len(index)) < 0.1] = np.nan
+        # overlapping and touching intervals, some outside the data, bounds on and between rows
+        starts = [start + dt.timedelta(seconds=float(t)) for t in rng.uniform(-1000, 101000, 500).round(1)]
+        finishes = [t + dt.timedelta(seconds=float(d)) for t, d in zip(starts, rng.integers(0, 300, 500))]
+        starts += finishes[:10]
+        finishes += [t + dt.timedelta(seconds=60) for t in finishes[:10]]
+        expected = [power.loc[s:f].mean() for s, f in zip(starts, finishes)]
+        # cumulative sums differ from the direct means by rounding only
+        np.testing.assert_allclose(expected, mean_by_intervals(power, starts, finishes), rtol=1e-9)
+        shuffled = rng.permutation(len(index))
+        np.testing.assert_allclose(expected, mean_by_intervals(power.iloc[shuffled], starts, finishes), rtol=1e-9)
+        self.assertEqual(len(mean_by_intervals(power, [], [])), 0)
+        # climbs that share rows each have the mean of all their rows
+        df = pd.DataFrame({N.POWER_ESTIMATE: power})
+        climbs = [{N.TIME: finish, N.CLIMB_TIME: (finish - start).total_seconds()}
+                  for start, finish in zip(starts, finishes)]
+        add_climb_stats(df, climbs)
+        for climb, power in zip(climbs, expected):
+            if np.isnan(power):
+                self.assertNotIn(N.CLIMB_POWER, climb)
+            else:
+                self.assertAlmostEqual(climb[N.CLIMB_POWER], power, places=6)
+
+    def test_label_by_intervals(self):
+        start = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        index = pd.DatetimeIndex([start + dt.timedelta(seconds=i) for i in range(100000)], name=N.INDEX)
+        df = pd.DataFrame({'x': np.arange(len(index))}, index=index)
+        rng = np.random.default_rng(42)
+        # hundreds of intervals, some overlapping, some outside the data, and bounds on and between rows
+        starts = [start + dt.timedelta(seconds=float(t)) for t in rng.uniform(-1000, 101000, 500).round(1)]
+        finishes = [t + dt.timedelta(seconds=float(d)) for t, d in zip(starts, rng.integers(0, 300, 500))]
+        labels = list(range(1, 501))
+        expected = df.copy()
+        expected['label'] = np.nan
+        for s, f, label in zip(starts, finishes, labels):
+            expected.loc[s:f, ['label']] = label
+        found = label_by_intervals(index, starts, finishes, labels)
+        np.testing.assert_array_equal(expected['label'].values, found)
+        shuffled = rng.permutation(len(index))
+        np.testing.assert_array_equal(found[shuffled], label_by_intervals(index[shuffled], starts, finishes, labels))
+        self.assertTrue(np.isnan(label_by_intervals(index, [], [], [])).all())
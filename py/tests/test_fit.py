@@ -1,12 +1,18 @@
+import datetime as dt
+from gc import disable, enable
 from glob import glob
 from logging import getLogger
 from os.path import basename, join, exists
 
+import numpy as np
+
 from ch2.commands.args import FIELDS, TABLES, GREP
-from ch2.fit.format.read import filtered_records
-from ch2.fit.format.records import no_names, append_units, no_bad_values, fix_degrees, chain
+from ch2.fit.format.columns import times
+from ch2.fit.format.read import filtered_records, filtered_columns, parse_data
+from ch2.fit.format.records import no_names, append_units, no_bad_values, fix_degrees, chain, merge_duplicates
+from ch2.fit.format.tokens import Defined
 from ch2.fit.profile.fields import DynamicField
-from ch2.fit.profile.profile import read_external_profile, read_fit
+from ch2.fit.profile.profile import read_external_profile, read_fit, map_fit, read_profile
 from ch2.fit.summary import summarize, summarize_csv, summarize_tables
 from ch2.lib.tests import OutputMixin, HEX_ADDRESS, EXC_HDR_CHK, sub_extn, EXC_FLD, sub_dir, RNM_UNKNOWN, ROUND_DISTANCE
 from tests import LogTestCase
@@ -48,6 +54,82 @@ class TestFit(LogTestCase, OutputMixin):
                 print(record.into(tuple, filter=chain(no_names, append_units, no_bad_values, fix_degrees)),
                       file=output)
 
+    def test_unknown_bad(self):
+        # unknown fields are always checked for bad values, even with check_bad=False
+        _, types, messages = read_external_profile(self.profile_path)
+        data = read_fit(join(self.test_dir, 'source/personal/2018-07-26-rec.fit'))
+        results = []
+        for compiled in (False, True):
+            tokens = [token for _, token in parse_data(data, types, messages)[1] if isinstance(token, Defined)]
+            results.append([list(token.parse_token(compiled=compiled, check_bad=False).data) for token in tokens])
+        interpreted, compiled = results
+        self.assertEqual(interpreted, compiled)
+        self.assertTrue(any(name.startswith('@') and value[0] is None
+                            for record in compiled for name, value in record))
+
+    def test_map_fit(self):
+        # the file is unmapped on exit (without waiting for garbage collection), even after errors
+        types, messages = read_profile()
+        disable()
+        try:
+            with map_fit(join(self.test_dir, 'source/personal/2018-07-26-rec.fit')) as data:
+                tokens = list(parse_data(data, types, messages)[1])
+                del tokens
+            with self.assertRaisesRegex(Exception, 'Bad checksum'):
+                with map_fit(join(self.test_dir, 'source/python-fitparse/activity-filecrc.fit')) as data:
+                    list(parse_data(data, types, messages)[1])
+            with self.assertRaises(BufferError):
+                with map_fit(join(self.test_dir, 'source/personal/2018-07-26-rec.fit')) as data:
+                    tokens = list(parse_data(data, types, messages)[1])
+        finally:
+            enable()
+
+    def test_columns(self):
+        paths = glob(join(self.test_dir, 'source/personal/2018-0*.fit')) + \
+                [join(self.test_dir, 'source/python-fitparse/compressed-speed-distance.fit')]
+        names = ('record', 'event')
+        for fit_file in paths:
+            data = read_fit(fit_file)
+            _, _, columns = filtered_columns(data, record_names=names)
+            _, _, all_columns = filtered_columns(data)
+            _, _, records = filtered_records(data, record_names=names, pipeline=[merge_duplicates, no_bad_values])
+            records = [record for _, _, record in records]
+            self.assertEqual(set(columns), set(names) & set(all_columns))
+            for name in columns:
+                expected = [record for record in records if record.name == name]
+                self.assertEqual(len(columns[name]), len(expected))
+                self.assertEqual(times(columns[name].timestamp), [record.timestamp for record in expected])
+                fields = set(field for record in expected for field in record.data) - {'timestamp'}
+                self.assertEqual(fields - set(columns[name].names), set())
+                for field in columns[name].names:
+                    # selecting messages does not change values (eg accumulated values)
+                    np.testing.assert_array_equal(columns[name][field], all_columns[name][field])
+                    values = columns[name][field]
+                    values = values.astype('datetime64[s]').tolist() if values.dtype.kind == 'M' else values.tolist()
+                    for value, record in zip(values, expected):
+                        self.assert_field(field, value, record.data[field][0] if field in record.data else None)
+
+    def assert_field(self, field, value, expected):
+        values = value if isinstance(value, list) else [value]
+        if expected is None:
+            for value in values:
+                self.assertTrue(value is None or value != value, f'{field}: {value}')  # None or nan
+            return
+        if field.startswith('@'):
+            # the record parser repeats unknown fields that appear more than once in a definition
+            expected = expected[:len(values)]
+        self.assertEqual(len(values), len(expected), field)
+        for value, expected in zip(values, expected):
+            if expected is None:
+                self.assertTrue(value is None or value != value, f'{field}: {value}')
+            elif isinstance(expected, dt.datetime):
+                if expected.tzinfo: expected = expected.astimezone(dt.timezone.utc).replace(tzinfo=None)
+                self.assertEqual(value, expected, field)
+            elif isinstance(expected, (int, float)) and not isinstance(expected, bool):
+                self.assertAlmostEqual(value, expected, msg=field)
+            else:
+                self.assertEqual(value, expected, field)
+
     def test_dump(self):
         with self.assertTextMatch(join(self.test_dir, 'target/personal/TestFit.test_dump')) as output:
             summarize(FIELDS, read_fit(join(self.test_dir, 'source/personal/2018-07-30-rec.fit')),
@@ -0,0 +1,115 @@
+from logging import getLogger
+from os.path import join
+from pickle import dumps, loads
+from tempfile import TemporaryDirectory
+
+from ch2.fit.format.crc import crc
+from ch2.fit.format.read import parse_data
+from ch2.fit.format.tokens import State, FileHeader, token_factory, Checksum, Defined
+from ch2.fit.profile.compact import CompactProfile, write_compact
+from ch2.fit.profile.profile import read_fit, read_profile, map_fit, read_external_profile
+from tests import LogTestCase
+
+log = getLogger(__name__)
+
+
+def copying_parse_data(data, types, messages):
+    # the original parser, which passed a copy of the remaining data to each token
+    state = State(types, messages)
+    file_header = FileHeader(data)
+    yield 0, file_header
+    offset = len(file_header)
+    file_header.validate(data, log)
+    while len(data) - offset > 2:
+        token = token_factory(data[offset:], state)
+        yield offset, token
+        offset += len(token)
+    checksum = Checksum(data[offset:])
+    yield offset, checksum
+    checksum.validate(data, log)
+
+
+def nibble_crc(data):
+    # the original checksum calculation, one nibble at a time
+    CRC = [0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+           0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400]
+    checksum = 0
+    for byte in data:
+        tmp = CRC[checksum & 0xf]
+        checksum = (checksum >> 4) & 0xfff
+        checksum = checksum ^ tmp ^ CRC[byte & 0xf]
+        tmp = CRC[checksum & 0xf]
+        checksum = (checksum >> 4) & 0xfff
+        checksum = checksum ^ tmp ^ CRC[(byte >> 4) & 0xf]
+    return checksum
+
+
+class TestFitSpeed(LogTestCase):
+
+    '''
+    Confirm that the faster paths agree with the originals.
+    '''
+
+    FILES = ['personal/2018-03-04-qdp.fit', 'personal/2018-08-27-rec.fit', 'other/3316129931.fit',
+             'python-fitparse/activity-large-fenxi2-multisport.fit']
+
+    def setUp(self):
+        super().setUp()
+        self.test_dir = 'data/test/source'
+        self.types, self.messages = read_profile()
+
+    def test_memoryview(self):
+        for name in self.FILES:
+            path = join(self.test_dir, name)
+            data = read_fit(path)
+            copied = list(copying_parse_data(data, self.types, self.messages))
+            viewed = list(parse_data(data, self.types, self.messages)[1])
+            with map_fit(path) as mapped:
+                mapped = list(parse_data(mapped, self.types, self.messages)[1])
+                self.assertEqual([(offset, token.tag, bytes(token.data)) for offset, token in copied],
+                                 [(offset, token.tag, bytes(token.data)) for offset, token in mapped])
+                del mapped
+            self.assertEqual([(offset, str(token)) for offset, token in copied],
+                             [(offset, str(token)) for offset, token in viewed])
+
+    def test_crc(self):
+        for name in self.FILES:
+            data = read_fit(join(self.test_dir, name))
+            for length in (0, 1, 13, len(data) // 3, len(data) - 2):
+                self.assertEqual(nibble_crc(data[:length]), crc(data[:length]))
+                self.assertEqual(crc(data), crc(data[length:], checksum=crc(data[:length])))
+            self.assertEqual(nibble_crc(data), crc(memoryview(data)))
+
+    def test_compiled(self):
+        for name in self.FILES:
+            data = read_fit(join(self.test_dir, name))
+            results = []
+            for compiled in (False, True):
+                # accumulators live in the state, so each path needs fresh tokens
+                tokens = [token for _, token in parse_data(data, self.types, self.messages)[1]
+                          if isinstance(token, Defined)]
+                results.append([list(token.parse_token(compiled=compiled).data) for token in tokens])
+            expected, records = results
+            self.assertEqual(expected, records)
+
+    def test_profile(self):
+        nlog, types, messages = read_external_profile('data/sdk/Profile.xlsx')
+        pickled = dumps((nlog, types, messages))
+        with TemporaryDirectory() as dir:
+            path = join(dir, 'profile')
+            write_compact(path, nlog, types, messages)
+            for name in self.FILES:
+                data = read_fit(join(self.test_dir, name))
+                _, full_types, full_messages = loads(pickled)
+                full_tokens = list(parse_data(data, full_types, full_messages)[1])
+                profile = CompactProfile(path, log)
+                tokens = list(parse_data(data, profile.types, profile.messages)[1])
+                self.assertEqual([(record.name, record.timestamp, list(record.data.items()))
+                                  for record in (token.parse_token().force() for _, token in full_tokens)],
+                                 [(record.name, record.timestamp, list(record.data.items()))
+                                  for record in (token.parse_token().force() for _, token in tokens)])
+            # a profile in the old format (a single pickle) is rejected with a useful message
+            with open(path, 'wb') as output:
+                output.write(pickled)
+            with self.assertRaisesRegex(Exception, 'package-fit-profile'):
+                CompactProfile(path, log)
@@ -0,0 +1,131 @@
+import datetime as dt
+from logging import getLogger
+
+from ch2.commands.args import V, bootstrap_db
+from ch2.common.args import m
+from ch2.config.profiles.default import default
+from ch2.lib.schedule import Schedule
+from ch2.pipeline.loader import Loader
+from ch2.sql.tables.activity import ActivityGroup
+from ch2.sql.tables.source import Composite, Interval
+from ch2.sql.tables.statistic import StatisticJournal, StatisticJournalFloat, StatisticJournalInteger, \
+    StatisticJournalText, StatisticJournalTimestamp, StatisticName
+from ch2.sql.tables.topic import DiaryTopicJournal
+from ch2.sql.utils import add
+from tests import LogTestCase, random_test_user
+
+log = getLogger(__name__)
+
+
+class MaxLoader(Loader):
+
+    def _resolve_duplicate(self, name, time, value, prev):
+        return max(value, prev)
+
+
+class TestLoader(LogTestCase):
+
+    N = 10000
+
+    def load(self, config, owner, source_id, copy):
+        start = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        with config.db.session_context() as s:
+            loader = Loader(s, owner, copy=copy)
+            for i in range(self.N):
+                time = start + dt.timedelta(seconds=i)
+                loader.add('float', None, None, source_id, i / 3, time, StatisticJournalFloat, description='float')
+                loader.add('integer', None, None, source_id, i, time, StatisticJournalInteger, description='int')
+                if not i % 100:
+                    loader.add('text', None, None, source_id, f'a\tb\\c\n{i}', time, StatisticJournalText,
+                               description='text')
+                    loader.add('timestamp', None, None, source_id, time, time, StatisticJournalTimestamp,
+                               description='timestamp')
+            loader.load()
+
+    def read(self, config, owner):
+        with config.db.session_context() as s:
+            return [(journal.statistic_name.name, journal.time, journal.value, journal.serial,
+                     journal.source_id, type(journal))
+                    for journal in s.query(StatisticJournal).join(StatisticName).
+                        filter(StatisticName.owner == owner).
+                        order_by(StatisticJournal.time, StatisticName.name).all()]
+
+    def source(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5', configurator=default)
+        with config.db.session_context() as s:
+            source = add(s, DiaryTopicJournal(date='2020-01-01'))
+            s.flush()
+            return config, source.id
+
+    def test_copy(self):
+        config, source_id = self.source()
+        self.load(config, 'ORM', source_id, False)
+        self.load(config, 'Copy', source_id, True)
+        expected, loaded = self.read(config, 'ORM'), self.read(config, 'Copy')
+        self.assertEqual(len(expected), 2 * self.N + 2 * self.N // 100)
+        self.assertEqual(expected, loaded)
+
+    def test_duplicates(self):
+        config, source_id = self.source()
+        start = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        times = [start + dt.timedelta(seconds=i) for i in range(5)]
+        with config.db.session_context() as s:
+            loader = Loader(s, 'Conflict', add_serial=False)
+            loader.add('x', None, None, source_id, 1.0, times[0], StatisticJournalFloat, description='x')
+            loader.add('x', None, None, source_id, 2.0, times[0], StatisticJournalFloat, description='x')
+            with self.assertRaisesRegex(Exception, 'Conflict'):
+                loader.load()
+        with config.db.session_context() as s:
+            loader = MaxLoader(s, 'Max', add_serial=False)
+            for time, value in zip(times + times[1:3], [1, 2, 3, 4, 5, 2, 7]):
+                loader.add('x', None, None, source_id, float(value), time, StatisticJournalFloat, description='x')
+            for time in times[::2]:
+                loader.add('y', None, None, source_id, 'y', time, StatisticJournalText, description='y')
+            loader.add('y', None, None, source_id, 'y', times[2], StatisticJournalText, description='y')
+            waypoints = loader.as_waypoints({'x': 'x', 'y': 'y'})
+            self.assertEqual([(w.time, w.x, w.y) for w in waypoints],
+                             [(times[0], 1, 'y'), (times[1], 2, None), (times[2], 7, 'y'),
+                              (times[3], 4, None), (times[4], 5, 'y')])
+            self.assertEqual(dict(loader.coverage_percentages()), {'x': 100, 'y': 60})
+            loader.load()
+        self.assertEqual([(name, value) for name, _, value, *_ in self.read(config, 'Max')],
+                         [('x', 1), ('y', 'y'), ('x', 2), ('x', 7), ('y', 'y'), ('x', 4), ('x', 5), ('y', 'y')])
+
+    def test_integers(self):
+        config, source_id = self.source()
+        start = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        with config.db.session_context() as s:
+            loader = Loader(s, 'Integer', add_serial=False)
+            # integral floats (and float source ids) as from a dataframe
+            loader.add('i', None, None, float(source_id), 3.0, start, StatisticJournalInteger, description='i')
+            with self.assertRaisesRegex(Exception, 'Non-integral'):
+                loader.add('i', None, None, source_id, 2.5, start, StatisticJournalInteger, description='i')
+            loader.load()
+        self.assertEqual([(value, type(value), journal_source_id) for _, _, value, _, journal_source_id, _
+                          in self.read(config, 'Integer')], [(3, int, source_id)])
+
+    def test_dirty(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5', configurator=default)
+        start = dt.datetime(2020, 1, 1, 12, tzinfo=dt.timezone.utc)
+        with config.db.session_context() as s:
+            groups = [None] + s.query(ActivityGroup).order_by(ActivityGroup.id).all()[:2]
+            group_ids = [group.id if group else 0 for group in groups]
+            intervals = [add(s, Interval(schedule=Schedule('d'), owner='Dirty', activity_group=group,
+                                         start=(start + dt.timedelta(days=i)).date()))
+                         for group in groups for i in range(10)]
+            source = add(s, Composite(n_components=0, activity_group=groups[1]))
+            s.commit()
+            loader = Loader(s, 'Data', add_serial=False, clear_timestamp=False)
+            for i in range(3 * 24, 5 * 24):
+                loader.add('x', None, None, source, float(i), start + dt.timedelta(hours=i), StatisticJournalFloat,
+                           description='x')
+            # values for intervals do not make other intervals dirty
+            loader.add('x', None, None, intervals[-1], 0.0, start, StatisticJournalFloat, description='x')
+            loader.load()
+        with config.db.session_context() as s:
+            dirty = sorted(((interval.activity_group_id or 0), (interval.start - start.date()).days)
+                           for interval in s.query(Interval).filter(Interval.dirty == True).all())
+        # data from midday on the 4th to the 6th; ungrouped intervals are affected by all groups
+        self.assertEqual(dirty, [(group_id, day) for group_id in sorted(group_ids[:2]) for day in (3, 4, 5)])
@@ -1,3 +1,5 @@
+import datetime as dt
+from json import dumps
 from logging import getLogger
 from tempfile import TemporaryDirectory
 
@@ -5,9 +7,13 @@ from ch2.commands.args import DEV, V, BASE, bootstrap_db, UPLOAD
 from ch2.commands.upload import upload
 from ch2.common.args import mm, m
 from ch2.config.profiles.default import default
-from ch2.diary.database import read_date
-from ch2.diary.model import LABEL, VALUE
-from ch2.lib import to_date
+from ch2.diary.database import read_date, read_model, build_model, refresh_models
+from ch2.diary.model import LABEL, VALUE, SCHEDULES
+from ch2.lib import to_date, local_date_to_time
+from ch2.lib.schedule import Schedule
+from ch2.pipeline.loader import Loader
+from ch2.sql import DiaryModel, StatisticJournalFloat, Composite
+from ch2.sql.utils import add
 from tests import LogTestCase, random_test_user
 
 log = getLogger(__name__)
@@ -35,3 +41,62 @@ class TestModel(LogTestCase):
                 self.assertEqual(name[VALUE], '2018-03-04T07:16:33')
                 route = activity[2]
                 self.assertEqual(route[LABEL], 'Route')
+
+    def test_saved_model(self):
+        user = random_test_user()
+        with TemporaryDirectory() as f:
+            bootstrap_db(user, mm(BASE), f, m(V), '5', mm(DEV), configurator=default)
+            config = bootstrap_db(user, mm(BASE), f, mm(DEV), UPLOAD,
+                                  'data/test/source/personal/2018-03-04-qdp.fit', '-K', 'n_cpu=1')
+            upload(config)
+            date, day = to_date('2018-03-04'), Schedule('d')
+            with config.db.session_context() as s:
+                # pages for the latest activity are built after processing
+                self.assertEqual(sorted((str(model.schedule), model.start, model.dirty)
+                                        for model in s.query(DiaryModel).all()),
+                                 [('d', date, False), ('m', to_date('2018-03-01'), False),
+                                  ('y', to_date('2018-01-01'), False)])
+                expected = build_model(s, day, date)
+                self.assertEqual(dumps(read_model(s, 'd', date)), dumps(expected))
+                # the activity has ranks over the month (and longer)
+                self.assertIn(f'"{SCHEDULES}"', DiaryModel.get(s, day, date))
+                # so new data on another day that month make the page dirty
+                source = add(s, Composite(n_components=0))
+                s.commit()
+                loader = Loader(s, 'Test', add_serial=False)
+                loader.add('x', None, None, source, 1.0,
+                           local_date_to_time(to_date('2018-03-05')) + dt.timedelta(hours=12),
+                           StatisticJournalFloat, description='x')
+                loader.load()
+                self.assertIsNone(DiaryModel.get(s, day, date))
+                self.assertIsNone(DiaryModel.get(s, Schedule('m'), to_date('2018-03-01')))
+                read_model(s, 'd', date, save=False)
+                self.assertIsNone(DiaryModel.get(s, day, date))
+                read_model(s, 'd', date)
+                self.assertIsNotNone(DiaryModel.get(s, day, date))
+
+    def test_missing_model_table(self):
+        # databases created before diary_model was added
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5', configurator=default)
+        config.db.engine.execute(f'drop table {DiaryModel.__tablename__}')
+        config = bootstrap_db(user, m(V), '5')  # a new engine
+        date, day = to_date('2020-01-01'), Schedule('d')
+        with config.db.session_context() as s:
+            source = add(s, Composite(n_components=0))
+            s.commit()
+            # marking dirty pages is skipped
+            loader = Loader(s, 'Test', add_serial=False)
+            loader.add('x', None, None, source, 1.0, dt.datetime(2020, 1, 1, 12, tzinfo=dt.timezone.utc),
+                       StatisticJournalFloat, description='x')
+            loader.load()
+            # pages are built, but not saved
+            model = read_model(s, 'd', date)
+            self.assertEqual(dumps(model), dumps(build_model(s, day, date)))
+            self.assertFalse(DiaryModel.available(s))
+            self.assertIsNone(DiaryModel.get(s, day, date))
+            # the table is added after processing
+            refresh_models(s)
+            self.assertTrue(DiaryModel.available(s))
+            read_model(s, 'd', date)
+            self.assertIsNotNone(DiaryModel.get(s, day, date))
@@ -0,0 +1,195 @@
+from collections import defaultdict
+from itertools import groupby
+from logging import getLogger
+from random import seed, uniform
+from time import perf_counter
+
+from psutil import Process
+
+from ch2.commands.args import BASE
+from ch2.lib.data import kargs_to_attr
+from ch2.pipeline.calculate.nearby import SimilarityCalculator
+from ch2.rtree import CQRTree, CSTRTree, MatchType
+from ch2.rtree.grid import SGrid
+from ch2.rtree.spherical import SQRTree, SSTRTree
+from tests import LogTestCase
+
+log = getLogger(__name__)
+
+
+def random_tracks(n_tracks, n_points, lon=-70.6, lat=-33.45, size=0.1, step=1e-4):
+    # random walks, starting within a (city-sized) square
+    items = []
+    for i_track in range(n_tracks):
+        x, y = lon + uniform(-size, size), lat + uniform(-size, size)
+        for i_point in range(n_points):
+            x, y = x + uniform(-step, step), y + uniform(-step, step)
+            items.append(([(x, y)], i_track))
+    return items
+
+
+class TrackSimilarity(SimilarityCalculator):
+
+    def __init__(self, old, new, **kargs):
+        self.__tracks = {False: old, True: new}
+        super().__init__(kargs_to_attr(args={BASE: None}), owner_in='test', fraction=1, **kargs)
+
+    def _aj_lon_lat(self, s, new=True):
+        for points, aj_id in self.__tracks[new]:
+            for lon, lat in points:
+                yield aj_id, lon, lat
+
+
+def single_tree_overlaps(old, new, border=150):
+    # the original calculation, with all points in a single tree
+    tree = SQRTree(default_match=MatchType.OVERLAP, default_border=border)
+    n_points, n_overlaps = defaultdict(lambda: 0), defaultdict(lambda: defaultdict(lambda: 0))
+    for points, aj_id in old:
+        tree[points] = aj_id
+        n_points[aj_id] += 1
+    for aj_id_in, items in groupby(new, key=lambda item: item[1]):
+        items, seen_posns = list(items), set()
+        for points, _ in items:
+            for other_posn, aj_id_out in tree.get_items(points):
+                if other_posn not in seen_posns:
+                    n_overlaps[min(aj_id_in, aj_id_out)][max(aj_id_in, aj_id_out)] += 1
+                    seen_posns.add(other_posn)
+        for points, _ in items:
+            tree[points] = aj_id_in
+            n_points[aj_id_in] += 1
+    return n_points, n_overlaps
+
+
+def plain(n_overlaps):
+    return {lo: dict(his) for lo, his in n_overlaps.items()}
+
+
+def rss():
+    return Process().memory_info().rss
+
+
+def random_items(n, size=100, width=1):
+    items = []
+    for i in range(n):
+        x, y = uniform(0, size), uniform(0, size)
+        if i % 2:
+            items.append(([(x, y)], i))
+        else:
+            items.append(([(x, y), (x + uniform(0, width), y + uniform(0, width))], i))
+    return items
+
+
+class TestRTree(LogTestCase):
+
+    def assert_same(self, tree, packed, points, **kargs):
+        self.assertEqual(sorted(tree.get_items(points, **kargs)), sorted(packed.get_items(points, **kargs)))
+
+    def test_match(self):
+        seed(1)
+        items = random_items(1000)
+        tree, packed = CQRTree(items), CSTRTree(items, max_entries=4)
+        self.assertEqual(len(tree), len(packed))
+        self.assertEqual(sorted(tree.items()), sorted(packed.items()))
+        self.assertEqual(tree.global_mbr, packed.global_mbr)
+        self.assertTrue(packed.height > 1)
+        for points, value in items[:100]:
+            for match in MatchType:
+                self.assert_same(tree, packed, points, match=match)
+                self.assert_same(tree, packed, points, match=match, border=3)
+                self.assert_same(tree, packed, points, match=match, value=value)
+            self.assertTrue(points in packed)
+        self.assertFalse([(-1, -1)] in packed)
+        self.assertEqual(list(CSTRTree().get([(1, 1)])), [])
+        for tree_or_packed in (tree, packed):
+            for match in MatchType:
+                for value in (None, 7):
+                    queries = [points for points, _ in items[:50]] + [[(-1, -1)]]
+                    kargs = dict(match=match, border=2, value=value)
+                    self.assertEqual(sorted((i, item) for i, points in enumerate(queries)
+                                            for item in tree_or_packed.get_items(points, **kargs)),
+                                     sorted(tree_or_packed.get_all_items(queries, **kargs)))
+        packed.add_all(random_items(10))
+        self.assertEqual(len(packed), 1010)
+
+    def timed_count(self, results):
+        # results are counted, not saved (saving many tuples triggers garbage collection, which dominates timing)
+        start = perf_counter()
+        n = 0
+        for _ in results:
+            n += 1
+        return perf_counter() - start, n
+
+    def test_large(self):
+        seed(2)
+        # (lon, lat) points, as in SimilarityCalculator
+        items = [([(lon, lat)], i // 1000) for i, (lon, lat) in
+                 enumerate((uniform(-2.1, -2.0), uniform(51.0, 51.1)) for _ in range(30000))]
+        queries = [points for points, _ in items[::100]]
+        tree = SQRTree(default_match=MatchType.OVERLAP, default_border=150)
+        for points, value in items:
+            tree[points] = value
+        packed = SSTRTree(items, default_match=MatchType.OVERLAP, default_border=150)
+        self.assertEqual([sorted(tree.get_items(points)) for points in queries],
+                         [sorted(packed.get_items(points)) for points in queries])
+        # a track of nearby points, as for a new activity
+        track = [[(-2.05 + i * 1e-5, 51.05 + i * 1e-5)] for i in range(500)]
+        for t in (tree, packed):
+            expected = sorted((i, item) for i, points in enumerate(track) for item in t.get_items(points))
+            self.assertTrue(expected)
+            self.assertEqual(expected, sorted(t.get_all_items(track)))
+
+    def test_grid(self):
+        seed(3)
+        items = random_tracks(10, 300, step=1e-3)
+        tree = SQRTree(items, default_match=MatchType.OVERLAP, default_border=150)
+        grid = SGrid(items, default_match=MatchType.OVERLAP, default_border=150)
+        self.assertEqual(len(tree), len(grid))
+        queries = [points for points, _ in random_tracks(3, 100, step=1e-3)] + [[(0, 0)]]
+        for kargs in (dict(), dict(border=0), dict(border=500), dict(value=3)):
+            for points in queries:
+                self.assertEqual(sorted(tree.get(points, **kargs)), sorted(grid.get(points, **kargs)))
+            self.assertEqual(sorted((i, value) for i, (_, value) in tree.get_all_items(queries, **kargs)),
+                             sorted((i, value) for i, (_, value) in grid.get_all_items(queries, **kargs)))
+        for points, value in items[::50]:
+            self.assertTrue((tuple(points), value) in grid.get_items(points))
+        with self.assertRaisesRegex(Exception, 'OVERLAP'):
+            list(grid.get(queries[0], match=MatchType.EQUALS))
+
+    def test_grid_speed(self):
+        seed(4)
+        # tracks from a common centre, crossing a few km
+        items = random_tracks(20, 1000, size=0.03, step=2e-4)
+        probes = [points for points, _ in random_tracks(5, 200, size=0.03, step=2e-4)]
+        results = []
+        for cls in (SGrid, SQRTree):  # grid first, so that it cannot reuse memory freed by the tree
+            before = rss()
+            start = perf_counter()
+            index = cls(default_match=MatchType.OVERLAP, default_border=150)
+            for points, value in items:
+                index[points] = value
+            build = perf_counter() - start
+            memory = rss() - before
+            one, n = self.timed_count(item for points in probes for item in index.get_items(points))
+            many, _ = self.timed_count(index.get_all_items(probes))
+            results.append(n)
+            log.info(f'{cls.__name__}: {len(items)} points, build {build:.2f}s, RSS {memory / 1e6:.1f}MB; '
+                     f'{len(probes)} probes ({n} results) one at a time {one:.3f}s, batched {many:.3f}s')
+            del index
+        self.assertEqual(results[0], results[1])
+
+    def test_similarity(self):
+        seed(5)
+        # old and new activities around a common centre (far enough south that planes differ)
+        old = random_tracks(5, 300, size=0.01, step=5e-4)
+        new = [(points, i_track + 5) for points, i_track in random_tracks(5, 300, size=0.01, step=5e-4)]
+        n_points, n_overlaps = single_tree_overlaps(old, new)
+        self.assertTrue(sum(n for his in n_overlaps.values() for n in his.values()))
+        for grid in (False, True):
+            calculator = TrackSimilarity(old, new, grid=grid)
+            n_points_calc, n_overlaps_calc = defaultdict(lambda: 0), defaultdict(lambda: defaultdict(lambda: 0))
+            first, later = calculator._prepare(None, n_points_calc, 30000)
+            new_ids, affected_ids = calculator._count_overlaps(None, first, later, n_points_calc,
+                                                               n_overlaps_calc, 10000)
+            self.assertEqual(list(range(5, 10)), new_ids)
+            self.assertEqual(dict(n_points), dict(n_points_calc))
+            self.assertEqual(plain(n_overlaps), plain(n_overlaps_calc))
@@ -1,14 +1,22 @@
 
 from contextlib import contextmanager
+from functools import lru_cache
 from logging import getLogger
+from os import listdir, remove
+from os.path import join
+from random import seed, uniform
+from tempfile import TemporaryDirectory
+from zipfile import ZipFile
+
+import numpy as np
 
 from ch2 import constants
 from ch2.commands.args import V, DEV, FORCE, bootstrap_db
 from ch2.common.args import mm, m
 from ch2.config.profiles.default import default
-from ch2.srtm.bilinear import bilinear_elevation_from_constant
-from ch2.srtm.file import SRTM1_DIR_CNAME
-from ch2.srtm.spline import spline_elevation_from_constant
+from ch2.srtm.bilinear import bilinear_elevation_from_constant, BilinearElevation
+from ch2.srtm.file import SRTM1_DIR_CNAME, SAMPLES, EXTN, TileStore
+from ch2.srtm.spline import spline_elevation_from_constant, SplineElevation, WindowedSplineElevation
 from tests import LogTestCase, random_test_user
 
 log = getLogger(__name__)
@@ -331,3 +339,61 @@ class TestSortem(LogTestCase):
                         x = lon + di * delta
                         self.assertAlmostEqual(oracle.elevation(y, x), 645, places=2,
                                                msg='dj %d; di %d' % (dj, di))
+
+    def test_vector(self):
+        # synthetic tiles (a smooth surface, different for each tile) so that no data are needed
+        @lru_cache(4)
+        def reader(dir, flat, flon):
+            y, x = np.mgrid[0:SAMPLES, 0:SAMPLES] / (SAMPLES - 1)
+            return (1000 + 500 * np.sin(3 * x + flon) * np.cos(2 * y + flat) + 37 * x * y).astype('>i2')
+        oracle = BilinearElevation('synthetic', reader=reader)
+        seed(1)
+        # a track that crosses tile boundaries
+        lats = np.array([-33.9 - 0.2 * i / 10000 + uniform(0, 1e-4) for i in range(10000)])
+        lons = np.array([-70.95 - 0.1 * i / 10000 + uniform(0, 1e-4) for i in range(10000)])
+        lats[::100] = np.nan
+        expected = [np.nan if np.isnan(lat) else oracle.elevation(lat, lon) for lat, lon in zip(lats, lons)]
+        np.testing.assert_array_equal(expected, oracle.elevations(lats, lons))
+        self.assertIsNone(BilinearElevation(None).elevations(lats, lons))
+
+    def test_tile_store(self):
+        with TemporaryDirectory() as dir:
+            tiles = {}
+            for flat, flon in ((-34, -71), (-34, -72), (-35, -71)):
+                root = '%s%02d%s%03d' % ('S' if flat < 0 else 'N', abs(flat), 'W' if flon < 0 else 'E', abs(flon))
+                tiles[(flat, flon)] = (np.arange(SAMPLES * SAMPLES) % 4099 + flat * flon).astype('>i2')
+                with ZipFile(join(dir, root + EXTN), 'w') as zip:
+                    zip.writestr(root + '.hgt', tiles[(flat, flon)].tobytes())
+            store = TileStore(dir, max_tiles=2)
+            for flat, flon in ((-34, -71), (-34, -72), (-34, -71), (-35, -71), (-34, -72)):
+                data = store.read(flat, flon)
+                self.assertIsInstance(data.base, np.memmap)
+                expected = np.flip(tiles[(flat, flon)].reshape((SAMPLES, SAMPLES)), 0)
+                np.testing.assert_array_equal(expected, data)
+            # -34,-72 was evicted by -35,-71 (-34,-71 had been used more recently)
+            self.assertEqual((store.hits, store.misses), (1, 4))
+            # zips are unpacked once - a new store (eg another process) uses the unpacked files
+            for name in listdir(dir):
+                if name.endswith(EXTN): remove(join(dir, name))
+            store = TileStore(dir)
+            np.testing.assert_array_equal(store.read(-35, -71)[-1, :3], tiles[(-35, -71)][:3])
+            with self.assertRaisesRegex(Exception, 'Missing'):
+                store.read(0, 0)
+
+    def test_windowed_spline(self):
+        with TemporaryDirectory() as dir:
+            y, x = np.mgrid[0:SAMPLES, 0:SAMPLES] / (SAMPLES - 1)
+            h = 1000 + 500 * np.sin(7 * x) * np.cos(5 * y) + 20 * np.sin(300 * x * y)
+            with open(join(dir, 'S34W071.hgt'), 'wb') as output:
+                output.write(np.flip(h, 0).astype('>i2').tobytes())
+            seed(1)
+            lats = np.array([-33.9 - 0.05 * i / 1000 + uniform(0, 1e-4) for i in range(1000)])
+            lons = np.array([-70.95 - 0.02 * i / 1000 + uniform(0, 1e-4) for i in range(1000)])
+            windowed = WindowedSplineElevation(dir)
+            elevations = windowed.elevations(lats, lons)
+            self.assertEqual(windowed.hits, 0)
+            self.assertTrue(0 < windowed.misses < 10)
+            self.assertAlmostEqual(windowed.elevation(lats[0], lons[0]), elevations[0])
+            self.assertEqual(windowed.hits, 1)
+            expected = SplineElevation(dir).elevations(lats, lons)
+            np.testing.assert_allclose(expected, elevations, atol=1e-3)
@@ -0,0 +1,106 @@
+import datetime as dt
+from logging import getLogger
+
+from ch2.commands.args import V, bootstrap_db
+from ch2.common.args import m
+from ch2.config.profiles.default import default
+from ch2.pipeline.calculate.summary import SummaryCalculator
+from ch2.pipeline.loader import Loader
+from ch2.sql.tables.activity import ActivityGroup
+from ch2.sql.tables.source import Composite, Interval
+from ch2.sql.tables.statistic import StatisticJournal, StatisticJournalFloat, StatisticJournalInteger, \
+    StatisticName, StatisticMeasure
+from ch2.sql.utils import add
+from tests import LogTestCase, random_test_user
+
+log = getLogger(__name__)
+
+
+class TestSummary(LogTestCase):
+
+    N_DAYS = 30
+
+    def load(self, config):
+        start = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        with config.db.session_context() as s:
+            groups = [None] + s.query(ActivityGroup).order_by(ActivityGroup.id).all()[:2]
+            sources = [add(s, Composite(n_components=0, activity_group=group)) for group in groups]
+            s.commit()
+            loader = Loader(s, 'Data', add_serial=False)
+            for i in range(self.N_DAYS * 24):
+                time = start + dt.timedelta(hours=i)
+                source = sources[i % len(sources)]
+                loader.add('float', None, 'max,min,sum,cnt,avg,msr', source, (i * 7 % 13) / 3, time,
+                           StatisticJournalFloat, description='float')
+                loader.add('integer', None, 'max,sum,avg', source, i % 17, time,
+                           StatisticJournalInteger, description='integer')
+            loader.load()
+        return [str(start.date() + dt.timedelta(days=i)) for i in range(self.N_DAYS)]
+
+    def read(self, config, owner):
+        with config.db.session_context() as s:
+            values = sorted((interval.start, interval.activity_group_id or 0, journal.statistic_name.name,
+                             round(journal.value, 6))
+                            for journal, interval in
+                            s.query(StatisticJournal, Interval).
+                            join(StatisticName, StatisticJournal.statistic_name_id == StatisticName.id).
+                            join(Interval, StatisticJournal.source_id == Interval.id).
+                            filter(StatisticName.owner == owner).all())
+            measures = sorted((interval.start, interval.activity_group_id or 0, measure.statistic_journal_id,
+                               measure.rank, measure.percentile)
+                              for measure, interval in
+                              s.query(StatisticMeasure, Interval).
+                              join(Interval, StatisticMeasure.source_id == Interval.id).
+                              filter(Interval.owner == owner).all())
+            return values, measures
+
+    def test_set_based(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5', configurator=default)
+        missing = self.load(config)
+        per_interval = SummaryCalculator(config, schedule='d', owner_out='PerInterval')
+        for missed in missing:
+            per_interval._run_one(missed)
+        set_based = SummaryCalculator(config, schedule='d', owner_out='SetBased')
+        set_based._run_many(missing)
+        (expected_values, expected_measures), (values, measures) = \
+            self.read(config, 'PerInterval'), self.read(config, 'SetBased')
+        self.assertTrue(expected_values)
+        self.assertTrue(expected_measures)
+        self.assertEqual(expected_values, values)
+        self.assertEqual(expected_measures, measures)
+
+    def test_measures(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5', configurator=default)
+        start = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+        values = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 58, 97, 93, 23, 84, 62, 64, 33, 83, 27]
+        with config.db.session_context() as s:
+            source = add(s, Composite(n_components=0))
+            s.commit()
+            loader = Loader(s, 'Data', add_serial=False)
+            for i, value in enumerate(values):
+                loader.add('float', None, 'max,msr', source, value, start + dt.timedelta(minutes=i),
+                           StatisticJournalFloat, description='float')
+            loader.load()
+        SummaryCalculator(config, schedule='d', owner_out='Measures')._run_many([str(start.date())])
+        with config.db.session_context() as s:
+            measures = sorted([(measure.statistic_journal.value, measure.rank, measure.percentile, measure.quartile)
+                               for measure in s.query(StatisticMeasure).all()], key=lambda measure: measure[0])
+        n = len(values)
+        ranks = [1 + sum(other > value for other in values) for value in values]
+        self.assertEqual([(value, rank, round(100 * (n - rank) / (n - 1), 6))
+                          for value, rank in sorted(zip(values, ranks))],
+                         [(value, rank, round(percentile, 6)) for value, rank, percentile, _ in measures])
+        # positions 0, 4.75, 9.5, 14.25 and 19 from the top
+        self.assertEqual([(97, 0), (62, 1), (9, 2), (4, 3), (1, 4)],
+                         [(measure[0], measure[3]) for measure in reversed(measures) if measure[3] is not None])
+
+    def test_missing(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5', configurator=default)
+        days = self.load(config)
+        calculator = SummaryCalculator(config, schedule='d')
+        self.assertEqual([missed.strip('"') for missed in calculator.missing()], days)
+        calculator._run_many(days[5:10] + days[20:])
+        self.assertEqual([missed.strip('"') for missed in calculator.missing()], days[:5] + days[10:20])